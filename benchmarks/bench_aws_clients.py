@@ -0,0 +1,175 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+"""
+Compare the per-invocation cost of creating AWS clients in the handlers.
+
+"legacy" reproduces the previous handler code. invokebda created a
+bedrock-data-automation-runtime and an STS client and called
+GetCallerIdentity on every invocation. analyzepdf created an S3 and a
+DynamoDB client for every page and an SQS client for every record.
+"pooled" uses multipagepdfbda_common.aws_clients. It creates each client once
+per execution environment and reads the account id from the function ARN.
+
+"warm" is the mean time of one invocation of both handlers in a process that
+has already served one. "cold" starts a fresh interpreter per run and times
+the imports and the first invocation, as in a new execution environment.
+
+No request leaves the machine. GetCallerIdentity is answered locally after
+sleeping --sts-latency-ms, which stands in for the round trip. The effect of
+keep-alive and pool size only shows against real endpoints, so it is not
+measured here. Requires boto3.
+
+Usage:
+    python benchmarks/bench_aws_clients.py --invocations 50 --pages 10 --cold-runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "deploy_code", "multipagepdfbda_common", "python"))
+
+ACCOUNT = "123456789012"
+REGION = "us-east-1"
+CONTEXT = SimpleNamespace(invoked_function_arn=f"arn:aws:lambda:{REGION}:{ACCOUNT}:function:multipagepdfbda_invoke_bda")
+
+# Clients can be created without real credentials as long as none are resolved from the network
+BENCH_ENV = {
+    "AWS_REGION": REGION,
+    "AWS_DEFAULT_REGION": REGION,
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_EC2_METADATA_DISABLED": "true",
+}
+
+
+class StsStub:
+    """Answers GetCallerIdentity locally after a simulated round trip, and counts the calls."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        http = SimpleNamespace(status_code=200, headers={})
+        return http, {
+            "Account": ACCOUNT,
+            "Arn": f"arn:aws:iam::{ACCOUNT}:user/benchmark",
+            "UserId": "benchmark",
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+        }
+
+
+def load(latency):
+    """Import boto3 and the layer, routing STS to a local stub for both of their sessions."""
+    import boto3
+    from multipagepdfbda_common import aws_clients
+
+    stub = StsStub(latency)
+    boto3.setup_default_session()
+    for session in (boto3.DEFAULT_SESSION, aws_clients._get_session()):
+        session._session.register("before-call.sts.GetCallerIdentity", stub)
+    return boto3, aws_clients, stub
+
+
+def legacy_invocation(boto3, pages):
+    bda = boto3.client('bedrock-data-automation-runtime', region_name=REGION)
+    sts = boto3.client('sts')
+    account = sts.get_caller_identity().get('Account')
+    arn = f"arn:aws:bedrock:{REGION}:{account}:data-automation-project/benchmark"
+    for _ in range(pages):
+        boto3.client('s3')
+        boto3.client('dynamodb')
+    boto3.client('sqs')
+    return bda, arn
+
+
+def pooled_invocation(aws_clients, pages):
+    bda = aws_clients.get_client('bedrock-data-automation-runtime')
+    arn = aws_clients.build_arn("bedrock", "data-automation-project/benchmark", CONTEXT)
+    for _ in range(pages):
+        aws_clients.get_client('s3')
+        aws_clients.get_client('dynamodb')
+    aws_clients.get_client('sqs')
+    return bda, arn
+
+
+def invoke(strategy, boto3, aws_clients, pages):
+    if strategy == "legacy":
+        return legacy_invocation(boto3, pages)
+    return pooled_invocation(aws_clients, pages)
+
+
+def run_warm(strategy, args):
+    boto3, aws_clients, stub = load(args.sts_latency_ms / 1000)
+    invoke(strategy, boto3, aws_clients, args.pages)
+    stub.calls = 0
+    start = time.perf_counter()
+    for _ in range(args.invocations):
+        invoke(strategy, boto3, aws_clients, args.pages)
+    elapsed = time.perf_counter() - start
+    return elapsed / args.invocations, stub.calls / args.invocations
+
+
+def run_cold_child(strategy, args):
+    start = time.perf_counter()
+    boto3, aws_clients, stub = load(args.sts_latency_ms / 1000)
+    invoke(strategy, boto3, aws_clients, args.pages)
+    print(time.perf_counter() - start)
+
+
+def run_cold(strategy, args):
+    env = dict(os.environ, **BENCH_ENV)
+    command = [sys.executable, __file__, "--cold-child", strategy, "--pages", str(args.pages),
+               "--sts-latency-ms", str(args.sts_latency_ms)]
+    times = [float(subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout)
+             for _ in range(args.cold_runs)]
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invocations", type=int, default=50, help="warm invocations per strategy")
+    parser.add_argument("--pages", type=int, default=10, help="pages handled by the analyzepdf invocation")
+    parser.add_argument("--cold-runs", type=int, default=5, help="fresh interpreters per strategy; the median is shown")
+    parser.add_argument("--sts-latency-ms", type=float, default=20, help="simulated GetCallerIdentity round trip")
+    parser.add_argument("--cold-child", choices=("legacy", "pooled"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.environ.update(BENCH_ENV)
+
+    if args.cold_child:
+        run_cold_child(args.cold_child, args)
+        return
+
+    print(f"pages per invocation: {args.pages}, simulated STS latency: {args.sts_latency_ms} ms")
+    print(f"{'strategy':>8} {'warm ms':>9} {'STS calls':>10} {'cold ms':>9}")
+    for strategy in ("legacy", "pooled"):
+        warm, sts_calls = run_warm(strategy, args)
+        cold = run_cold(strategy, args)
+        print(f"{strategy:>8} {warm * 1000:>9.2f} {sts_calls:>10.1f} {cold * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
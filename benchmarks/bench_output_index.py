@@ -0,0 +1,133 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+"""
+Compare S3 request count and latency of wrapup's output discovery.
+
+"probe" reproduces the previous strategy: a HEAD request per candidate
+ai/human key in get_all_possible_files and again before every get_object in
+curate_data. "listing" is the ListObjectsV2 index used by gather_data today.
+
+Each simulated S3 request sleeps for --latency-ms to stand in for the round trip.
+
+Usage:
+    python benchmarks/bench_output_index.py --pages 100 500 --latency-ms 15
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "deploy_code", "multipagepdfbda_wrapup"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "deploy_code", "multipagepdfbda_common", "python"))
+
+import gather_data  # noqa: E402
+
+DOCUMENT_ID = "0123456789abcdef0123456789abcdef"
+BUCKET = "benchmark-bucket"
+
+
+class CountingS3:
+    """Minimal S3 stand-in that counts requests and simulates round-trip latency."""
+
+    def __init__(self, keys, latency):
+        self.keys = sorted(keys)
+        self.latency = latency
+        self.requests = {}
+
+    def _request(self, operation):
+        self.requests[operation] = self.requests.get(operation, 0) + 1
+        time.sleep(self.latency)
+
+    def head_object(self, Bucket, Key):
+        self._request("HeadObject")
+        return Key in self.keys
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        matching = [key for key in self.keys if key.startswith(Prefix)]
+        for start in range(0, max(len(matching), 1), 1000):
+            self._request("ListObjectsV2")
+            yield {"Contents": [{"Key": key} for key in matching[start:start + 1000]]}
+
+
+def build_keys(pages, reviewed_ratio):
+    keys = []
+    for page in range(pages):
+        base_key = f"wip/{DOCUMENT_ID}/{page}.png"
+        keys.append(base_key)
+        keys.append(base_key + gather_data.AI_OUTPUT_SUFFIX)
+        if page < pages * reviewed_ratio:
+            keys.append(base_key + gather_data.HUMAN_DELTA_SUFFIX)
+    return keys
+
+
+def discover_by_probing(client, image_keys):
+    base_keys = [f"wip/{DOCUMENT_ID}/{item}.png" for item in image_keys]
+    found = [
+        key
+        for base_key in base_keys
+        for key in (base_key + gather_data.AI_OUTPUT_SUFFIX, base_key + gather_data.HUMAN_DELTA_SUFFIX)
+        if client.head_object(Bucket=BUCKET, Key=key)
+    ]
+    # curate_data probed the first AI key and every human key a second time
+    client.head_object(Bucket=BUCKET, Key=base_keys[0] + gather_data.AI_OUTPUT_SUFFIX)
+    for base_key in base_keys:
+        client.head_object(Bucket=BUCKET, Key=base_key + gather_data.HUMAN_DELTA_SUFFIX)
+    return found
+
+
+def discover_by_listing(client, image_keys):
+    gather_data.s3_client = client
+    output_index = gather_data.build_output_index(BUCKET, DOCUMENT_ID)
+    event = {"bucket": BUCKET, "id": DOCUMENT_ID, "key": "uploads/doc.pdf", "image_keys": image_keys}
+    files, _, _ = gather_data.get_all_possible_files(event, output_index)
+    return files
+
+
+def run(pages, latency, reviewed_ratio):
+    keys = build_keys(pages, reviewed_ratio)
+    image_keys = [str(page) for page in range(pages)]
+    rows = []
+    for name, discover in (("probe", discover_by_probing), ("listing", discover_by_listing)):
+        client = CountingS3(keys, latency)
+        start = time.perf_counter()
+        found = discover(client, image_keys)
+        elapsed = time.perf_counter() - start
+        rows.append((name, len(found), sum(client.requests.values()), elapsed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--latency-ms", type=float, default=15.0)
+    parser.add_argument("--reviewed-ratio", type=float, default=1.0, help="fraction of pages with a human output")
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'strategy':>8} {'outputs':>8} {'requests':>9} {'seconds':>9}")
+    for pages in args.pages:
+        for name, found, requests, elapsed in run(pages, args.latency_ms / 1000, args.reviewed_ratio):
+            print(f"{pages:>6} {name:>8} {found:>8} {requests:>9} {elapsed:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
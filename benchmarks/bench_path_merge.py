@@ -0,0 +1,197 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+"""
+Compare wrapup's merge of human corrections into large nested BDA outputs.
+
+"legacy" reproduces the previous update_with_flattened_values, called once
+per page with its logging written line by line to /dev/null. "trie" compiles the corrections
+of all pages with path_merge.PathTrie and merges them in one traversal;
+"cold" includes parsing every path, "warm" reuses the per-container parse cache.
+
+"applied" counts corrections that landed at the right place. The legacy merge
+cannot address list items, so corrections to table rows are written under
+keys such as "records[3]" instead.
+
+Usage:
+    python benchmarks/bench_path_merge.py --objects 50 --fields 20 --tables 5 --rows 200 --columns 8
+"""
+
+import argparse
+import contextlib
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "deploy_code", "multipagepdfbda_wrapup"))
+
+from path_merge import PathTrie, parse_path  # noqa: E402
+
+
+def update_with_flattened_values(structure, flattened_values):
+    """Previous merge from multipagepdfbda_wrapup/lambda_function.py, unchanged."""
+    print(f"Updating structure with flattened values: {json.dumps(flattened_values, indent=2)}")
+
+    for key, value in flattened_values.items():
+        if '/' not in key and '.' not in key:
+            if key in structure:
+                print(f"Updating direct key: {key} = {value}")
+                structure[key] = value
+            else:
+                print(f"Creating new direct key: {key} = {value}")
+                structure[key] = value
+
+    for key, value in flattened_values.items():
+        if '/' in key or '.' in key:
+            parts = key.split('/') if '/' in key else key.split('.')
+            current = structure
+            path_so_far = []
+
+            for i, part in enumerate(parts):
+                path_so_far.append(part)
+
+                if i == len(parts) - 1:
+                    print(f"Setting value at {'.'.join(path_so_far)} = {value}")
+                    current[part] = value
+                else:
+                    if part not in current:
+                        print(f"Creating missing structure for: {'.'.join(path_so_far)}")
+                        current[part] = {}
+                    elif not isinstance(current[part], dict):
+                        print(f"Converting to dict at {'.'.join(path_so_far)}")
+                        current[part] = {}
+                    current = current[part]
+
+
+def build_document(objects, fields, tables, rows, columns):
+    """A BDA-style inference result with nested objects and tables, plus all of its leaf paths."""
+    document, paths = {}, []
+    for o in range(objects):
+        document[f"section_{o}"] = {f"field_{f}": f"ai {o}.{f}" for f in range(fields)}
+        paths += [f"section_{o}.field_{f}" for f in range(fields)]
+    for t in range(tables):
+        document[f"table_{t}"] = [{f"column_{c}": f"ai {t}.{r}.{c}" for c in range(columns)} for r in range(rows)]
+        paths += [f"table_{t}[{r}].column_{c}" for r in range(rows) for c in range(columns)]
+    return document, paths
+
+
+def build_pages(paths, pages, ratio, seed):
+    """Spread a random sample of corrections over the human review pages."""
+    rng = random.Random(seed)
+    corrected = rng.sample(paths, int(len(paths) * ratio))
+    page_answers = [{} for _ in range(pages)]
+    for index, path in enumerate(corrected):
+        page_answers[index % pages][path] = f"human {index}"
+    return page_answers
+
+
+def count_applied(document, page_answers):
+    applied = 0
+    for answers in page_answers:
+        for path, value in answers.items():
+            node = document
+            try:
+                for segment in parse_path(path):
+                    node = node[segment]
+            except (KeyError, IndexError, TypeError):
+                continue
+            applied += node == value
+    return applied
+
+
+class LogSink:
+    """
+    Line-buffered /dev/null that counts the printed bytes.
+
+    The Lambda runtime forwards stdout to CloudWatch Logs line by line, so
+    each print costs a write; the byte count is the log volume it ingests.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.file = open(os.devnull, "w", buffering=1)
+
+    def write(self, text):
+        self.bytes += len(text)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+
+def merge_legacy(document, page_answers):
+    sink = LogSink()
+    with contextlib.redirect_stdout(sink):
+        for answers in page_answers:
+            update_with_flattened_values(document, answers)
+    sink.file.close()
+    return sink.bytes
+
+
+def merge_trie(document, page_answers):
+    trie, _ = PathTrie.compile((path, value) for answers in page_answers for path, value in answers.items())
+    conflicts = trie.merge(document)
+    # wrapup logs one summary line plus one line per skipped correction
+    return len(f"Merged corrections from {len(page_answers)} pages, {len(conflicts)} skipped\n")
+
+
+def run(args):
+    document, paths = build_document(args.objects, args.fields, args.tables, args.rows, args.columns)
+    page_answers = build_pages(paths, args.pages, args.ratio, args.seed)
+    corrections = sum(len(answers) for answers in page_answers)
+
+    rows = []
+    for name, merge, cold in (("legacy", merge_legacy, False), ("trie cold", merge_trie, True), ("trie warm", merge_trie, False)):
+        best = None
+        for _ in range(args.repeat):
+            target = copy.deepcopy(document)
+            if cold:
+                parse_path.cache_clear()
+            start = time.perf_counter()
+            log_bytes = merge(target, page_answers)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        rows.append((name, corrections, count_applied(target, page_answers), best, log_bytes))
+    return len(paths), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=50, help="nested objects in the document")
+    parser.add_argument("--fields", type=int, default=20, help="fields per nested object")
+    parser.add_argument("--tables", type=int, default=5, help="list fields in the document")
+    parser.add_argument("--rows", type=int, default=200, help="rows per list field")
+    parser.add_argument("--columns", type=int, default=8, help="fields per row")
+    parser.add_argument("--pages", type=int, default=20, help="human review pages the corrections come from")
+    parser.add_argument("--ratio", type=float, default=0.3, help="fraction of fields corrected")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    leaves, rows = run(args)
+    print(f"document leaves: {leaves}, pages: {args.pages}")
+    print(f"{'strategy':>10} {'corrections':>12} {'applied':>8} {'seconds':>9} {'log KiB':>9}")
+    for name, corrections, applied, elapsed, log_bytes in rows:
+        print(f"{name:>10} {corrections:>12} {applied:>8} {elapsed:>9.4f} {log_bytes / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+Scaling benchmarks of the Python stages, run with pytest-benchmark.
+
+Every case runs on synthetic BDA outputs of three sizes (SIZES), made with
+tools/offline_harness/fixtures.py, and is checked against a budget per
+field: the mean time of a call and the peak memory it allocates, divided
+by the fields of the segment. A budget per field holds at every size, so
+a stage that starts scaling worse than linearly fails at the larger sizes
+even when it still fits the small one.
+
+    confidence: process_explainability_info, create_a2i_input_content
+    wrapup:     create_csv, answers_from_delta, curate_data, and the merge
+                of review corrections (review_delta and path_merge), which
+                replaced update_with_flattened_values
+
+curate_data writes to the in-process S3 stand-in of the offline harness,
+so no request leaves the machine. Requires boto3, pytest and
+pytest-benchmark; this file is not collected by a plain pytest run.
+
+Usage:
+    python -m pytest benchmarks/bench_stage_scaling.py
+    python -m pytest benchmarks/bench_stage_scaling.py --benchmark-autosave
+    python -m pytest benchmarks/bench_stage_scaling.py --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEPLOY_CODE = os.path.join(REPO_ROOT, "deploy_code")
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(DEPLOY_CODE, "multipagepdfbda_common", "python"))
+sys.path.insert(0, os.path.join(DEPLOY_CODE, "multipagepdfbda_wrapup"))
+
+BENCH_ENV = {
+    "AWS_REGION": "us-east-1",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_EC2_METADATA_DISABLED": "true",
+    "metrics_sink": "off",
+    "LOG_LEVEL": "WARNING",
+}
+os.environ.update(BENCH_ENV)
+
+from multipagepdfbda_common import aws_clients  # noqa: E402
+from tools.offline_harness.fakes import FakeAws  # noqa: E402
+from tools.offline_harness.fixtures import synthetic_document  # noqa: E402
+
+# gather_data creates its S3 client on import, so the stand-ins go in first
+AWS = FakeAws(fixtures=lambda bucket, key: None, job_seconds=lambda fixture: 0, on_human_loop=lambda loop: None)
+aws_clients.set_factory(AWS)
+
+import gather_data  # noqa: E402
+from multipagepdfbda_common.s3_paths import HUMAN_DELTA_SUFFIX  # noqa: E402
+from review_delta import answers_from_delta, materialize_human_view  # noqa: E402
+
+
+def load_confidence():
+    path = os.path.join(DEPLOY_CODE, "multipagepdfbda_confidence", "lambda_function.py")
+    spec = importlib.util.spec_from_file_location("multipagepdfbda_confidence_lambda_function", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+confidence = load_confidence()
+
+BUCKET = "multipagepdfbda-benchmark"
+DOCUMENT_ID = "0123456789abcdef0123456789abcdef"
+THRESHOLD = 0.95
+
+# (pages, simple fields per page, line_items rows per page) of one segment
+SIZES = {
+    "small": (1, 20, 2),
+    "medium": (10, 40, 5),
+    "large": (50, 80, 10),
+}
+
+# Per field of the segment: (mean microseconds, peak allocated bytes). About
+# three times what a laptop measures at the large size, so only regressions
+# trip them. FIXED_* cover the cost that does not grow with the segment.
+BUDGETS = {
+    "process_explainability_info": (60, 6000),
+    "create_a2i_input_content": (3, 1000),
+    "create_csv": (5, 1000),
+    "answers_from_delta": (8, 1000),
+    "merge_corrections": (3, 200),
+    "curate_data": (10, 1500),
+}
+FIXED_MICROS = 500
+FIXED_BYTES = 256 * 1024
+
+# Share of the fields a reviewer corrected
+CORRECTED = 0.2
+
+
+class Segment:
+    """A synthetic segment and the inputs the stages derive from it."""
+
+    def __init__(self, pages, fields_per_page, line_items_per_page):
+        document = synthetic_document(
+            pages=pages,
+            fields_per_page=fields_per_page,
+            line_items_per_page=line_items_per_page,
+            low_confidence_rate=0.05,
+        )
+        self.custom_output = document["segments"][0]
+        self.custom_output["taskObject"] = f"s3://{BUCKET}/uploads/benchmark.pdf"
+        self.pages = list(range(pages))
+        processed = confidence.process_explainability_info(self.custom_output["explainability_info"], THRESHOLD)
+        self.all_fields = processed["all_fields"]
+        self.fields = len(self.all_fields)
+        self.inference_result = self.custom_output["inference_result"]
+
+    def page_corrections(self):
+        """Review deltas of every page, each correcting a CORRECTED share of its fields."""
+        reviewed, by_page = {}, {}
+        for index, field in enumerate(self.all_fields):
+            reviewed.setdefault(field["page"], []).append(field["field_name"])
+            if index % round(1 / CORRECTED) == 0:
+                by_page.setdefault(field["page"], []).append(
+                    {"field": field["field_name"], "old": field["value"], "new": f"{field['value']} (corrected)"}
+                )
+        return [
+            {"page": page, "reviewed_fields": len(reviewed[page]), "reviewed": reviewed[page], "changes": changes}
+            for page, changes in sorted(by_page.items())
+        ]
+
+
+@pytest.fixture(scope="module", params=list(SIZES), ids=list(SIZES))
+def segment(request):
+    return Segment(*SIZES[request.param])
+
+
+def peak_bytes(function, *args):
+    """Peak memory allocated by one call, as traced by tracemalloc."""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def check_budget(benchmark, name, segment, function, *args):
+    """Benchmark function(*args) and fail if it is over the budget of name for the segment."""
+    benchmark.extra_info["fields"] = segment.fields
+    benchmark(function, *args)
+    micros_per_field, bytes_per_field = BUDGETS[name]
+    peak = peak_bytes(function, *args)
+    benchmark.extra_info["peak_bytes"] = peak
+    bytes_budget = FIXED_BYTES + bytes_per_field * segment.fields
+    assert peak <= bytes_budget, f"{name} allocated {peak} bytes for {segment.fields} fields, budget {bytes_budget}"
+    # No stats when run with --benchmark-disable
+    if benchmark.stats is not None:
+        micros = benchmark.stats.stats.mean * 1e6
+        micros_budget = FIXED_MICROS + micros_per_field * segment.fields
+        assert micros <= micros_budget, f"{name} took {micros:.0f} us for {segment.fields} fields, budget {micros_budget}"
+
+
+def test_process_explainability_info(benchmark, segment):
+    check_budget(benchmark, "process_explainability_info", segment,
+                 confidence.process_explainability_info, segment.custom_output["explainability_info"], THRESHOLD)
+
+
+def test_create_a2i_input_content(benchmark, segment):
+    check_budget(benchmark, "create_a2i_input_content", segment,
+                 confidence.create_a2i_input_content, segment.custom_output, segment.all_fields)
+
+
+def test_create_csv(benchmark, segment):
+    check_budget(benchmark, "create_csv", segment, gather_data.create_csv, segment.inference_result, "ai", 0)
+
+
+def rebuild_answers(corrections, ai_data):
+    return [answers_from_delta(delta, ai_data) for delta in corrections]
+
+
+def test_answers_from_delta(benchmark, segment):
+    check_budget(benchmark, "answers_from_delta", segment,
+                 rebuild_answers, segment.page_corrections(), segment.inference_result)
+
+
+def test_merge_corrections(benchmark, segment):
+    check_budget(benchmark, "merge_corrections", segment,
+                 materialize_human_view, segment.inference_result, segment.page_corrections())
+
+
+def test_curate_data(benchmark, segment):
+    payload = {"id": DOCUMENT_ID, "bucket": BUCKET, "key": "uploads/benchmark.pdf"}
+    base_image_keys = [f"wip/{DOCUMENT_ID}/{page}.png" for page in segment.pages]
+    output_index = set(base_image_keys)
+    for delta in segment.page_corrections():
+        key = f"wip/{DOCUMENT_ID}/{delta['page']}.png{HUMAN_DELTA_SUFFIX}"
+        AWS.s3.put_object(Bucket=BUCKET, Key=key, Body=json.dumps(delta))
+        output_index.add(key)
+    check_budget(benchmark, "curate_data", segment, gather_data.curate_data,
+                 base_image_keys, payload, segment.pages, output_index, (0, segment.inference_result))
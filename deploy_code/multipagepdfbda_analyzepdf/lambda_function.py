@@ -18,7 +18,6 @@
 
 import copy
 import json
-import boto3
 import botocore
 import os
 import io
@@ -27,8 +26,19 @@ import tempfile
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
 
-s3_client = boto3.client('s3')
-sagemaker_a2i_runtime = boto3.client('sagemaker-a2i-runtime')
+from multipagepdfbda_common import checkpoint, inflight
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.metrics import blueprint_name, emits_metrics, get_metrics, size_bucket
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.s3_paths import AI_OUTPUT_SUFFIX, human_loop_name, page_image_key, to_s3_uri
+from multipagepdfbda_common.structured_log import get_logger
+from multipagepdfbda_common.timeline import record_span
+
+logger = get_logger()
+metrics = get_metrics()
+
+# Sort key of the per-document completion counter item in the callback table
+DOCUMENT_COUNTER_SORT_KEY = "document"
 
 def start_human_loop(human_loop_name, flow_definition_arn, input_content):
     """
@@ -41,7 +51,7 @@ def start_human_loop(human_loop_name, flow_definition_arn, input_content):
     dict: Response from the start_human_loop API call.
     """
     # Start the human loop
-    response = sagemaker_a2i_runtime.start_human_loop(
+    response = get_client('sagemaker-a2i-runtime').start_human_loop(
         HumanLoopName=human_loop_name,
         FlowDefinitionArn=flow_definition_arn,
         HumanLoopInput={
@@ -51,49 +61,33 @@ def start_human_loop(human_loop_name, flow_definition_arn, input_content):
     return response
 
 def write_ai_response_to_bucket(bucket, s3location, data):
-    client = boto3.client('s3')
-    response = client.put_object(
+    response = get_client('s3').put_object(
         Body = json.dumps(data),
         Bucket = bucket,
-        Key = s3location + "/ai/output.json"
+        Key = s3location + AI_OUTPUT_SUFFIX
     )
     return response
 
-def dump_task_token_in_dynamodb(event, total_pages=1):
+def register_page_with_document(event):
     """
-    Store task token and document metadata in DynamoDB
-    
-    Parameters:
-    event (dict): The event containing human_loop_id, process_key, and token
-    total_pages (int): Total number of pages in the document
+    Add this page and its task token to the per-document completion counter item.
+
+    The counter item lives in the callback table under the document id with a
+    fixed sort key. Its `pages` and `tokens` string sets are updated with ADD,
+    which is idempotent, so a redelivered SQS message does not inflate the
+    number of pages the document waits for.
     """
-    dynamodb = boto3.client('dynamodb')
-    
-    # Check if an entry already exists for this document
-    try:
-        response = dynamodb.get_item(
-            TableName=os.environ['ddb_tablename'],
-            Key={'jobid': {'S': event["human_loop_id"]},'callback_token': {'S': event["token"]}}
-        )
-        
-        # If entry exists, we don't need to create it again
-        if 'Item' in response:
-            print(f"Entry already exists for job {event['human_loop_id']}")
-            return response
-    except Exception as e:
-        print(f"Error checking for existing entry: {str(e)}")
-    
-    # Create new entry with page tracking information
-    response = dynamodb.put_item(
+    response = get_client('dynamodb').update_item(
         TableName=os.environ['ddb_tablename'],
-        Item={
-            'jobid': {'S': event["human_loop_id"]},
-            'imagepath': {'S': event["process_key"]},
-            'callback_token': {'S': event["token"]},
-            'extension': {'S': event["extension"]},
-            'total_pages': {'N': str(total_pages)},
-            'document_id': {'S': event["id"]},
-            'is_complete': {'BOOL': False}
+        Key={
+            'jobid': {'S': event["id"]},
+            'callback_token': {'S': DOCUMENT_COUNTER_SORT_KEY}
+        },
+        UpdateExpression="ADD pages :page, tokens :token SET extension = if_not_exists(extension, :extension)",
+        ExpressionAttributeValues={
+            ':page': {'SS': [event["human_loop_id"]]},
+            ':token': {'SS': [event["token"]]},
+            ':extension': {'S': event["extension"]}
         }
     )
     return response
@@ -140,17 +134,19 @@ def filter_labels_by_page(a2iinput):
     
     return result
 
+@profiled
+@emits_metrics
 def lambda_handler(event, context):
-    print(event)
     for record in event["Records"]:
         body = json.loads(record["body"])
+        logger.reset(context, id=body.get("id"))
+        logger.debug("Received message", message_id=record.get("messageId"), body=body)
         
         # Extract the file extension from the input key
         input_extension = os.path.splitext(body["key"])[1].lower()
         
         # Convert wip_key to string if it's an integer
         if isinstance(body["wip_key"], int):
-            print("converting to string")
             body["wip_key"] = str(body["wip_key"])
         
         # Use .png for PDFs, otherwise use the original extension
@@ -160,55 +156,81 @@ def lambda_handler(event, context):
         total_pages = 1  # Default to 1 page
         if "image_keys" in body and isinstance(body["image_keys"], list):
             total_pages = len(body["image_keys"])
-            print(f"Document has {total_pages} pages")
+            logger.info("Processing document pages", total_pages=total_pages)
+        metrics.put_dimensions(Blueprint=blueprint_name(body.get("matched_blueprint")), SizeBucket=size_bucket(total_pages))
+        metrics.put_metric("Pages", total_pages)
         
         # Store document-level metadata in DynamoDB
         # We'll use the document ID as a base for tracking all pages
         document_base_id = body['id']
         
+        # A resumed execution only reviews the pages earlier attempts did not
+        attempt = int(body.get("attempt") or 0)
+        reviewed = reviewed_pages(document_base_id) if attempt else set()
+        
         # Check if we have image_keys array to process multiple pages
         if "image_keys" in body and isinstance(body["image_keys"], list) and len(body["image_keys"]) > 0:
             # Process each page in the image_keys array
-            for page_index in body["image_keys"]:
-                process_page(body, page_index, output_extension, total_pages, document_base_id)
+            pages = body["image_keys"]
         else:
             # Process just the current page from wip_key
-            current_page_index = int(body["wip_key"]) if body["wip_key"].isdigit() else 0
-            process_page(body, current_page_index, output_extension, total_pages, document_base_id)
+            pages = [int(body["wip_key"]) if body["wip_key"].isdigit() else 0]
+        for page_index in pages:
+            process_page(body, page_index, output_extension, total_pages, document_base_id, attempt, reviewed)
+        
+        # Nothing was sent to review, so no completion event will return the token
+        if reviewed and all(str(page) in reviewed for page in pages) and "token" in body:
+            logger.info("Every page was reviewed by an earlier attempt")
+            invoke_to_get_back_to_stepfunction(body["token"], {
+                "includes_human": "yes", "bucket": body["bucket"], "id": document_base_id, "key": body["key"]
+            })
+        
+        # Time the segment spent on the queue and starting its human loops
+        record_span(document_base_id, "review_queue", record["attributes"]["SentTimestamp"], pages=body.get("image_keys"))
         
         # Delete the SQS message
-        client = boto3.client('sqs')
-        response = client.delete_message(
+        response = get_client('sqs').delete_message(
             QueueUrl=os.environ['sqs_url'],
             ReceiptHandle=record["receiptHandle"]
         )
     
     return "all_done_check"
 
-def process_page(body, page_index, output_extension, total_pages, document_base_id):
+def reviewed_pages(document_id):
+    """Pages whose review an earlier attempt completed; none if the checkpoints cannot be read."""
+    try:
+        return checkpoint.completed_pages(checkpoint.load(document_id))
+    except Exception as e:
+        logger.warning("Could not load checkpoints, reviewing every page", error=str(e))
+        return set()
+
+def process_page(body, page_index, output_extension, total_pages, document_base_id, attempt=0, reviewed=()):
     """Process a single page and start human loop if needed"""
     # Set up page-specific fields
     page_body = body.copy()
-    page_body["process_key"] = f"wip/{body['id']}/{page_index}{output_extension}"
-    page_body["human_loop_id"] = f"{body['id']}i{page_index}"
-    page_body["s3_location"] = f"{page_body['process_key']}/ai/output.json"
+    page_body["process_key"] = page_image_key(body['id'], page_index, output_extension)
+    page_body["human_loop_id"] = human_loop_name(body['id'], page_index, attempt)
+    page_body["s3_location"] = f"{page_body['process_key']}{AI_OUTPUT_SUFFIX}"
     page_body["extension"] = output_extension
     
     # For PDFs, we need to point to the specific page PNG
     if output_extension == '.png':
         # Use the PNG file for this specific page
-        page_body["input_s3_uri"] = f"s3://{body['bucket']}/wip/{body['id']}/{page_index}{output_extension}"
+        page_body["input_s3_uri"] = to_s3_uri(body['bucket'], page_body["process_key"])
     else:
         # For other formats, use the original document but specify the page
         targetkey = body["key"].replace("uploads", "uploads-output")
-        page_body["input_s3_uri"] = f"s3://{body['bucket']}/wip/{body['id']}/{page_index}{output_extension}"
+        page_body["input_s3_uri"] = to_s3_uri(body['bucket'], page_body["process_key"])
         #page_body["input_s3_uri"] = f"s3://{body['bucket']}/{body['key']}#page={page_index+1}"
         page_body["output_s3_uri"] = f"s3://{body['bucket']}/{targetkey}"
     
-    print(f"Processing page {page_index}, input URI: {page_body['input_s3_uri']}")
+    log = logger.bind(page=page_index, human_loop=page_body["human_loop_id"])
+    log.info("Processing page", input_s3_uri=page_body["input_s3_uri"])
     
     # Process this page
-    if "a2iinput" in page_body and page_body["a2iinput"] != "none":
+    if str(page_index) in reviewed:
+        log.info("Page was reviewed by an earlier attempt")
+    elif "a2iinput" in page_body and page_body["a2iinput"] != "none":
         # Create a deep copy of a2iinput to avoid modifying the original
         import copy
         a2i_input = copy.deepcopy(page_body["a2iinput"])
@@ -228,7 +250,7 @@ def process_page(body, page_index, output_extension, total_pages, document_base_
         # Update the a2i input with filtered labels
         a2i_input["labels"] = filtered_labels
         
-        print(f"Page {page_index} has {len(filtered_labels)} labels")
+        log.info("Starting human loop", labels=len(filtered_labels))
         
         # Add document metadata to page_body
         page_body["id"] = document_base_id
@@ -237,11 +259,15 @@ def process_page(body, page_index, output_extension, total_pages, document_base_
         # Process with a2iinput
         write_ai_response_to_bucket(page_body['bucket'], page_body["process_key"], page_body["inference_result"])
         
-        # Store task token and page metadata in DynamoDB
-        dump_task_token_in_dynamodb(page_body, total_pages)
+        # Register the page and its task token with the document counter
+        register_page_with_document(page_body)
         
-        # Start human loop
+        # Start human loop; it counts as in flight until humancomplete or humanfailed sees it end
+        checkpoint.save(document_base_id, f"review#{page_index}", human_loop=page_body["human_loop_id"], status="InProgress")
+        inflight.acquire("review", page_body["human_loop_id"])
         response = start_human_loop(page_body["human_loop_id"], os.environ['human_workflow_arn'], a2i_input)
+        metrics.put_metric("FieldsSentToReview", len(filtered_labels))
+        metrics.add("HumanLoopsStarted", 1)
     else:
         # If a2iinput is not available, check for inference_result
         if "inference_result" in page_body:
@@ -251,17 +277,16 @@ def process_page(body, page_index, output_extension, total_pages, document_base_
             # Get token directly from the event and return to Step Function
             if "token" in page_body:
                 try:
-                    response = invoke_to_get_back_to_stepfunction(page_body["token"], page_body)
-                except Exception as e:
-                    print(f"Error returning to Step Function: {str(e)}")
+                    invoke_to_get_back_to_stepfunction(page_body["token"], page_body)
+                except Exception:
+                    log.exception("Error returning to Step Function")
             else:
-                print("No token found in the message body")
+                log.warning("No token found in the message body")
         else:
-            print("Neither a2iinput nor inference_result found in the message body")
+            log.warning("Neither a2iinput nor inference_result found in the message body")
 
 def invoke_to_get_back_to_stepfunction(token, body):
-    client = boto3.client('stepfunctions')
-    response = client.send_task_success(
+    response = get_client('stepfunctions').send_task_success(
         taskToken=token,
         output=json.dumps(body)
     )
@@ -17,25 +17,81 @@
 #  */
 
 import json
-import boto3
-import re
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.metrics import emits_metrics, get_metrics
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.s3_paths import (
+    BDA_OUTPUT_PREFIX, WIP_PREFIX, bda_output_prefix, execution_name, parent_prefix, parse_s3_uri, wip_prefix
+)
+from multipagepdfbda_common.structured_log import get_logger
+
+logger = get_logger()
+metrics = get_metrics()
+
+DELETE_CONCURRENCY = int(os.environ.get("delete_concurrency", "8"))
+SWEEP_CONCURRENCY = int(os.environ.get("sweep_concurrency", "16"))
+# Failed executions can be redriven for a while; keep their files until then
+SWEEP_GRACE_HOURS = float(os.environ.get("sweep_grace_hours", "24"))
+
+@profiled
+@emits_metrics
 def lambda_handler(event, context):
     """
     Lambda function to clean up two specific folders:
     1. wip/{document_id}/
     2. The BDA job folder from job_metadata_uri
     
-    Expected event format:
+    Cleanup requests arrive from the cleanup SQS queue, which the state
+    machine writes to instead of waiting for the deletes. A direct
+    invocation with a single request is still accepted.
+
+    Expected request format:
     {
         "bucket": "multipagepdfbda-multipagepdfbda61c279ea-cdnthyfgz6ya",
         "id": "8c8d1a426c38495dae9aa667741f585e",
         "bda_results": {
-            "job_metadata_uri": "s3://multipagepdfbda-multipagepdfbda61c279ea-cdnthyfgz6ya/output/aef66365-89bc-420f-9a99-c0d13ab753d1/job_metadata.json"
+            "job_metadata_uri": "s3://multipagepdfbda-multipagepdfbda61c279ea-cdnthyfgz6ya/output/8c8d1a426c38495dae9aa667741f585e/aef66365-89bc-420f-9a99-c0d13ab753d1/job_metadata.json"
         }
     }
     """
-    print("Received cleanup request:", event)
+    if "Records" not in event:
+        logger.reset(context, id=event.get("id"))
+        return cleanup_document(event)
+
+    # Report failed messages only, so the rest of the batch is not retried
+    failures = []
+    for record in event["Records"]:
+        logger.reset(context, message_id=record["messageId"])
+        try:
+            request = json.loads(record["body"])
+        except ValueError:
+            logger.warning("Dropping unreadable cleanup request")
+            continue
+        logger.reset(context, message_id=record["messageId"], id=request.get("id"))
+        try:
+            result = cleanup_document(request)
+            if result["statusCode"] != 200:
+                logger.warning("Dropping invalid cleanup request", reason=result["body"])
+        except Exception:
+            logger.exception("Error cleaning up")
+            failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": failures}
+
+def cleanup_document(event):
+    """
+    Delete the intermediate files of one document.
+
+    Args:
+        event: Cleanup request with bucket, id and optionally bda_results
+
+    Returns:
+        Dict with statusCode and body
+    """
+    logger.debug("Received cleanup request", request=event)
     
     # Extract required parameters
     bucket = event.get("bucket")
@@ -51,22 +107,20 @@ def lambda_handler(event, context):
     total_deleted = 0
     
     # 1. Delete wip/{document_id}/ folder
-    wip_folder = f"wip/{document_id}/"
+    wip_folder = wip_prefix(document_id)
     wip_deleted = delete_folder(bucket, wip_folder)
     total_deleted += wip_deleted
-    print(f"Deleted {wip_deleted} files from {wip_folder}")
+    logger.info("Deleted folder", prefix=wip_folder, files=wip_deleted)
     
     # 2. Delete BDA job folder from job_metadata_uri
     if event.get("bda_results") and event["bda_results"].get("job_metadata_uri"):
         bda_job_uri = event["bda_results"]["job_metadata_uri"]
-        print(f"Received BDA job metadata URI: {bda_job_uri}")
         bda_job_folder = extract_bda_job_folder(bda_job_uri)
-        print(f"Extracted BDA job folder: {bda_job_folder}")
         
         if bda_job_folder:
             bda_deleted = delete_folder(bucket, bda_job_folder)
             total_deleted += bda_deleted
-            print(f"Deleted {bda_deleted} files from {bda_job_folder}")
+            logger.info("Deleted folder", prefix=bda_job_folder, files=bda_deleted)
     
     return {
         "statusCode": 200,
@@ -78,23 +132,47 @@ def extract_bda_job_folder(job_uri):
     Extract the BDA job folder path from the job_metadata_uri
     
     Example: 
-    s3://bucket/output/aef66365-89bc-420f-9a99-c0d13ab753d1/job_metadata.json
-    -> output/aef66365-89bc-420f-9a99-c0d13ab753d1/
+    s3://bucket/output/8c8d1a426c38495dae9aa667741f585e/aef66365-89bc-420f-9a99-c0d13ab753d1/job_metadata.json
+    -> output/8c8d1a426c38495dae9aa667741f585e/aef66365-89bc-420f-9a99-c0d13ab753d1/
     """
     try:
-        parts = job_uri.split('/')
         # Remove the last part (job_metadata.json)
-        folder_path = '/'.join(parts[3:-1])
-        return folder_path
-    except Exception as e:
-        print(f"Error in fallback extraction: {str(e)}")
+        return parent_prefix(parse_s3_uri(job_uri)[1]) or None
+    except ValueError as e:
+        logger.warning("Could not extract BDA job folder", job_metadata_uri=job_uri, error=str(e))
     
     return None
 
+def delete_batch(bucket, keys, prefix):
+    """
+    Delete up to 1000 keys with one DeleteObjects call.
+
+    Returns:
+        Number of files deleted
+    """
+    try:
+        response = get_client('s3').delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': False}
+        )
+    except Exception:
+        logger.exception("Error deleting objects", prefix=prefix)
+        return 0
+
+    # Log any errors
+    metrics.add("FilesDeleted", len(response.get('Deleted', [])))
+    metrics.add("DeleteErrors", len(response.get('Errors', [])))
+    for error in response.get('Errors', []):
+        logger.error("Error deleting object", key=error['Key'], code=error['Code'], error=error['Message'])
+    return len(response.get('Deleted', []))
+
 def delete_folder(bucket, prefix):
     """
     Delete all files in a folder prefix.
     
+    Listing stays sequential, but each page of up to 1000 keys is deleted
+    while the next page is being listed.
+
     Args:
         bucket: S3 bucket name
         prefix: Folder prefix to delete (e.g., "wip/document-id/")
@@ -102,39 +180,119 @@ def delete_folder(bucket, prefix):
     Returns:
         Number of files deleted
     """
-    s3_client = boto3.client('s3')
-    deleted_count = 0
-    
-    # Use pagination to handle folders with many files
-    paginator = s3_client.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
-    
-    for page in pages:
-        if 'Contents' not in page:
-            # No objects found with this prefix
-            continue
-        
-        # Collect objects to delete (up to 1000 per batch)
-        objects_to_delete = [{'Key': obj['Key']} for obj in page['Contents']]
-        
-        if objects_to_delete:
-            try:
-                # Delete the batch of objects
-                response = s3_client.delete_objects(
-                    Bucket=bucket,
-                    Delete={'Objects': objects_to_delete}
-                )
-                
-                # Count deleted objects
-                if 'Deleted' in response:
-                    deleted_count += len(response['Deleted'])
-                
-                # Log any errors
-                if 'Errors' in response and response['Errors']:
-                    for error in response['Errors']:
-                        print(f"Error deleting {error['Key']}: {error['Code']} - {error['Message']}")
-                        
-            except Exception as e:
-                print(f"Error deleting objects in {prefix}: {str(e)}")
-    
-    return deleted_count
\ No newline at end of file
+    paginator = get_client('s3').get_paginator('list_objects_v2')
+    with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+        futures = [
+            executor.submit(delete_batch, bucket, [obj['Key'] for obj in page['Contents']], prefix)
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+            if page.get('Contents')
+        ]
+        return sum(future.result() for future in futures)
+
+def list_child_prefixes(bucket, prefix):
+    """Names of the "folders" directly under prefix."""
+    names = []
+    paginator = get_client('s3').get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            names.append(common_prefix['Prefix'][len(prefix):].rstrip('/'))
+    return names
+
+def newest_object_time(bucket, prefix):
+    """LastModified of the newest file under prefix, or None if it is empty."""
+    newest = None
+    paginator = get_client('s3').get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if newest is None or obj['LastModified'] > newest:
+                newest = obj['LastModified']
+    return newest
+
+def execution_is_live(document_id, cutoff):
+    """
+    Whether the execution of a document may still need its intermediate files.
+
+    The kickoff function names each execution after the document id, and
+    tools/redrive.py names the executions it resumes {id}-r1, {id}-r2 and so
+    on. Running executions and executions that stopped after the cutoff are
+    live, the latter so a failed execution can still be resumed.
+    """
+    sfn_client = get_client('stepfunctions')
+    attempt = 0
+    while True:
+        try:
+            execution = sfn_client.describe_execution(
+                executionArn=os.environ['execution_arn_prefix'] + execution_name(document_id, attempt)
+            )
+        except sfn_client.exceptions.ExecutionDoesNotExist:
+            return False
+        if execution['status'] in ('RUNNING', 'PENDING_REDRIVE'):
+            return True
+        stop_date = execution.get('stopDate')
+        if stop_date is None or stop_date > cutoff:
+            return True
+        attempt += 1
+
+def sweep_document(bucket, document_id, cutoff):
+    """
+    Delete the wip/ and BDA output folders of one document if they are orphaned.
+
+    Returns:
+        Number of files deleted
+    """
+    prefixes = [wip_prefix(document_id), bda_output_prefix(document_id)]
+    # Files written after the cutoff belong to a document that is still being
+    # processed, or whose execution has not been started yet
+    try:
+        for prefix in prefixes:
+            newest = newest_object_time(bucket, prefix)
+            if newest is not None and newest > cutoff:
+                return 0
+        if execution_is_live(document_id, cutoff):
+            return 0
+        deleted = sum(delete_folder(bucket, prefix) for prefix in prefixes)
+    except Exception:
+        # Leave the document for the next sweep
+        logger.bind(id=document_id).exception("Error sweeping document")
+        return 0
+    logger.bind(id=document_id).info("Swept orphaned files", files=deleted)
+    return deleted
+
+@profiled
+@emits_metrics
+def sweep_handler(event, context):
+    """
+    Scheduled sweep of intermediate files that no execution will clean up.
+
+    The cleanup queue only receives documents whose execution succeeded, so
+    failed, timed out and aborted executions leave wip/{id}/ and
+    output/{id}/ behind. Every document id found under either prefix is
+    checked and swept in parallel. BDA output written before it was keyed
+    by document id is left to the bucket's lifecycle rule.
+    """
+    logger.reset(context)
+    bucket = os.environ['bucket']
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=SWEEP_GRACE_HOURS)
+    document_ids = set(list_child_prefixes(bucket, WIP_PREFIX))
+    # Only the per-document folders; legacy BDA job folders are UUIDs with dashes
+    document_ids.update(
+        name for name in list_child_prefixes(bucket, BDA_OUTPUT_PREFIX)
+        if len(name) == 32 and all(c in "0123456789abcdef" for c in name)
+    )
+    logger.info("Checking documents for orphaned files", documents=len(document_ids), cutoff=cutoff.isoformat())
+
+    swept = deleted = 0
+    with ThreadPoolExecutor(max_workers=SWEEP_CONCURRENCY) as executor:
+        results = executor.map(lambda document_id: sweep_document(bucket, document_id, cutoff), sorted(document_ids))
+        for count in results:
+            swept += count > 0
+            deleted += count
+
+    logger.info("Sweep complete", documents_swept=swept, files=deleted)
+    metrics.put_metric("DocumentsChecked", len(document_ids))
+    metrics.put_metric("DocumentsSwept", swept)
+    return {
+        "documents_checked": len(document_ids),
+        "documents_swept": swept,
+        "files_deleted": deleted
+    }
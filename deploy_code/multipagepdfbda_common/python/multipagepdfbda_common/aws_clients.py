@@ -0,0 +1,160 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+from multipagepdfbda_common.metrics import instrument_session
+
+# Defaults for every client; a function can override them with its environment
+MAX_POOL_CONNECTIONS = int(os.environ.get("aws_max_pool_connections", "32"))
+MAX_ATTEMPTS = int(os.environ.get("aws_max_attempts", "5"))
+
+_session = None
+_factory = None
+_clients = {}
+_resources = {}
+_lock = threading.Lock()
+_caller = {}
+
+
+def client_config(**overrides):
+    """
+    The shared botocore config, with per-client overrides.
+
+    Connections are kept alive and pooled, and retries use adaptive mode, which
+    adds client-side rate limiting to the standard exponential backoff.
+    """
+    config = Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={"mode": "adaptive", "max_attempts": MAX_ATTEMPTS},
+    )
+    return config.merge(Config(**overrides)) if overrides else config
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+        instrument_session(_session)
+    return _session
+
+
+def set_factory(factory):
+    """
+    Create clients and resources with factory(kind, service), kind being
+    "client" or "resource", instead of boto3; None goes back to boto3.
+
+    Clients created so far are dropped. tools/offline_harness uses this to run
+    the handlers against local stand-ins of the AWS services.
+    """
+    global _factory
+    with _lock:
+        _factory = factory
+        _clients.clear()
+        _resources.clear()
+        _caller.clear()
+
+
+def _create(kind, service, overrides):
+    if _factory is not None:
+        return _factory(kind, service)
+    create = _get_session().client if kind == "client" else _get_session().resource
+    return create(service, region_name=os.environ.get("AWS_REGION"), config=client_config(**overrides))
+
+
+def _cache_key(service, overrides):
+    return service, tuple(sorted((name, repr(value)) for name, value in overrides.items()))
+
+
+def get_client(service, **overrides):
+    """
+    Client for service, created on first use and reused for the lifetime of the
+    execution environment.
+
+    Clients are thread-safe once created, so one client serves every thread of
+    an invocation. Creation itself is not, and is serialized. Keyword arguments
+    override the shared config, e.g. max_pool_connections=64; each distinct
+    set of overrides gets its own client.
+    """
+    key = _cache_key(service, overrides)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = _create("client", service, overrides)
+    return client
+
+
+def get_resource(service, **overrides):
+    """
+    Resource for service, created on first use.
+
+    Unlike clients, resources are not thread-safe; use them from the handler
+    thread only.
+    """
+    key = _cache_key(service, overrides)
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = _resources[key] = _create("resource", service, overrides)
+    return resource
+
+
+def get_region():
+    return os.environ.get("AWS_REGION") or _get_session().region_name
+
+
+def _resolve_caller(context):
+    if not _caller:
+        # The function ARN already holds partition and account; STS is only
+        # called once per environment when no Lambda context is at hand
+        function_arn = getattr(context, "invoked_function_arn", None)
+        if function_arn:
+            parts = function_arn.split(":")
+            _caller.update(partition=parts[1], account=parts[4])
+        else:
+            identity = get_client("sts").get_caller_identity()
+            _caller.update(partition=identity["Arn"].split(":")[1], account=identity["Account"])
+    return _caller
+
+
+def get_account_id(context=None):
+    """AWS account id of the running function, resolved once per execution environment."""
+    return _resolve_caller(context)["account"]
+
+
+def build_arn(service, resource, context=None, region=None):
+    """ARN of a resource in the function's own account, e.g. build_arn("bedrock", "data-automation-project/abc")."""
+    caller = _resolve_caller(context)
+    return f"arn:{caller['partition']}:{service}:{region or get_region()}:{caller['account']}:{resource}"
+
+
+def queue_url(queue_arn):
+    """URL of an SQS queue from its ARN, e.g. the eventSourceARN of an SQS record."""
+    partition, _, region, account, name = queue_arn.split(":")[1:6]
+    domain = "amazonaws.com.cn" if partition == "aws-cn" else "amazonaws.com"
+    return f"https://sqs.{region}.{domain}/{account}/{name}"
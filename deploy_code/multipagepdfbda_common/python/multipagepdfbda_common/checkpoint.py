@@ -0,0 +1,109 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+
+"""
+Stage checkpoints of a document, for resuming a failed execution.
+
+A stage that finished its part of a document writes a small item to the
+callback table under the partition checkpoint#{document id}. Sort keys:
+    bda               job_metadata_uri of the finished BDA job
+    segment#{n}       decision of the confidence check of segment n
+    review#{page}     human loop of a page and its status; Completed once
+                      humancomplete has written the review delta
+    wrapup#{n}        outputs written for segment n
+    resume#{attempt}  execution started by tools/redrive.py
+
+Checkpoints only point at what a stage left in S3: the BDA output under
+output/{id}/, the review deltas under wip/{id}/ and the outputs under
+complete/. A resumed execution skips a stage whose checkpoint is there and
+reads the rest from S3 as the first execution did.
+
+Writing never fails a stage: errors are logged and dropped, and a stage
+without its checkpoint is run again on resume.
+
+Settings (environment variables):
+    checkpoint_table     table name; nothing is written without it
+    checkpoint_ttl_days  days checkpoints are kept (default 30)
+"""
+
+import json
+import os
+import time
+
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.structured_log import get_logger
+
+CHECKPOINT_TABLE = os.environ.get("checkpoint_table")
+TTL_DAYS = int(os.environ.get("checkpoint_ttl_days", "30"))
+
+
+def partition(document_id):
+    return f"checkpoint#{document_id}"
+
+
+def save(document_id, stage, table=None, **fields):
+    """Write the checkpoint of stage, e.g. save(id, "wrapup#2", outputs={...}); an earlier one is replaced."""
+    table = table or CHECKPOINT_TABLE
+    if not table or not document_id:
+        return
+    try:
+        get_client("dynamodb").put_item(
+            TableName=table,
+            Item={
+                "jobid": {"S": partition(document_id)},
+                "callback_token": {"S": stage},
+                "data": {"S": json.dumps(fields, default=str)},
+                "saved_at": {"N": str(int(time.time() * 1000))},
+                "expires_at": {"N": str(int(time.time()) + TTL_DAYS * 86400)},
+            },
+        )
+    except Exception as e:
+        get_logger().warning("Could not save checkpoint", stage=stage, error=str(e))
+
+
+def load(document_id, table=None):
+    """
+    Every checkpoint of a document.
+
+    Returns:
+        {stage: fields}; raises if the table cannot be read
+    """
+    params = {
+        "TableName": table or CHECKPOINT_TABLE,
+        "KeyConditionExpression": "jobid = :partition",
+        "ExpressionAttributeValues": {":partition": {"S": partition(document_id)}},
+        "ConsistentRead": True,
+    }
+    checkpoints = {}
+    while True:
+        response = get_client("dynamodb").query(**params)
+        for item in response["Items"]:
+            checkpoints[item["callback_token"]["S"]] = json.loads(item["data"]["S"])
+        if "LastEvaluatedKey" not in response:
+            return checkpoints
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def completed_pages(checkpoints):
+    """Pages, as strings, whose review delta has been written."""
+    return {
+        stage[len("review#"):] for stage, fields in checkpoints.items()
+        if stage.startswith("review#") and fields.get("status") == "Completed"
+    }
@@ -0,0 +1,121 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+
+"""
+Counts of the BDA jobs and human loops in flight, for kickoff backpressure.
+
+A stage takes a lease while it holds a scarce resource and releases it when
+done: invoke_bda for its BDA job, analyzepdf for every human loop it starts,
+released by humancomplete or humanfailed. Leases are items of the callback
+table under the partition inflight#{kind}, so count() is a single Query.
+A lease left behind by a crashed stage stops counting once it expires.
+
+Tracking never fails a stage: errors are logged and dropped, and count()
+returns None, which kickoff takes as no backpressure.
+
+Kinds, with their lease lifetime:
+    bda     one per document while invoke_bda waits for its job
+    review  one per human loop until it completes, fails or is stopped
+
+Settings (environment variables):
+    inflight_table              table name; nothing is tracked without it
+    inflight_bda_ttl_seconds    lifetime of a bda lease (default 900)
+    inflight_review_ttl_hours   lifetime of a review lease (default 72)
+"""
+
+import os
+import time
+
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.structured_log import get_logger
+
+INFLIGHT_TABLE = os.environ.get("inflight_table")
+TTL_SECONDS = {
+    "bda": int(os.environ.get("inflight_bda_ttl_seconds", "900")),
+    "review": int(os.environ.get("inflight_review_ttl_hours", "72")) * 3600,
+}
+
+KINDS = tuple(TTL_SECONDS)
+
+
+def partition(kind):
+    return f"inflight#{kind}"
+
+
+def acquire(kind, name):
+    """Take the lease name, e.g. a document id or human loop name, of kind; taking it again renews it."""
+    if not INFLIGHT_TABLE or not name:
+        return
+    try:
+        get_client("dynamodb").put_item(
+            TableName=INFLIGHT_TABLE,
+            Item={
+                "jobid": {"S": partition(kind)},
+                "callback_token": {"S": name},
+                "expires_at": {"N": str(int(time.time()) + TTL_SECONDS[kind])},
+            },
+        )
+    except Exception as e:
+        get_logger().warning("Could not take in-flight lease", kind=kind, lease=name, error=str(e))
+
+
+def release(kind, name):
+    """Release the lease name of kind; releasing a lease that is not held does nothing."""
+    if not INFLIGHT_TABLE or not name:
+        return
+    try:
+        get_client("dynamodb").delete_item(
+            TableName=INFLIGHT_TABLE,
+            Key={"jobid": {"S": partition(kind)}, "callback_token": {"S": name}},
+        )
+    except Exception as e:
+        get_logger().warning("Could not release in-flight lease", kind=kind, lease=name, error=str(e))
+
+
+def count(kind):
+    """
+    Unexpired leases of kind.
+
+    Returns:
+        The count, or None if tracking is off or the table could not be read
+    """
+    if not INFLIGHT_TABLE:
+        return None
+    params = {
+        "TableName": INFLIGHT_TABLE,
+        "KeyConditionExpression": "jobid = :partition",
+        "FilterExpression": "expires_at > :now",
+        "ExpressionAttributeValues": {
+            ":partition": {"S": partition(kind)},
+            ":now": {"N": str(int(time.time()))},
+        },
+        "Select": "COUNT",
+    }
+    total = 0
+    try:
+        while True:
+            response = get_client("dynamodb").query(**params)
+            total += response["Count"]
+            if "LastEvaluatedKey" not in response:
+                return total
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except Exception as e:
+        get_logger().warning("Could not count in-flight leases", kind=kind, error=str(e))
+        return None
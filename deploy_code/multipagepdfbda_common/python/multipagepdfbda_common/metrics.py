@@ -0,0 +1,300 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+Per-stage metrics in CloudWatch embedded metric format (EMF).
+
+A handler wrapped with @emits_metrics writes one EMF record per invocation
+with its StageDuration, Errors, the bytes read from and written to S3, and
+whatever counts the handler adds (pages, fields, review decisions). Every AWS
+call made through multipagepdfbda_common.aws_clients is timed, and the
+latencies go out as one record per service and operation. CloudWatch turns
+the records into metrics without any PutMetricData call.
+
+Stage records have the dimension sets [Function] and, once the handler has
+set them, [Function, Blueprint, SizeBucket]. Call records have
+[Function, Service, Operation].
+
+Settings (environment variables):
+    metrics_namespace  CloudWatch namespace (default multipagepdfbda)
+    metrics_sink       stdout (default), memory or off; memory keeps the
+                       records in a MemorySink, see set_sink()
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get("metrics_namespace", "multipagepdfbda")
+
+# EMF accepts at most 100 values per metric in one record
+MAX_VALUES = 100
+
+# Upper page counts of the SizeBucket dimension; larger documents are "51+"
+SIZE_BUCKETS = (1, 5, 20, 50)
+
+
+def size_bucket(pages):
+    """SizeBucket dimension for a page count, e.g. 3 -> "2-5"."""
+    lower = 1
+    for upper in SIZE_BUCKETS:
+        if pages <= upper:
+            return str(upper) if lower == upper else f"{lower}-{upper}"
+        lower = upper + 1
+    return f"{lower}+"
+
+
+def blueprint_name(matched_blueprint):
+    """Blueprint dimension from the matched_blueprint of a BDA custom output."""
+    if isinstance(matched_blueprint, dict):
+        return matched_blueprint.get("name") or matched_blueprint.get("arn", "").rsplit("/", 1)[-1] or None
+    return matched_blueprint or None
+
+
+class MemorySink:
+    """Keeps EMF records in memory instead of printing them, for tests and local runs."""
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def values(self, name, **dimensions):
+        """All values of metric name in records whose dimensions include the given ones."""
+        found = []
+        for record in self.records:
+            if name in record and all(record.get(key) == value for key, value in dimensions.items()):
+                value = record[name]
+                found.extend(value if isinstance(value, list) else [value])
+        return found
+
+
+def print_sink(record):
+    print(json.dumps(record, default=str))
+
+
+_sink = {"stdout": print_sink, "memory": MemorySink(), "off": None}.get(
+    os.environ.get("metrics_sink", "stdout"), print_sink
+)
+
+
+def set_sink(sink):
+    """
+    Send records to sink, a callable taking the record dict, or nowhere if None.
+
+    Returns:
+        The previous sink
+    """
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+def get_sink():
+    return _sink
+
+
+class Metrics:
+    """
+    Metrics of one invocation.
+
+    reset() starts the stage and flush() writes its records. Values may be
+    added from any thread, so page fetches and AWS calls made by worker
+    threads are counted.
+    """
+
+    __slots__ = ("dimensions", "values", "units", "calls", "properties", "started", "lock", "call_log")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Set to a list to also keep every call, see multipagepdfbda_common.profiling
+        self.call_log = None
+        self.reset()
+
+    def reset(self, context=None, **dimensions):
+        """Start a new stage with the Function dimension and the given ones."""
+        with self.lock:
+            self.dimensions = {}
+            self.values = {}
+            self.units = {}
+            self.calls = {}
+            self.properties = {}
+            if context is not None:
+                self.properties["request_id"] = getattr(context, "aws_request_id", None)
+            self.started = time.perf_counter()
+        self.put_dimensions(**dimensions)
+        return self
+
+    def put_dimensions(self, **dimensions):
+        """Set stage dimensions, e.g. Blueprint and SizeBucket; None values are left out."""
+        with self.lock:
+            self.dimensions.update((key, str(value)) for key, value in dimensions.items() if value is not None)
+
+    def put_metric(self, name, value, unit="Count"):
+        with self.lock:
+            self.values.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    def add(self, name, value, unit="Count"):
+        """Add value to the single running total of name."""
+        with self.lock:
+            totals = self.values.setdefault(name, [0])
+            totals[0] += value
+            self.units[name] = unit
+
+    def put_property(self, name, value):
+        """Field logged with the stage record but not turned into a metric, e.g. the document id."""
+        with self.lock:
+            self.properties[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        """Time the body of a with block as metric name, in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put_metric(name, (time.perf_counter() - start) * 1000, "Milliseconds")
+
+    def record_call(self, service, operation, millis, error, started=None):
+        with self.lock:
+            latencies, errors = self.calls.setdefault((service, operation), ([], [0]))
+            latencies.append(millis)
+            errors[0] += error
+            if self.call_log is not None:
+                self.call_log.append((service, operation, started, millis, error))
+
+    def flush(self):
+        """Write the stage record and the call records, and start over with the same dimensions."""
+        with self.lock:
+            self.values.setdefault("StageDuration", []).append((time.perf_counter() - self.started) * 1000)
+            self.units["StageDuration"] = "Milliseconds"
+            values, units, calls = self.values, self.units, self.calls
+            dimensions, properties = dict(self.dimensions), dict(self.properties)
+            self.values, self.units, self.calls = {}, {}, {}
+            self.started = time.perf_counter()
+        if _sink is None:
+            return
+
+        dimensions["Function"] = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+        dimension_sets = [["Function"]]
+        if len(dimensions) > 1:
+            dimension_sets.append(["Function"] + sorted(key for key in dimensions if key != "Function"))
+        emit(dict(properties, **dimensions), dimension_sets, {name: (units[name], value) for name, value in values.items()})
+
+        for (service, operation), (latencies, errors) in sorted(calls.items()):
+            emit(
+                dict(Function=dimensions["Function"], Service=service, Operation=operation),
+                [["Function", "Service", "Operation"]],
+                {"CallLatency": ("Milliseconds", latencies), "CallErrors": ("Count", errors)},
+            )
+
+
+def emit(fields, dimension_sets, metrics):
+    """
+    Write EMF records for metrics, {name: (unit, [values])}, with the given
+    dimension values and sets. Metrics with more than MAX_VALUES values are
+    spread over several records.
+    """
+    for start in range(0, max(len(values) for _, values in metrics.values()), MAX_VALUES):
+        chunk = {name: (unit, values[start:start + MAX_VALUES]) for name, (unit, values) in metrics.items()}
+        chunk = {name: (unit, values) for name, (unit, values) in chunk.items() if values}
+        record = dict(fields)
+        record["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": dimension_sets,
+                "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in chunk.items()],
+            }],
+        }
+        record.update((name, values[0] if len(values) == 1 else values) for name, (_, values) in chunk.items())
+        _sink(record)
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """The metrics of this function, shared by all of its modules."""
+    return _metrics
+
+
+def emits_metrics(handler):
+    """
+    Decorate a Lambda handler to reset the metrics when it is invoked and flush
+    them when it returns or raises. Errors counts the raised exceptions.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        _metrics.reset(context)
+        try:
+            return handler(event, context)
+        except Exception:
+            _metrics.put_metric("Errors", 1)
+            raise
+        finally:
+            _metrics.flush()
+    return wrapper
+
+
+def _before_call(model, params, context, **kwargs):
+    context["metrics_call"] = (model.service_model.service_name, model.name, time.perf_counter())
+    if model.name in ("PutObject", "UploadPart"):
+        length = body_length(params.get("body"))
+        if length is not None:
+            _metrics.add("BytesWritten", length, "Bytes")
+
+
+def body_length(body):
+    """Bytes left in a serialized request body, or None if it cannot be told without reading it."""
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    try:
+        position = body.tell()
+        end = body.seek(0, os.SEEK_END)
+        body.seek(position)
+        return end - position
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _after_call(context, parsed=None, exception=None, **kwargs):
+    # after-call-error, sent when no response arrived, carries no model
+    call = context.pop("metrics_call", None)
+    if call is None:
+        return
+    service, operation, started = call
+    error = exception is not None or bool(parsed and "Error" in parsed)
+    _metrics.record_call(service, operation, (time.perf_counter() - started) * 1000, error, started)
+    if not error and operation == "GetObject":
+        _metrics.add("BytesRead", parsed.get("ContentLength", 0), "Bytes")
+
+
+def instrument_session(session):
+    """Time every call made by the clients and resources of a boto3 session."""
+    # Registered per service and operation, so the handlers run ahead of
+    # those that end the before-call event with a response, such as a Stubber
+    session.events.register("before-call.*.*", _before_call)
+    session.events.register("after-call.*.*", _after_call)
+    session.events.register("after-call-error.*.*", _after_call)
@@ -0,0 +1,200 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+Opt-in profiling of Lambda invocations.
+
+@profiled profiles a sample of the invocations of a handler and uploads the
+result to S3 under profiles/{document id}/{function}/:
+    {time}-{request id}.json    wall time, the top functions by cumulative
+                                time, the top allocations and every AWS call
+    {time}-{request id}.pstats  the cProfile stats, for pstats or snakeviz
+
+cProfile only sees the handler thread; the work of thread pools shows up
+as the time the handler waited for it. AWS calls are timed in every thread.
+
+With profile_sample_rate unset or 0 the decorator returns the handler
+itself, so disabled profiling costs nothing.
+
+Settings (environment variables):
+    profile_sample_rate  fraction of invocations profiled (default 0)
+    profile_modes        any of cprofile, tracemalloc and calls (default all)
+    profile_top_n        functions and allocations kept (default 30)
+    profile_bucket       bucket the profiles are uploaded to
+"""
+
+import cProfile
+import datetime
+import functools
+import json
+import marshal
+import os
+import pstats
+import random
+import time
+import tracemalloc
+
+from multipagepdfbda_common.metrics import get_metrics
+from multipagepdfbda_common.s3_paths import split_human_loop_name
+from multipagepdfbda_common.structured_log import get_logger
+
+SAMPLE_RATE = float(os.environ.get("profile_sample_rate", "0"))
+MODES = frozenset(mode.strip() for mode in os.environ.get("profile_modes", "cprofile,tracemalloc,calls").split(",") if mode.strip())
+TOP_N = int(os.environ.get("profile_top_n", "30"))
+PROFILE_BUCKET = os.environ.get("profile_bucket")
+PROFILE_PREFIX = "profiles/"
+
+
+def document_id_of(event):
+    """Document id of a handler event, whichever of the pipeline's event shapes it has."""
+    if not isinstance(event, dict):
+        return None
+    if event.get("id"):
+        return event["id"]
+    if isinstance(event.get("Payload"), dict) and event["Payload"].get("id"):
+        return event["Payload"]["id"]
+    human_loop_name = event.get("detail", {}).get("humanLoopName") if isinstance(event.get("detail"), dict) else None
+    if human_loop_name:
+        return split_human_loop_name(human_loop_name)[0]
+    for record in event.get("Records", [])[:1]:
+        try:
+            return json.loads(record["body"]).get("id")
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None
+    return None
+
+
+class Profile:
+    """The collectors of one profiled invocation."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile() if "cprofile" in MODES else None
+        self.tracing = "tracemalloc" in MODES and not tracemalloc.is_tracing()
+        self.calls = [] if "calls" in MODES else None
+
+    def start(self):
+        if self.calls is not None:
+            get_metrics().call_log = self.calls
+        if self.tracing:
+            tracemalloc.start()
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started = time.perf_counter()
+        if self.profiler:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+        self.wall_ms = (time.perf_counter() - self.started) * 1000
+        self.snapshot = None
+        if self.tracing:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        if self.calls is not None:
+            get_metrics().call_log = None
+
+    def summary(self):
+        result = {"started_at": self.started_at.isoformat(), "wall_ms": self.wall_ms, "modes": sorted(MODES)}
+        if self.profiler:
+            stats = pstats.Stats(self.profiler)
+            rows = sorted(stats.stats.items(), key=lambda entry: entry[1][3], reverse=True)[:TOP_N]
+            result["cprofile"] = [
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "tottime_ms": tottime * 1000,
+                    "cumtime_ms": cumtime * 1000,
+                }
+                for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+            ]
+        if self.snapshot:
+            result["tracemalloc"] = {
+                "current_bytes": self.traced[0],
+                "peak_bytes": self.traced[1],
+                "top": [
+                    {"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                    for stat in self.snapshot.statistics("lineno")[:TOP_N]
+                ],
+            }
+        if self.calls is not None:
+            result["calls"] = [
+                {
+                    "service": service,
+                    "operation": operation,
+                    "offset_ms": (started - self.started) * 1000 if started else None,
+                    "duration_ms": millis,
+                    "error": bool(error),
+                }
+                for service, operation, started, millis, error in self.calls
+            ]
+        return result
+
+    def pstats_bytes(self):
+        """The stats in the marshal format of pstats.Stats.dump_stats."""
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+
+def upload(profile, event, context, error):
+    from multipagepdfbda_common.aws_clients import get_client
+
+    function = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+    request_id = getattr(context, "aws_request_id", None) or f"{random.getrandbits(32):08x}"
+    document_id = document_id_of(event) or "no-id"
+    summary = dict(profile.summary(), function=function, request_id=request_id, id=document_id)
+    if error:
+        summary["error"] = error
+    base_key = f"{PROFILE_PREFIX}{document_id}/{function}/{profile.started_at:%Y%m%dT%H%M%S}-{request_id}"
+
+    s3 = get_client("s3")
+    s3.put_object(Bucket=PROFILE_BUCKET, Key=f"{base_key}.json", Body=json.dumps(summary, default=str))
+    if profile.profiler:
+        s3.put_object(Bucket=PROFILE_BUCKET, Key=f"{base_key}.pstats", Body=profile.pstats_bytes())
+    return base_key
+
+
+def profiled(handler):
+    """
+    Decorate a Lambda handler to profile a profile_sample_rate share of its
+    invocations. Without a sample rate or bucket, the handler is returned as is.
+    """
+    if SAMPLE_RATE <= 0 or not PROFILE_BUCKET:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if random.random() >= SAMPLE_RATE:
+            return handler(event, context)
+        profile = Profile()
+        error = None
+        profile.start()
+        try:
+            return handler(event, context)
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            profile.stop()
+            try:
+                key = upload(profile, event, context, error)
+                get_logger().info("Uploaded profile", key=key, wall_ms=profile.wall_ms)
+            except Exception as e:
+                get_logger().warning("Could not upload profile", error=str(e))
+    return wrapper
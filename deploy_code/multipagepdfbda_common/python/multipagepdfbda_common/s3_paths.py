@@ -0,0 +1,118 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+S3 URI parsing and the key layout of the solution's bucket.
+
+    uploads/{name}                             documents to process
+    output/{document id}/{job id}/             BDA job output
+    wip/{document id}/{page}{ext}              page images for review
+    wip/{document id}/{page}{ext}/ai/output.json
+    wip/{document id}/{page}{ext}/human/delta.json
+    complete/{document id}-{name}-pages-{pages}-*
+    compacted/_index/{yyyymmddTHHMMSSffffffZ}-{segment}.json
+                                               outputs of a segment, for compaction
+"""
+
+WIP_PREFIX = "wip/"
+BDA_OUTPUT_PREFIX = "output/"
+COMPLETE_PREFIX = "complete/"
+COMPACTION_INDEX_PREFIX = "compacted/_index/"
+
+AI_OUTPUT_SUFFIX = "/ai/output.json"
+HUMAN_DELTA_SUFFIX = "/human/delta.json"
+# Full answerContent written by humancomplete before review deltas
+HUMAN_OUTPUT_SUFFIX = "/human/output.json"
+
+
+def compaction_index_position(written_at):
+    """Key prefix of the index entries written at written_at, a UTC datetime."""
+    return f"{COMPACTION_INDEX_PREFIX}{written_at:%Y%m%dT%H%M%S%fZ}"
+
+
+def compaction_index_key(written_at, segment):
+    """
+    Index entry of the outputs of a segment. Entries sort by the time they
+    were written, so compaction lists only those after its watermark.
+    """
+    return f"{compaction_index_position(written_at)}-{segment}.json"
+
+
+def parse_s3_uri(uri):
+    """
+    Split an s3:// URI into bucket and key.
+
+    Returns:
+        (bucket, key); key is "" for a bare bucket URI
+    """
+    if not uri.startswith("s3://"):
+        raise ValueError(f"Not an S3 URI: {uri}")
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def to_s3_uri(bucket, key):
+    return f"s3://{bucket}/{key}"
+
+
+def parent_prefix(key):
+    """Folder of a key with its trailing slash, e.g. output/x/job_metadata.json -> output/x/"""
+    return key[:key.rfind("/") + 1]
+
+
+def wip_prefix(document_id):
+    return f"{WIP_PREFIX}{document_id}/"
+
+
+def bda_output_prefix(document_id):
+    return f"{BDA_OUTPUT_PREFIX}{document_id}/"
+
+
+def page_image_key(document_id, page, extension):
+    """Key of a page image; extension includes the dot, e.g. ".png"."""
+    return f"{WIP_PREFIX}{document_id}/{page}{extension}"
+
+
+def page_number_of(page_key):
+    """Page number of a page image key such as wip/{id}/12.png"""
+    name = page_key[page_key.rfind("/") + 1:]
+    return int(name[:name.find(".")])
+
+
+def execution_name(document_id, attempt=0):
+    """Name of the execution of a document; tools/redrive.py resumes it as {id}-r{attempt}."""
+    return f"{document_id}-r{attempt}" if attempt else document_id
+
+
+def human_loop_name(document_id, page, attempt=0):
+    """
+    Name of the human loop of a page. Loop names cannot be reused, so a
+    resumed execution that reviews the page again adds its attempt, e.g. r1.
+    """
+    return f"{document_id}i{page}" + (f"r{attempt}" if attempt else "")
+
+
+def split_human_loop_name(name):
+    """
+    (document id, page) of a human loop name, without the attempt.
+
+    Document ids are hex, so the last "i" is the separator.
+    """
+    separator = name.rfind("i")
+    return name[:separator], name[separator + 1:].partition("r")[0]
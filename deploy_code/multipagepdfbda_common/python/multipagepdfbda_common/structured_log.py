@@ -0,0 +1,171 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+Structured, level-gated logging for the Lambda functions.
+
+Every record is one JSON line with a level, a message, the correlation
+fields bound to the logger (function, request_id, id, segment, page,
+human_loop) and the record's own fields. Fields are redacted and capped
+before they are serialized, and nothing is serialized for records below
+the level.
+
+Settings (environment variables):
+    LOG_LEVEL            DEBUG, INFO (default), WARNING or ERROR
+    log_sample_rate      fraction of documents logged at DEBUG in every
+                         function, chosen by document id (default 0)
+    log_max_field_chars  longest serialized field before it is cut (default 1024)
+    log_redact_keys      comma-separated keys whose values are never logged
+"""
+
+import hashlib
+import json
+import os
+import traceback
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_LEVEL = LEVELS.get(os.environ.get("LOG_LEVEL", "INFO").upper(), LEVELS["INFO"])
+LOG_SAMPLE_RATE = float(os.environ.get("log_sample_rate", "0"))
+MAX_FIELD_CHARS = int(os.environ.get("log_max_field_chars", "1024"))
+
+# Task tokens and receipt handles grant access; the rest carry document content
+DEFAULT_REDACT_KEYS = "token,tokens,taskToken,receiptHandle,inference_result,a2iinput,a2i_input,answerContent,humanAnswers"
+REDACT_KEYS = frozenset(
+    key.strip().lower() for key in os.environ.get("log_redact_keys", DEFAULT_REDACT_KEYS).split(",") if key.strip()
+)
+REDACTED = "[redacted]"
+
+
+def is_sampled(document_id):
+    """
+    Whether a document is logged at DEBUG.
+
+    The decision is a hash of the id, so every function agrees on it and a
+    sampled document can be traced end to end.
+    """
+    if LOG_SAMPLE_RATE <= 0 or not document_id:
+        return False
+    bucket = int(hashlib.sha256(str(document_id).encode("utf-8")).hexdigest()[:8], 16)
+    return bucket < LOG_SAMPLE_RATE * 0x100000000
+
+
+def redact(value):
+    """Copy of value with the values of REDACT_KEYS replaced, at any depth."""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower() in REDACT_KEYS else redact(child)
+            for key, child in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(child) for child in value]
+    return value
+
+
+def cap(value):
+    """
+    Value itself if its JSON form fits MAX_FIELD_CHARS, else that JSON cut to
+    size with the number of characters left out.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else json.dumps(value, default=str, separators=(",", ":"))
+    if len(text) <= MAX_FIELD_CHARS:
+        return value
+    return f"{text[:MAX_FIELD_CHARS]}...[{len(text) - MAX_FIELD_CHARS} more chars]"
+
+
+class StructuredLogger:
+    """
+    Logger with bound correlation fields.
+
+    Handlers keep one module-level logger, reset it at the start of each
+    invocation with the fields of the document being processed, and bind
+    child loggers for work items handled side by side (pages, SQS records).
+    """
+
+    __slots__ = ("fields", "min_level")
+
+    def __init__(self, fields=None, min_level=LOG_LEVEL):
+        self.fields = fields or {}
+        self.min_level = min_level
+
+    @staticmethod
+    def _level_for(fields, min_level):
+        return min(min_level, LEVELS["DEBUG"]) if is_sampled(fields.get("id")) else min_level
+
+    def bind(self, **fields):
+        """Child logger with extra correlation fields; None values are left out."""
+        merged = dict(self.fields)
+        merged.update((key, value) for key, value in fields.items() if value is not None)
+        return StructuredLogger(merged, self._level_for(merged, self.min_level))
+
+    def reset(self, context=None, **fields):
+        """Start a new invocation: keep the function name, replace every other field."""
+        merged = {"function": os.environ.get("AWS_LAMBDA_FUNCTION_NAME")}
+        if context is not None:
+            merged["request_id"] = getattr(context, "aws_request_id", None)
+        merged.update(fields)
+        self.fields = {key: value for key, value in merged.items() if value is not None}
+        self.min_level = self._level_for(self.fields, LOG_LEVEL)
+        return self
+
+    def is_enabled(self, level):
+        return LEVELS[level] >= self.min_level
+
+    def log(self, level, message, **fields):
+        if LEVELS[level] < self.min_level:
+            return
+        record = {"level": level, "message": message}
+        record.update(self.fields)
+        for key, value in fields.items():
+            record[key] = REDACTED if key.lower() in REDACT_KEYS else cap(redact(value))
+        print(json.dumps(record, default=str))
+
+    def debug(self, message, **fields):
+        self.log("DEBUG", message, **fields)
+
+    def info(self, message, **fields):
+        self.log("INFO", message, **fields)
+
+    def warning(self, message, **fields):
+        self.log("WARNING", message, **fields)
+
+    def error(self, message, **fields):
+        self.log("ERROR", message, **fields)
+
+    def exception(self, message, **fields):
+        """Log at ERROR with the traceback of the exception being handled."""
+        # The end of a traceback says what failed
+        self.log("ERROR", message, error=traceback.format_exc()[-MAX_FIELD_CHARS:], **fields)
+
+
+_logger = None
+
+
+def get_logger():
+    """
+    The logger of this function.
+
+    All modules of a function share it, so the fields bound by the handler's
+    reset() are on the records of the helpers it calls.
+    """
+    global _logger
+    if _logger is None:
+        _logger = StructuredLogger().reset()
+    return _logger
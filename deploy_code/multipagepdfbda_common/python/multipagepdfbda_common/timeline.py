@@ -0,0 +1,125 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+Per-document processing timeline.
+
+Every stage appends a span {stage, start, end} in epoch milliseconds, plus
+the segment or pages it covered, to one item per document in the timeline
+table. A single GetItem then shows where the time of a document went.
+kickoff also sets `day` and `uploaded_at`, the keys of the by_day index that
+tools/timeline_report.py queries for the documents of a time window.
+
+Stages, in pipeline order:
+    upload_queue  S3 event time to the start of the execution
+    bda_job       BDA invocation to its completion
+    confidence    confidence check of a segment
+    review_queue  segment queued for analyzepdf to its human loops started
+    review        human loop created to completed, per page
+    wrapup        writing the outputs of a segment
+
+Recording never fails a stage: errors are logged and dropped. A retried
+stage appends its span again; readers drop the duplicates.
+
+Settings (environment variables):
+    timeline_table     table name; nothing is recorded without it
+    timeline_ttl_days  days a timeline is kept (default 30)
+"""
+
+import datetime
+import os
+import time
+
+from boto3.dynamodb.types import TypeSerializer
+
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.structured_log import get_logger
+
+TIMELINE_TABLE = os.environ.get("timeline_table")
+TTL_DAYS = int(os.environ.get("timeline_ttl_days", "30"))
+
+STAGES = ("upload_queue", "bda_job", "confidence", "review_queue", "review", "wrapup")
+
+_serializer = TypeSerializer()
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def to_ms(value):
+    """Epoch milliseconds of a datetime, an ISO 8601 string or epoch milliseconds."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        if value.isdigit():
+            return int(value)
+        value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return int(value.timestamp() * 1000)
+
+
+def record_span(document_id, stage, start, end=None, item_fields=None, **fields):
+    """
+    Append a span of stage to the timeline of a document.
+
+    Args:
+        start, end: datetime, ISO 8601 string or epoch milliseconds; end defaults to now
+        item_fields: attributes set on the document item itself, kept if already set
+        fields: extra span fields, e.g. segment=2 or pages=[0, 1]; None values are left out
+    """
+    if not TIMELINE_TABLE or not document_id:
+        return
+    span = {"stage": stage, "start": to_ms(start), "end": now_ms() if end is None else to_ms(end)}
+    span.update((key, value) for key, value in fields.items() if value is not None)
+
+    names = {"#spans": "spans", "#expires_at": "expires_at"}
+    values = {
+        ":empty": [],
+        ":span": [span],
+        ":expires_at": int(time.time()) + TTL_DAYS * 86400,
+    }
+    assignments = [
+        "#spans = list_append(if_not_exists(#spans, :empty), :span)",
+        "#expires_at = if_not_exists(#expires_at, :expires_at)",
+    ]
+    for index, (name, value) in enumerate((item_fields or {}).items()):
+        names[f"#f{index}"] = name
+        values[f":f{index}"] = value
+        assignments.append(f"#f{index} = if_not_exists(#f{index}, :f{index})")
+
+    try:
+        get_client("dynamodb").update_item(
+            TableName=TIMELINE_TABLE,
+            Key={"id": {"S": document_id}},
+            UpdateExpression="SET " + ", ".join(assignments),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={key: _serializer.serialize(value) for key, value in values.items()},
+        )
+    except Exception as e:
+        get_logger().warning("Could not record timeline span", stage=stage, error=str(e))
+
+
+def record_upload(document_id, uploaded_at, key=None):
+    """Record the upload_queue span of a document whose execution was just started."""
+    uploaded_ms = to_ms(uploaded_at)
+    day = datetime.datetime.fromtimestamp(uploaded_ms / 1000, datetime.timezone.utc).strftime("%Y-%m-%d")
+    item_fields = {"day": day, "uploaded_at": uploaded_ms}
+    if key:
+        item_fields["key"] = key
+    record_span(document_id, "upload_queue", uploaded_ms, item_fields=item_fields)
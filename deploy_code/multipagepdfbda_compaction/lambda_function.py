@@ -0,0 +1,462 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.metrics import emits_metrics, get_metrics
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.s3_paths import COMPACTION_INDEX_PREFIX, COMPLETE_PREFIX, compaction_index_position
+from multipagepdfbda_common.structured_log import get_logger
+
+# pyarrow comes from the AWS SDK for pandas layer; without it Parquet files are left as they are
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+BUCKET = os.environ.get('bucket')
+
+logger = get_logger()
+metrics = get_metrics()
+
+# Outputs are only compacted once they are this old, so a segment that wrapup
+# is still writing is never split across two runs
+SETTLE_SECONDS = int(os.environ.get('settle_seconds', '900'))
+
+# Uncompressed source bytes per batch file
+TARGET_BATCH_BYTES = int(os.environ.get('target_batch_mb', '128')) * 1024 * 1024
+
+# Allowed difference between the clock of wrapup, which names the index
+# entries, and the LastModified time S3 gives them
+INDEX_CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+# Segments written before wrapup indexed its outputs are found by listing all
+# of complete/, until the watermark is this far past the first run that read
+# the index; it covers wrapups still running the previous code
+LEGACY_LISTING_GRACE = datetime.timedelta(hours=1)
+
+# Upper bound of sources per run; the window is shortened to fit and the rest
+# is picked up by the next run
+MAX_SOURCES_PER_RUN = int(os.environ.get('max_sources_per_run', '20000'))
+
+# Delete the per-document files once their batch and manifest are written
+DELETE_SOURCES = os.environ.get('delete_compacted_sources', 'false').lower() == 'true'
+
+FETCH_CONCURRENCY = int(os.environ.get('fetch_concurrency', '16'))
+
+SOURCE_PREFIX = COMPLETE_PREFIX
+PARQUET_PREFIX = os.environ.get('parquet_prefix', 'analytics') + "/"
+COMPACTED_PREFIX = "compacted/"
+STATE_KEY = COMPACTED_PREFIX + "_state.json"
+MANIFEST_PREFIX = COMPACTED_PREFIX + "_manifests/"
+
+# Files wrapup writes for every document segment, by the field they become
+SEGMENT_SUFFIXES = {
+    "-bda-responses.json": "bda_responses",
+    "-human-corrections.json": "human_corrections",
+    "-human-responses.json": "human_responses",
+    "-output.csv": "csv",
+}
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+s3_client = get_client('s3', max_pool_connections=FETCH_CONCURRENCY)
+
+
+@profiled
+@emits_metrics
+def lambda_handler(event, context):
+    """
+    Merge completed per-document outputs into size-targeted, date-partitioned batches.
+
+    Every run compacts the outputs last modified inside a time window
+    [watermark, cutoff) and advances the watermark to the cutoff. The window
+    is stored in a state object before any batch is written and each run
+    writes a manifest of the batches it produced and their sources, so a run
+    that fails part way is resumed with the same window on the next schedule
+    and overwrites its own deterministic batch keys instead of duplicating them.
+    The window's segments are found through the index entries wrapup writes
+    under compacted/_index/ and its Parquet files through their date
+    partitions, so a run does not list every output ever written.
+
+    Outputs:
+        compacted/segments/date={yyyy-mm-dd}/{run_id}-{n}.ndjson.gz
+            one JSON line per document segment with its BDA, human and CSV values
+        compacted/analytics/{table}/blueprint={name}/date={yyyy-mm-dd}/{run_id}-{n}.parquet
+            the wrapup Parquet files of a partition merged, when pyarrow is available
+        compacted/_manifests/{run_id}.json
+    """
+    logger.reset(context)
+    bucket = event.get("bucket", BUCKET)
+    state = load_json(bucket, STATE_KEY) or {}
+    state.setdefault("index_since", datetime.datetime.now(datetime.timezone.utc).isoformat())
+    legacy_until = parse_time(state["index_since"]) + LEGACY_LISTING_GRACE
+
+    window = state.get("in_progress")
+    if window:
+        logger.info("Resuming interrupted compaction run", run_id=window['run_id'])
+        window_start = parse_time(window["start"])
+        cutoff = parse_time(window["cutoff"])
+        segments, parquet_files = list_sources(bucket, window_start, cutoff, window_start < legacy_until)
+    else:
+        window_start = parse_time(state["watermark"]) if state.get("watermark") else EPOCH
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=SETTLE_SECONDS)
+        if cutoff <= window_start:
+            return {"statusCode": 200, "body": "Nothing to compact"}
+        segments, parquet_files = list_sources(bucket, window_start, cutoff, window_start < legacy_until)
+        cutoff = limit_window(segments, parquet_files, window_start, cutoff)
+        segments = [segment for segment in segments if segment["modified"] < cutoff]
+        parquet_files = [item for item in parquet_files if item["modified"] < cutoff]
+        if not segments and not parquet_files:
+            save_json(bucket, STATE_KEY, dict(state, watermark=cutoff.isoformat()))
+            return {"statusCode": 200, "body": "Nothing to compact"}
+        window = {
+            "run_id": cutoff.strftime("%Y%m%dT%H%M%S%fZ"),
+            "start": window_start.isoformat(),
+            "cutoff": cutoff.isoformat(),
+        }
+        save_json(bucket, STATE_KEY, dict(state, in_progress=window))
+
+    manifest_key = f"{MANIFEST_PREFIX}{window['run_id']}.json"
+    manifest = load_json(bucket, manifest_key)
+    if manifest is None:
+        outputs = compact_segments(bucket, window["run_id"], segments)
+        outputs += compact_parquet(bucket, window["run_id"], parquet_files)
+        manifest = {
+            "run_id": window["run_id"],
+            "window": {"start": window["start"], "cutoff": window["cutoff"]},
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "outputs": outputs,
+        }
+        save_json(bucket, manifest_key, manifest)
+    else:
+        logger.info("Manifest already written; skipping to source cleanup", manifest=manifest_key)
+
+    if DELETE_SOURCES:
+        sources = [key for output in manifest["outputs"] for key in output["sources"]]
+        logger.info("Deleted compacted source files", files=delete_keys(bucket, sources))
+
+    save_json(bucket, STATE_KEY, {
+        "watermark": window["cutoff"],
+        "last_manifest": manifest_key,
+        "index_since": state["index_since"],
+    })
+
+    source_count = sum(len(output["sources"]) for output in manifest["outputs"])
+    metrics.put_metric("FilesCompacted", source_count)
+    metrics.put_metric("Batches", len(manifest["outputs"]))
+    logger.info("Compaction complete", files=source_count, batches=len(manifest['outputs']), window=window)
+    return {
+        "statusCode": 200,
+        "body": f"Compacted {source_count} files into {len(manifest['outputs'])} batches",
+        "manifest": manifest_key,
+    }
+
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def load_json(bucket, key):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.load(response["Body"])
+
+
+def save_json(bucket, key, data):
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(data, indent=2),
+        ContentType='application/json'
+    )
+
+
+def split_segment_key(key):
+    """Return (segment base key, field) for a wrapup output key, or (None, None)."""
+    for suffix, field in SEGMENT_SUFFIXES.items():
+        if key.endswith(suffix):
+            return key[:-len(suffix)], field
+    return None, None
+
+
+def list_sources(bucket, window_start, cutoff, list_complete=False):
+    """
+    List the segments and Parquet files last modified inside [window_start, cutoff).
+
+    Segments are found through the index entries wrapup writes, which also
+    date them, so all files of a segment always fall in the same window.
+    With list_complete, complete/ is listed as well for the segments written
+    before the index existed.
+
+    Returns:
+        (segments, parquet_files) sorted by modification time
+    """
+    segments = list_indexed_segments(bucket, window_start, cutoff)
+    if list_complete:
+        for base_key, segment in list_complete_segments(bucket, window_start, cutoff).items():
+            segments.setdefault(base_key, segment)
+    parquet_files = list_parquet_files(bucket, window_start, cutoff) if pyarrow is not None else []
+
+    in_window = list(segments.values())
+    in_window.sort(key=lambda segment: (segment["modified"], segment["base_key"]))
+    parquet_files.sort(key=lambda item: (item["modified"], item["key"]))
+    return in_window, parquet_files
+
+
+def list_indexed_segments(bucket, window_start, cutoff):
+    """
+    Segments whose index entry was written inside [window_start, cutoff), by base key.
+
+    Entry keys start with the time they were written, so the listing starts
+    at the watermark and ends past the cutoff instead of walking every entry
+    ever written. A segment that wrapup wrote again keeps its latest entry.
+    """
+    stop_key = compaction_index_position(cutoff + INDEX_CLOCK_SKEW)
+    entries = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    pages = paginator.paginate(
+        Bucket=bucket,
+        Prefix=COMPACTION_INDEX_PREFIX,
+        StartAfter=compaction_index_position(window_start - INDEX_CLOCK_SKEW),
+    )
+    for page in pages:
+        contents = page.get('Contents', [])
+        entries += [
+            obj for obj in contents
+            if obj['Key'] < stop_key and window_start <= obj['LastModified'] < cutoff
+        ]
+        if contents and contents[-1]['Key'] >= stop_key:
+            break
+
+    segments = {}
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+        bodies = executor.map(lambda obj: json.loads(read_object(bucket, obj['Key'])), entries)
+        for obj, entry in zip(entries, bodies):
+            segment = {"base_key": entry["segment"], "files": {}, "size": 0, "modified": obj['LastModified']}
+            for key, size in entry["files"].items():
+                base_key, field = split_segment_key(key)
+                if base_key is not None:
+                    segment["files"][field] = key
+                    segment["size"] += size
+            if segment["files"]:
+                segments[entry["segment"]] = segment
+    return segments
+
+
+def list_complete_segments(bucket, window_start, cutoff):
+    """
+    Segments of complete/ last modified inside [window_start, cutoff), by base key.
+
+    A segment is dated by its newest file. This lists all of complete/, so
+    it only runs until every segment written before the index was compacted.
+    """
+    segments = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=SOURCE_PREFIX):
+        for obj in page.get('Contents', []):
+            base_key, field = split_segment_key(obj['Key'])
+            if base_key is None:
+                continue
+            segment = segments.setdefault(base_key, {"base_key": base_key, "files": {}, "size": 0, "modified": EPOCH})
+            segment["files"][field] = obj['Key']
+            segment["size"] += obj['Size']
+            segment["modified"] = max(segment["modified"], obj['LastModified'])
+    return {
+        base_key: segment for base_key, segment in segments.items()
+        if window_start <= segment["modified"] < cutoff
+    }
+
+
+def list_prefixes(bucket, prefix):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        for common_prefix in page.get('CommonPrefixes', []):
+            yield common_prefix['Prefix']
+
+
+def list_parquet_files(bucket, window_start, cutoff):
+    """
+    Parquet files last modified inside [window_start, cutoff).
+
+    Wrapup partitions them as {table}/blueprint={name}/date={yyyy-mm-dd}/ by
+    the day it wrote them, so only the partitions from the day before the
+    window start on are listed.
+    """
+    first_partition = f"date={partition_date(window_start - datetime.timedelta(days=1))}"
+    parquet_files = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for table_prefix in list_prefixes(bucket, PARQUET_PREFIX):
+        for blueprint_prefix in list_prefixes(bucket, table_prefix):
+            pages = paginator.paginate(Bucket=bucket, Prefix=blueprint_prefix, StartAfter=blueprint_prefix + first_partition)
+            for page in pages:
+                for obj in page.get('Contents', []):
+                    if obj['Key'].endswith(".parquet") and window_start <= obj['LastModified'] < cutoff:
+                        parquet_files.append({"key": obj['Key'], "size": obj['Size'], "modified": obj['LastModified']})
+    return parquet_files
+
+
+def limit_window(segments, parquet_files, window_start, cutoff):
+    """Move the cutoff back so at most MAX_SOURCES_PER_RUN sources are compacted."""
+    modified = sorted([segment["modified"] for segment in segments] + [item["modified"] for item in parquet_files])
+    if len(modified) <= MAX_SOURCES_PER_RUN:
+        return cutoff
+    limited = modified[MAX_SOURCES_PER_RUN]
+    # Everything modified at the same instant stays together; only shorten when it makes progress
+    if limited <= window_start or limited <= modified[0]:
+        return cutoff
+    logger.info("Shortening compaction window", sources=len(modified), cutoff=limited.isoformat())
+    return limited
+
+
+def partition_date(modified):
+    return modified.strftime("%Y-%m-%d")
+
+
+def plan_batches(items):
+    """Group items by partition and cut each group into batches of about TARGET_BATCH_BYTES."""
+    batches = []
+    current = {}
+    for item in items:
+        partition = item["partition"]
+        batch = current.get(partition)
+        if batch is None or batch["size"] >= TARGET_BATCH_BYTES:
+            batch = {"partition": partition, "items": [], "size": 0}
+            current[partition] = batch
+            batches.append(batch)
+        batch["items"].append(item)
+        batch["size"] += item["size"]
+    return batches
+
+
+def read_object(bucket, key):
+    return s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+
+def read_csv_fields(body):
+    """Map the header row of a wrapup CSV to its value row."""
+    rows = list(csv.reader(io.StringIO(body.decode('utf-8'))))
+    if len(rows) < 2:
+        return {}
+    return dict(zip(rows[0], rows[1]))
+
+
+def build_segment_record(segment, bodies):
+    name = segment["base_key"][len(SOURCE_PREFIX):]
+    record = {
+        "segment": name,
+        "document_id": name.split("-", 1)[0],
+        "last_modified": segment["modified"].isoformat(),
+    }
+    for field, key in segment["files"].items():
+        body = bodies[key]
+        record[field] = read_csv_fields(body) if field == "csv" else json.loads(body)
+    return record
+
+
+def compact_segments(bucket, run_id, segments):
+    """Write the segments as gzip NDJSON batches; returns the manifest entries."""
+    for segment in segments:
+        segment["partition"] = f"{COMPACTED_PREFIX}segments/date={partition_date(segment['modified'])}"
+
+    outputs = []
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+        for number, batch in enumerate(plan_batches(segments)):
+            keys = [key for segment in batch["items"] for key in segment["files"].values()]
+            bodies = dict(zip(keys, executor.map(lambda key: read_object(bucket, key), keys)))
+
+            buffer = io.BytesIO()
+            with gzip.GzipFile(fileobj=buffer, mode="wb") as writer:
+                for segment in batch["items"]:
+                    line = json.dumps(build_segment_record(segment, bodies), separators=(",", ":"))
+                    writer.write(line.encode('utf-8') + b"\n")
+
+            key = f"{batch['partition']}/{run_id}-{number:05d}.ndjson.gz"
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=buffer.getvalue(),
+                ContentType='application/x-ndjson',
+                ContentEncoding='gzip'
+            )
+            outputs.append({
+                "key": key,
+                "format": "ndjson",
+                "records": len(batch["items"]),
+                "source_bytes": batch["size"],
+                "sources": keys,
+            })
+    return outputs
+
+
+def compact_parquet(bucket, run_id, parquet_files):
+    """Merge the wrapup Parquet files of each partition; returns the manifest entries."""
+    for item in parquet_files:
+        item["partition"] = COMPACTED_PREFIX + item["key"][:item["key"].rfind("/")]
+
+    outputs = []
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+        for number, batch in enumerate(plan_batches(parquet_files)):
+            keys = [item["key"] for item in batch["items"]]
+            tables = [
+                pyarrow.parquet.read_table(io.BytesIO(body))
+                for body in executor.map(lambda key: read_object(bucket, key), keys)
+            ]
+            # Blueprints gain fields over time; missing columns become nulls
+            table = pyarrow.concat_tables(tables, promote_options="default")
+            buffer = io.BytesIO()
+            pyarrow.parquet.write_table(table, buffer, compression="snappy")
+
+            key = f"{batch['partition']}/{run_id}-{number:05d}.parquet"
+            s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+            outputs.append({
+                "key": key,
+                "format": "parquet",
+                "records": table.num_rows,
+                "source_bytes": batch["size"],
+                "sources": keys,
+            })
+    return outputs
+
+
+def delete_keys(bucket, keys):
+    deleted = 0
+    for start in range(0, len(keys), 1000):
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]]}
+        )
+        deleted += len(response.get('Deleted', []))
+        for error in response.get('Errors', []):
+            logger.error("Error deleting object", key=error['Key'], code=error['Code'], error=error['Message'])
+    return deleted
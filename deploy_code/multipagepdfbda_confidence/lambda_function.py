@@ -17,11 +17,24 @@
 #  */
 
 import json
-import boto3
 import os
 import copy
 
+from multipagepdfbda_common import checkpoint
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.metrics import blueprint_name, emits_metrics, get_metrics, size_bucket
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.s3_paths import parse_s3_uri
+from multipagepdfbda_common.structured_log import get_logger
+from multipagepdfbda_common.timeline import now_ms, record_span
+
+logger = get_logger()
+metrics = get_metrics()
+
+@profiled
+@emits_metrics
 def lambda_handler(event, context):
+    started = now_ms()
     # Configuration
     CONFIDENCE_THRESHOLD = float(os.environ.get('CONFIDENCE_THRESHOLD', '0.7'))
     
@@ -36,9 +49,7 @@ def lambda_handler(event, context):
         }
     
     # Parse S3 URI
-    s3_uri_parts = segment_uri.replace('s3://', '').split('/')
-    bucket = s3_uri_parts[0]
-    key = '/'.join(s3_uri_parts[1:])
+    bucket, key = parse_s3_uri(segment_uri)
     
     # Extract segment index from the path
     # Assuming path format: .../custom_output/{segment_index}/result.json
@@ -51,9 +62,10 @@ def lambda_handler(event, context):
                 break
             except:
                 pass
+    logger.reset(context, id=event.get('id'), segment=segment_index)
     
     # Get custom output from S3
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     try:
         custom_response = s3.get_object(Bucket=bucket, Key=key)
         custom_output = json.loads(custom_response['Body'].read().decode('utf-8'))
@@ -68,7 +80,7 @@ def lambda_handler(event, context):
         # Store inference_result if available
         if 'inference_result' in custom_output:
             inference_result = custom_output['inference_result']
-            print(f"Found inference_result in custom output")
+            logger.debug("Found inference_result in custom output")
         
         # Store multi-page document information if available
         if 'split_document' in custom_output:
@@ -78,7 +90,7 @@ def lambda_handler(event, context):
                 if len(image_keys) > 0:
                     page_index = image_keys[0]
                 
-                print(f"Multi-page document detected with pages: {image_keys}")
+                logger.info("Multi-page document detected", pages=image_keys)
         
         # Process all fields in explainability_info
         if 'explainability_info' in custom_output:
@@ -98,6 +110,7 @@ def lambda_handler(event, context):
             'page_index': page_index,
             'segment_index': segment_index,
             'image_keys': image_keys,  # Add the image_keys to the result
+            'matched_blueprint': custom_output.get('matched_blueprint', {}),
             'a2i_input': "none"
         }
         
@@ -119,16 +132,62 @@ def lambda_handler(event, context):
             a2i_input = create_a2i_input_content(custom_output, all_fields)
             result['a2i_input'] = a2i_input
         
+        checkpoint.save(event.get('id'), f"segment#{segment_index}", needs_a2i=needs_a2i, pages=image_keys,
+                        blueprint=blueprint_name(result['matched_blueprint']))
+        if (event.get('resume') or {}).get('attempt'):
+            apply_checkpoints(result, event)
+        
+        logger.info("Checked segment confidence", needs_a2i=needs_a2i, fields=len(all_fields), pages=image_keys)
+        metrics.put_dimensions(
+            Blueprint=blueprint_name(result['matched_blueprint']),
+            SizeBucket=size_bucket(len(image_keys) or 1)
+        )
+        # The average of NeedsReview is the share of segments sent to human review
+        metrics.put_metric("NeedsReview", int(needs_a2i))
+        metrics.put_metric("FieldsChecked", len(all_fields))
+        metrics.put_metric("LowConfidenceFields", sum(field['confidence'] < CONFIDENCE_THRESHOLD for field in all_fields))
+        metrics.put_metric("Pages", len(image_keys) or 1)
+        record_span(event.get('id'), "confidence", started, segment=segment_index, pages=image_keys, needs_review=needs_a2i)
         return result
     
     except Exception as e:
-        print(f"Error processing custom output: {str(e)}")
+        logger.exception("Error processing custom output")
         return {
             'needs_a2i': True,
             'reason': f'Error processing custom output: {str(e)}',
             'page_index': segment_index
         }
 
+def apply_checkpoints(result, event):
+    """
+    Mark the segment of a resumed execution with what earlier attempts finished:
+    resume_stage "written" and the wrapup_result when its outputs were
+    written, or "reviewed" and a review_result when every page of it was
+    reviewed. Otherwise the segment runs as usual.
+    """
+    try:
+        checkpoints = checkpoint.load(event['id'])
+    except Exception as e:
+        # Without checkpoints the segment is processed, and reviewed, again
+        logger.warning("Could not load checkpoints", error=str(e))
+        return
+    written = checkpoints.get(f"wrapup#{result['segment_index']}")
+    if written:
+        result['resume_stage'] = 'written'
+        result['wrapup_result'] = written['outputs']
+    elif result['needs_a2i']:
+        pages = {str(page) for page in result['image_keys'] or [result['page_index']]}
+        if pages <= checkpoint.completed_pages(checkpoints):
+            result['resume_stage'] = 'reviewed'
+            # What humancomplete sends with the task token
+            result['review_result'] = {
+                'includes_human': 'yes',
+                'bucket': event.get('bucket'),
+                'id': event.get('id'),
+                'key': event.get('key'),
+            }
+    logger.info("Resuming segment", resume_stage=result.get('resume_stage', 'none'))
+
 def create_a2i_input_content(custom_output, all_fields):
     """
     Create the input content for A2I workflow based on the custom output and processed fields
@@ -245,7 +304,7 @@ def process_explainability_info(explainability_info, threshold):
                             
                             # Check if confidence is below threshold and log it
                             if confidence < threshold:
-                                print(f"Low confidence field: {field_path}, confidence: {confidence}, threshold: {threshold}")
+                                logger.debug("Low confidence field", field=field_path, confidence=confidence, threshold=threshold)
                                 result['has_low_confidence'] = True
             
             # If this is a nested structure with multiple fields
@@ -303,7 +362,7 @@ def process_explainability_info(explainability_info, threshold):
                         
                         # Check if confidence is below threshold and log it
                         if confidence < threshold:
-                            print(f"Low confidence field: {field_path}, confidence: {confidence}, threshold: {threshold}")
+                            logger.debug("Low confidence field", field=field_path, confidence=confidence, threshold=threshold)
                             result['has_low_confidence'] = True
             
             # If this is a simple field
@@ -343,7 +402,7 @@ def process_explainability_info(explainability_info, threshold):
                 
                 # Check if confidence is below threshold and log it
                 if confidence < threshold:
-                    print(f"Low confidence field: {field_name}, confidence: {confidence}, threshold: {threshold}")
+                    logger.debug("Low confidence field", field=field_name, confidence=confidence, threshold=threshold)
                     result['has_low_confidence'] = True
     
     return result
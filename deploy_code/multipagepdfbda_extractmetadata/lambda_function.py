@@ -17,15 +17,25 @@
 #  */
 
 
-import boto3
 import json
 
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.metrics import emits_metrics, get_metrics
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.s3_paths import parse_s3_uri
+from multipagepdfbda_common.structured_log import get_logger
+
+logger = get_logger()
+metrics = get_metrics()
+
+@profiled
+@emits_metrics
 def lambda_handler(event, context):
-    print(event)    
     payload = event.get('Payload', {})
-    print(f"payload: {payload}")
+    logger.reset(context, id=payload.get('id'))
+    logger.debug("Received event", event=event)
     bda_results = payload.get('bda_results', {})
-    print(f"bda_results: {bda_results}")
+    logger.info("Reading BDA job metadata", bda_results=bda_results)
     job_metadata_uri = bda_results.get('job_metadata_uri')
     
     if not job_metadata_uri:
@@ -35,30 +45,34 @@ def lambda_handler(event, context):
         }
     
     # Parse S3 URI
-    s3_uri_parts = job_metadata_uri.replace('s3://', '').split('/')
-    bucket = s3_uri_parts[0]
-    key = '/'.join(s3_uri_parts[1:])
+    bucket, key = parse_s3_uri(job_metadata_uri)
     
     # Get job metadata from S3
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     try:
         response = s3.get_object(Bucket=bucket, Key=key)
         job_metadata = json.loads(response['Body'].read().decode('utf-8'))
         
         # Extract all segment metadata URIs
         segment_uris = []
+        unmatched = 0
         for segment in job_metadata.get('output_metadata', []):
             for segment_metadata in segment.get('segment_metadata', []):
                 if 'custom_output_status' in segment_metadata and segment_metadata['custom_output_status'] == 'MATCH':
                     # Add the direct URI to the list
                     segment_uris.append(segment_metadata['custom_output_path'])
+                else:
+                    unmatched += 1
         
+        logger.info("Found matched segments", segments=len(segment_uris), unmatched=unmatched)
+        metrics.put_metric("Segments", len(segment_uris))
+        metrics.put_metric("UnmatchedSegments", unmatched)
         return {
             'segment_uris': segment_uris
         }
         
     except Exception as e:
-        print(f"Error retrieving job metadata: {str(e)}")
+        logger.exception("Error retrieving job metadata", job_metadata_uri=job_metadata_uri)
         return {
             'segment_uris': [],
             'error': f'Error retrieving job metadata: {str(e)}'
@@ -18,10 +18,40 @@
 
 
 import json
-import boto3
 import os
-from boto3.dynamodb.conditions import Key
+import time
+import random
 import decimal
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
+
+from multipagepdfbda_common import checkpoint, inflight
+from multipagepdfbda_common.aws_clients import get_client, get_resource
+from multipagepdfbda_common.metrics import emits_metrics, get_metrics
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.s3_paths import HUMAN_DELTA_SUFFIX, page_image_key, parse_s3_uri, split_human_loop_name
+from multipagepdfbda_common.structured_log import get_logger
+from multipagepdfbda_common.timeline import record_span
+
+# Sort key of the per-document completion counter item in the callback table
+DOCUMENT_COUNTER_SORT_KEY = "document"
+
+# Callback fan-out settings
+CALLBACK_CONCURRENCY = int(os.environ.get('callback_concurrency', '10'))
+CALLBACK_MAX_ATTEMPTS = int(os.environ.get('callback_max_attempts', '5'))
+CALLBACK_BACKOFF_BASE_SECONDS = 0.2
+
+# The task already finished or timed out; retrying cannot succeed
+CLOSED_TOKEN_ERRORS = {'TaskTimedOut', 'InvalidToken', 'TaskDoesNotExist'}
+RETRYABLE_CALLBACK_ERRORS = {'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailable', 'InternalFailure', 'RequestTimeout'}
+
+def get_sfn_client():
+    # Retries are handled per token in send_token_with_retry
+    return get_client('stepfunctions', max_pool_connections=CALLBACK_CONCURRENCY, retries={'total_max_attempts': 1})
+
+logger = get_logger()
+metrics = get_metrics()
 
 # Helper class to convert Decimal to int/float for JSON serialization
 class DecimalEncoder(json.JSONEncoder):
@@ -31,175 +61,271 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(o)
 
 
-def return_to_stepfunctions(payload):
-    client = boto3.client('stepfunctions')
+def send_token_with_retry(token, send):
+    """
+    Deliver a result for one token, retrying throttling and transient errors
+    with exponential backoff and full jitter.
+
+    Args:
+        token: The task token
+        send: Callable that performs the Step Functions call for the token
+
+    Returns:
+        (outcome, detail) where outcome is "delivered", "closed" (the task no
+        longer accepts a result) or "failed" (not delivered; can be retried later).
+    """
+    detail = None
+    for attempt in range(CALLBACK_MAX_ATTEMPTS):
+        try:
+            send(token)
+            return "delivered", None
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            detail = f"{code}: {e.response['Error'].get('Message', '')}"
+            if code in CLOSED_TOKEN_ERRORS:
+                return "closed", detail
+            if code not in RETRYABLE_CALLBACK_ERRORS:
+                return "failed", detail
+        except BotoCoreError as e:
+            detail = str(e)
+        if attempt < CALLBACK_MAX_ATTEMPTS - 1:
+            time.sleep(random.uniform(0, CALLBACK_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    return "failed", detail
+
+def fan_out_callbacks(tokens, send):
+    """
+    Run `send` for every token concurrently with bounded parallelism.
+
+    Returns:
+        Dict mapping each token to its (outcome, detail) pair.
+    """
+    if not tokens:
+        return {}
     
+    with ThreadPoolExecutor(max_workers=min(CALLBACK_CONCURRENCY, len(tokens))) as executor:
+        results = executor.map(lambda token: send_token_with_retry(token, send), tokens)
+        outcomes = dict(zip(tokens, results))
+    
+    for token, (outcome, detail) in outcomes.items():
+        if outcome != "delivered":
+            logger.warning("Callback was not delivered", token_suffix=token[-8:], outcome=outcome, detail=detail)
+    return outcomes
+
+def return_to_stepfunctions(payload):
+    """Send task success for every waiting token of the document."""
     # If payload contains a list of tokens, process each one
     tokens = payload['tokens'] if isinstance(payload['tokens'], list) else [payload['tokens']]
-    responses = []
-    
-    for token in tokens:
-        response = client.send_task_success(
-            taskToken = token,
-            output = json.dumps({ 
-                "includes_human": "yes",
-                "output_dest": payload["final_dest"],
-                "bucket": payload["bucket"],
-                "id": payload["id"],
-                "key": payload["key"]
-            })
-        )
-        responses.append(response)
+    output = json.dumps({ 
+        "includes_human": "yes",
+        "output_dest": payload["final_dest"],
+        "bucket": payload["bucket"],
+        "id": payload["id"],
+        "key": payload["key"]
+    })
+    sfn_client = get_sfn_client()
+    return fan_out_callbacks(tokens, lambda token: sfn_client.send_task_success(taskToken=token, output=output))
+
+def fail_waiting_tasks(tokens, error, cause):
+    """Send task failure for every waiting token of the document."""
+    # Step Functions limits error to 256 and cause to 32768 characters
+    sfn_client = get_sfn_client()
+    return fan_out_callbacks(
+        tokens,
+        lambda token: sfn_client.send_task_failure(taskToken=token, error=error[:256], cause=cause[:32768])
+    )
+
+def record_delivery_outcomes(document_id, outcomes):
+    """
+    Persist callback outcomes on the document counter item.
+
+    Delivered and closed tokens are added to sets so a later retry only sends
+    the remaining ones. `delivery_retry` marks the document as having tokens
+    that still need to be sent.
+    """
+    delivered = {token for token, (outcome, _) in outcomes.items() if outcome == "delivered"}
+    closed = {token for token, (outcome, _) in outcomes.items() if outcome == "closed"}
+    pending = len(outcomes) - len(delivered) - len(closed)
+    
+    update_expression = "SET delivery_retry = :retry"
+    values = {':retry': pending > 0}
+    add_clauses = []
+    if delivered:
+        add_clauses.append("delivered_tokens :delivered")
+        values[':delivered'] = delivered
+    if closed:
+        add_clauses.append("closed_tokens :closed")
+        values[':closed'] = closed
+    if add_clauses:
+        update_expression += " ADD " + ", ".join(add_clauses)
     
-    return responses    
+    get_callback_table().update_item(
+        Key={
+            'jobid': document_id,
+            'callback_token': DOCUMENT_COUNTER_SORT_KEY
+        },
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=values
+    )
+    logger.info("Recorded callback outcomes", delivered=len(delivered), closed=len(closed), pending=pending)
+    return pending
 
 def write_to_s3_human_response(payload):
-    client = boto3.client('s3')
-    print(payload["final_dest"])
-    print(payload["kv_list"])
-    print(payload["bucket"])
+    client = get_client('s3')
+    delta = payload["delta"]
+    logger.info("Writing review delta", changed_fields=len(delta['changes']), reviewed_fields=delta['reviewed_fields'], key=payload['final_dest'])
     response = client.put_object(
-        Body = json.dumps(payload["kv_list"]),
+        Body = json.dumps(delta),
         Bucket = payload["bucket"],
         Key = payload["final_dest"]
     )
     return response
 
-def create_human_kv_list(payload):
-    data = payload["response"]["humanAnswers"][0]["answerContent"]
-    print(data)
-    return data
+def normalize_answer(value):
+    return "" if value is None else str(value).strip()
+
+def build_review_delta(payload):
+    """
+    Reduce the reviewer's answers to the fields they changed.
+
+    The labels of the human loop input hold the values the reviewer was shown,
+    so a field is a change when its answer differs from its label value.
+    Unchanged fields are only listed by name; wrapup materializes the full
+    human view by applying the changes to the AI output.
+
+    Returns:
+        dict with the reviewer, submission time, the reviewed field names and
+        a list of {"field", "old", "new"} changes keyed by flattened field path
+    """
+    response = payload["response"]
+    answer = response["humanAnswers"][0]
+    answers = answer["answerContent"]
+    shown_values = {label["name"]: label.get("value") for label in response["inputContent"].get("labels", [])}
+    
+    changes = [
+        {"field": field, "old": shown_values.get(field), "new": value}
+        for field, value in answers.items()
+        if normalize_answer(value) != normalize_answer(shown_values.get(field))
+    ]
+    return {
+        "human_loop": payload["human_loop_id"],
+        "reviewer": answer.get("workerId"),
+        "submitted_at": answer.get("submissionTime"),
+        "time_spent_seconds": answer.get("timeSpentInSeconds"),
+        "reviewed_fields": len(answers),
+        "reviewed": list(answers),
+        "changes": changes,
+    }
     
 def get_s3_data(payload):
-    s3 = boto3.resource('s3')
-    obj = s3.Object(payload["bucket"], payload["key"])
-    body = obj.get()['Body'].read()
-    return json.loads(body)
+    response = get_client('s3').get_object(Bucket=payload["bucket"], Key=payload["key"])
+    return json.loads(response['Body'].read())
 
 
 
-def get_token_and_check_completion(payload):
+def mark_page_complete(table, document_id, human_loop_id):
     """
-    Get the task tokens and check if all pages of the document have been reviewed.
-    Only returns the tokens if all pages are complete.
-    Uses begins_with on the document ID prefix to find all pages.
-    Returns a list of unique tokens instead of a single token.
+    Atomically count one reviewed page against the document counter item.
+
+    The update only applies when the page is registered for the document and
+    has not been counted yet, so a redelivered completion event is rejected
+    by the condition instead of being counted twice.
+
+    Returns:
+        The counter item after the update, or None if the event was a duplicate
+        or the page is unknown.
     """
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(os.environ['ddb_tablename'])
-    
-    # Extract the document ID prefix (remove the last 2 characters which should be 'iX')
-    # The human_loop_id format is typically {document_id}i{page_number}
-    document_id_prefix = payload["human_loop_id"][:-2]  # Remove the last 2 chars (e.g., 'i0', 'i1')
-    
-    print(f"Processing completion for document prefix {document_id_prefix}, current page {payload['human_loop_id']}")
-    
-    # Mark this page as complete by updating the existing record
     try:
-        # First get the current record to extract its callback_token (sort key)
-        current_page_response = table.query(KeyConditionExpression=Key('jobid').eq(payload["human_loop_id"]))
-        
-        if not current_page_response['Items']:
-            print(f"No record found for job ID {payload['human_loop_id']}")
-            return None, None
-            
-        current_item = current_page_response['Items'][0]
-        callback_token = current_item['callback_token']
-        
-        # Update the existing record with the correct primary key
-        table.update_item(
+        response = table.update_item(
             Key={
-                'jobid': payload["human_loop_id"],
-                'callback_token': callback_token
+                'jobid': document_id,
+                'callback_token': DOCUMENT_COUNTER_SORT_KEY
             },
-            UpdateExpression="set is_complete = :i",
+            UpdateExpression="ADD completed :one, completed_pages :page",
+            ConditionExpression="contains(pages, :loop) AND NOT contains(completed_pages, :loop)",
             ExpressionAttributeValues={
-                ':i': True
-            }
+                ':one': 1,
+                ':page': {human_loop_id},
+                ':loop': human_loop_id
+            },
+            ReturnValues="ALL_NEW"
         )
-        print(f"Marked page {payload['human_loop_id']} as complete in DynamoDB")
-    except Exception as e:
-        print(f"Error marking page as complete: {str(e)}")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.info("Page is already counted or not registered", human_loop=human_loop_id)
+            return None
+        raise
+    return response['Attributes']
+
+def get_callback_table():
+    return get_resource('dynamodb').Table(os.environ['ddb_tablename'])
+
+def get_undelivered_tokens(counter):
+    """Tokens of the document that have neither been delivered nor closed."""
+    done = set(counter.get('delivered_tokens', set())) | set(counter.get('closed_tokens', set()))
+    return [token for token in counter['tokens'] if token not in done]
+
+def get_token_and_check_completion(payload):
+    """
+    Mark the current page as reviewed and check if all pages of the document are done.
+
+    Each completion event performs a single conditional ADD on the per-document
+    counter item. `completed` only grows by one per distinct page, so exactly one
+    event observes `completed == len(pages)`; only that event returns the tokens.
+    A replay of an already counted event returns the tokens that are still
+    undelivered when a previous fan-out left some behind.
+
+    Returns:
+        (tokens, extension) when callbacks should be sent, otherwise (None, None).
+    """
+    table = get_callback_table()
     
-    # Find all pages for this document using begins_with on the document ID prefix
-    try:
-        # Query the GSI for all items with this document_id
-        all_pages_response = table.query(
-            IndexName='document_id-index',
-            KeyConditionExpression=Key('document_id').eq(document_id_prefix)
+    document_id = payload["id"]
+    logger.info("Processing page completion")
+    
+    counter = mark_page_complete(table, document_id, payload["human_loop_id"])
+    if counter is None:
+        response = table.get_item(
+            Key={'jobid': document_id, 'callback_token': DOCUMENT_COUNTER_SORT_KEY},
+            ConsistentRead=True
         )
-        
-        print(f"Found {len(all_pages_response['Items'])} pages for document prefix {document_id_prefix}")
-        
-        # Check if all pages are complete
-        all_pages_complete = True
-        extension = None
-        
-        # First check if all pages are complete
-        for page_item in all_pages_response['Items']:
-            page_id = page_item['jobid']
-            is_complete = page_item.get('is_complete', False)
-            
-            # Capture extension from any page (should be the same for all pages of this document)
-            if extension is None:
-                extension = page_item.get('extension', '')
-                
-            print(f"Page {page_id}: is_complete = {is_complete}")
-            
-            if not is_complete:
-                all_pages_complete = False
-                print(f"Page {page_id} is not yet complete")
-                break
-        
-        if all_pages_complete:
-            # If all pages are complete, collect all unique tokens
-            # Use a set to automatically remove duplicates
-            unique_tokens = set()
-            for page_item in all_pages_response['Items']:
-                token = page_item.get('callback_token')
-                if token:
-                    unique_tokens.add(token)
-            
-            # Convert set back to list
-            tokens = list(unique_tokens)
-            
-            print(f"All {len(all_pages_response['Items'])} pages for document prefix {document_id_prefix} are complete.")
-            print(f"Collected {len(tokens)} unique tokens from {len(all_pages_response['Items'])} pages.")
-            return tokens, extension
-        else:
-            print(f"Not all pages for document prefix {document_id_prefix} are complete yet. Waiting for remaining pages.")
-            return None, None
-            
-    except Exception as e:
-        print(f"Error checking page completion: {str(e)}")
+        counter = response.get('Item')
+        if counter and counter.get('delivery_retry'):
+            tokens = get_undelivered_tokens(counter)
+            logger.info("Retrying undelivered callbacks", tokens=len(tokens))
+            return tokens, counter.get('extension', '')
         return None, None
+    
+    completed = int(counter['completed'])
+    total = len(counter['pages'])
+    logger.info("Counted reviewed page", completed=completed, total=total)
+    
+    if completed < total:
+        logger.info("Waiting for remaining pages")
+        return None, None
+    
+    tokens = get_undelivered_tokens(counter)
+    logger.info("All pages are complete", total=total, tokens=len(tokens))
+    return tokens, counter.get('extension', '')
 
 def create_final_dest(id, key,extension):
     prefix = key[:3].lower()
     if prefix != "wip":
-        final_dest = "wip/" + id + "/0"  + extension 
+        final_dest = page_image_key(id, 0, extension)
     else:
         final_dest = key
-    return final_dest + "/human/output.json"
+    return final_dest + HUMAN_DELTA_SUFFIX
 
 def create_payload(event):
     payload = {}
     detail = event["detail"]
-    cur = detail["humanLoopOutput"]["outputS3Uri"]
-    
-    cur = cur.replace("s3://", "")
-    payload["bucket"] = cur[:cur.find("/")]
-    payload["key"] = cur[len(payload["bucket"])+1:]
+    payload["bucket"], payload["key"] = parse_s3_uri(detail["humanLoopOutput"]["outputS3Uri"])
 
     payload["response"] = get_s3_data(payload)
     
-    cur1 = payload["response"]["inputContent"]["taskObject"]
-    cur1 = cur1.replace("s3://", "")
-    payload["bucket1"] = cur1[:cur1.find("/")]
-    payload["key1"] = cur1[len(payload["bucket1"])+1:]
+    payload["bucket1"], payload["key1"] = parse_s3_uri(payload["response"]["inputContent"]["taskObject"])
     
     payload["human_loop_id"] = payload["response"]["humanLoopName"]
-    payload["id"] = payload["human_loop_id"][:payload["human_loop_id"].rfind("i")]
+    payload["id"], _ = split_human_loop_name(payload["human_loop_id"])
 
     
     # Get tokens only if all pages are complete
@@ -211,22 +337,95 @@ def create_payload(event):
     
     return payload
 
+def reset_logger(event, context):
+    """Bind the document and page of the human loop in the event."""
+    human_loop_name = event.get("detail", {}).get("humanLoopName")
+    document_id, page = split_human_loop_name(human_loop_name) if human_loop_name else (None, None)
+    logger.reset(context, id=document_id, page=page, human_loop=human_loop_name)
+    logger.debug("Received event", event=event)
+
+def save_review_checkpoint(human_loop_name, status, **fields):
+    """Record the outcome of the review of a page, so a resumed execution can skip it."""
+    document_id, page = split_human_loop_name(human_loop_name)
+    checkpoint.save(document_id, f"review#{page}", human_loop=human_loop_name, status=status, **fields)
+
+def parse_event_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def put_review_wait(event):
+    """Time from the creation of the human loop to this status change, i.e. the A2I wait."""
+    created = event["detail"].get("creationTime")
+    if created and event.get("time"):
+        wait = parse_event_time(event["time"]) - parse_event_time(created)
+        metrics.put_metric("ReviewWaitTime", wait.total_seconds(), "Seconds")
+        document_id, page = split_human_loop_name(event["detail"]["humanLoopName"])
+        record_span(document_id, "review", created, event["time"], page=int(page) if page.isdigit() else page, status=event["detail"]["humanLoopStatus"])
+
+@profiled
+@emits_metrics
 def lambda_handler(event, context):
-    print(event)
+    reset_logger(event, context)
+    put_review_wait(event)
+    inflight.release("review", event["detail"]["humanLoopName"])
     if event["detail"]["humanLoopStatus"] == "Completed":
         payload = create_payload(event)
-        payload["kv_list"] = create_human_kv_list(payload)
+        payload["delta"] = build_review_delta(payload)
+        metrics.put_metric("FieldsReviewed", payload["delta"]["reviewed_fields"])
+        metrics.put_metric("FieldsChanged", len(payload["delta"]["changes"]))
         
         # Always write the human review results to S3
-        response = write_to_s3_human_response(payload)
+        write_to_s3_human_response(payload)
+        save_review_checkpoint(payload["human_loop_id"], "Completed", delta_key=payload["final_dest"])
         
         # Only return to Step Functions if all pages are complete (tokens is not None)
         if payload.get("tokens") != None:
-            print("all pages complete")
-            print(f"Processing {len(payload['tokens'])} tokens")
-            response = return_to_stepfunctions(payload)
+            logger.info("Returning to Step Functions", tokens=len(payload['tokens']))
+            outcomes = return_to_stepfunctions(payload)
+            pending = record_delivery_outcomes(payload["id"], outcomes)
+            if pending:
+                # Fail the invocation so Lambda retries the event; the replay only
+                # sends the tokens that are still undelivered
+                raise RuntimeError(f"{pending} callbacks for document {payload['id']} are still pending")
             return "all done - all pages complete"
         else:
             return "page processed - waiting for remaining pages"
     else:
-        return "dont_care"
\ No newline at end of file
+        # The EventBridge rule only routes Completed loops here
+        return "dont_care"
+
+@profiled
+@emits_metrics
+def failed_loop_handler(event, context):
+    """
+    Fail the waiting task tokens of a document whose human loop Failed or was Stopped.
+
+    Without this the execution would wait on the token until the task times out.
+    """
+    reset_logger(event, context)
+    put_review_wait(event)
+    inflight.release("review", event["detail"]["humanLoopName"])
+    metrics.add("FailedHumanLoops", 1)
+    detail = event["detail"]
+    human_loop_name = detail["humanLoopName"]
+    document_id, _ = split_human_loop_name(human_loop_name)
+    status = detail["humanLoopStatus"]
+    save_review_checkpoint(human_loop_name, status)
+    
+    response = get_callback_table().get_item(
+        Key={'jobid': document_id, 'callback_token': DOCUMENT_COUNTER_SORT_KEY},
+        ConsistentRead=True
+    )
+    counter = response.get('Item')
+    if not counter:
+        logger.info("No waiting tasks registered")
+        return "no waiting tasks"
+    
+    tokens = get_undelivered_tokens(counter)
+    cause = detail.get("failureReason") or f"Human loop {human_loop_name} is {status}"
+    logger.warning("Failing waiting tasks", status=status, tokens=len(tokens))
+    
+    outcomes = fail_waiting_tasks(tokens, f"HumanLoop{status}", cause)
+    pending = record_delivery_outcomes(document_id, outcomes)
+    if pending:
+        raise RuntimeError(f"{pending} task failures for document {document_id} are still pending")
+    return f"failed {len(tokens)} waiting tasks"
\ No newline at end of file
@@ -18,12 +18,25 @@
 
 
 import json
-import boto3
 import os
 import time
 
+from multipagepdfbda_common import checkpoint, inflight
+from multipagepdfbda_common.aws_clients import build_arn, get_account_id, get_client
+from multipagepdfbda_common.metrics import emits_metrics, get_metrics
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.s3_paths import to_s3_uri
+from multipagepdfbda_common.structured_log import get_logger
+from multipagepdfbda_common.timeline import now_ms, record_span
+
+logger = get_logger()
+metrics = get_metrics()
+
+@profiled
+@emits_metrics
 def lambda_handler(event, context):
-    print(event)
+    logger.reset(context, id=event.get('id'))
+    logger.debug("Received event", event=event)
     # Configuration
     AWS_REGION = os.environ.get('REGION')
     BUCKET_NAME = event.get('bucket')
@@ -34,31 +47,39 @@ def lambda_handler(event, context):
     key = event.get('key')
     file_name = key.split('/')[-1]
     
-    # AWS SDK clients
-    bda = boto3.client('bedrock-data-automation-runtime', region_name=AWS_REGION)
-    sts = boto3.client('sts')
+    # AWS SDK client, reused across warm invocations
+    bda = get_client('bedrock-data-automation-runtime')
     
-    # Get AWS account ID
-    aws_account_id = sts.get_caller_identity().get('Account')
+    # Account ID from the function ARN, no STS call
+    aws_account_id = get_account_id(context)
     
     # Set up S3 URIs
-    input_s3_uri = f"s3://{BUCKET_NAME}/{key}"  # Full path to the file
-    print(input_s3_uri)
-    print(BUCKET_NAME)
-    output_s3_uri = f"s3://{BUCKET_NAME}/{OUTPUT_PATH}"  # Output folder
-    data_automation_arn = f"arn:aws:bedrock:{AWS_REGION}:{aws_account_id}:data-automation-project/{PROJECT_ID}"
+    input_s3_uri = to_s3_uri(BUCKET_NAME, key)  # Full path to the file
+    # Output folder per document, so the orphan sweeper can match BDA output to its execution
+    output_s3_uri = to_s3_uri(BUCKET_NAME, f"{OUTPUT_PATH}/{event.get('id')}")
+    data_automation_arn = build_arn("bedrock", f"data-automation-project/{PROJECT_ID}", context, AWS_REGION)
     
-    print(f"Invoking Bedrock Data Automation for '{file_name}'")
+    logger.info("Invoking Bedrock Data Automation", file_name=file_name, input_s3_uri=input_s3_uri, output_s3_uri=output_s3_uri)
     
-    # Invoke BDA
-    response = invoke_data_automation(input_s3_uri, output_s3_uri, data_automation_arn, aws_account_id, bda,AWS_REGION)
-    invocation_arn = response['invocationArn']
-    
-    # Wait for completion
-    data_automation_status = wait_for_data_automation_to_complete(invocation_arn, bda)
+    # Invoke BDA, counted as in flight for kickoff's backpressure until it ends
+    bda_started = now_ms()
+    inflight.acquire("bda", event.get('id'))
+    try:
+        response = invoke_data_automation(input_s3_uri, output_s3_uri, data_automation_arn, aws_account_id, bda,AWS_REGION)
+        invocation_arn = response['invocationArn']
+        
+        # Wait for completion; the time spent waiting on BDA, including its queue
+        with metrics.timer("BdaJobDuration"):
+            data_automation_status = wait_for_data_automation_to_complete(invocation_arn, bda)
+    finally:
+        inflight.release("bda", event.get('id'))
+    metrics.add("BdaJobsFailed", int(data_automation_status['status'] != 'Success'))
+    record_span(event.get('id'), "bda_job", bda_started, status=data_automation_status['status'])
     
     if data_automation_status['status'] == 'Success':
         job_metadata_s3_uri = data_automation_status['outputConfiguration']['s3Uri']
+        # A resumed execution starts from this output instead of paying for the job again
+        checkpoint.save(event.get('id'), "bda", job_metadata_uri=job_metadata_s3_uri)
         
         # Return the results
         return {
@@ -97,7 +118,6 @@ def wait_for_data_automation_to_complete(invocation_arn, bda_client, loop_time_i
         )
         status = response['status']
         if status not in ['Created', 'InProgress']:
-            print(f"BDA processing completed with status: {status}")
+            logger.info("BDA processing completed", status=status, invocation_arn=invocation_arn)
             return response
-        print(".", end='', flush=True)
         time.sleep(loop_time_in_seconds)
\ No newline at end of file
@@ -18,29 +18,88 @@
 
 
 import json
-import boto3
-import uuid
+import hashlib
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote, unquote_plus
 
+from multipagepdfbda_common import inflight
+from multipagepdfbda_common.aws_clients import get_client, queue_url
+from multipagepdfbda_common.metrics import emits_metrics, get_metrics
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.structured_log import get_logger
+from multipagepdfbda_common.timeline import now_ms, record_upload, to_ms
+
+START_CONCURRENCY = int(os.environ.get("start_concurrency", "10"))
+
+# Backpressure: above these many BDA jobs or human loops in flight, no new
+# documents are started; 0 means no limit. See multipagepdfbda_common.inflight
+MAX_INFLIGHT = {
+    "bda": int(os.environ.get("max_inflight_bda", "0")),
+    "review": int(os.environ.get("max_inflight_reviews", "0")),
+}
+BACKPRESSURE_DELAY = int(os.environ.get("backpressure_delay_seconds", "60"))
+MAX_BACKPRESSURE_DELAY = 900
+
+# Allowed clock difference between Lambda and Step Functions when telling a
+# new execution from a running one started by an earlier delivery
+START_CLOCK_SKEW_MS = 1000
+
+logger = get_logger()
+metrics = get_metrics()
+
 def start_step_function(payload):
-    client = boto3.client('stepfunctions')
-    response = client.start_execution(
-        stateMachineArn=os.environ['state_machine_arn'],
-        name = payload["id"],
-        input = json.dumps(payload, indent=3, default=str),
-    )
-    return response
+    """
+    Start the execution of one document.
+
+    The execution is named after the document id and its input is
+    deterministic. A duplicate notification for the same object version is
+    rejected by Step Functions only once that execution has closed. While it
+    is running, StartExecution succeeds and returns the existing execution,
+    which is recognized by a start date from before this call.
+
+    Returns:
+        True if an execution was started, False if it already existed
+    """
+    sfn_client = get_client('stepfunctions')
+    log = logger.bind(id=payload["id"])
+    requested_at = now_ms()
+    try:
+        response = sfn_client.start_execution(
+            stateMachineArn=os.environ['state_machine_arn'],
+            name = payload["id"],
+            input = json.dumps(payload, indent=3, default=str),
+        )
+    except sfn_client.exceptions.ExecutionAlreadyExists:
+        log.info("Execution already exists, skipping duplicate", bucket=payload["bucket"], key=payload["key"])
+        metrics.add("DuplicateDocuments", 1)
+        return False
+    if to_ms(response["startDate"]) < requested_at - START_CLOCK_SKEW_MS:
+        log.info("Execution is already running, skipping duplicate", bucket=payload["bucket"], key=payload["key"])
+        metrics.add("DuplicateDocuments", 1)
+        return False
+    return True
+
+def document_id(bucket, key, s3_object):
+    """
+    Deterministic document id for one version of an uploaded object.
+
+    Derived from bucket, key, version id and ETag, so every delivery of the
+    same S3 notification maps to the same id. It keeps the 32 hex character
+    form of the uuid4 ids used before.
+    """
+    source = "/".join([bucket, key, s3_object.get("versionId", ""), s3_object.get("eTag", "")])
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
 
 def extract_event_data(record):
     s3 = record["s3"]
-    id = uuid.uuid4().hex
     bucket = s3["bucket"]["name"]
     key = unquote_plus(unquote(s3["object"]["key"]))
     pdf_name = key[key.rfind("/")+1:key.rfind(".")]
     
     data = {
-        "id": id,
+        "id": document_id(bucket, key, s3["object"]),
         "bucket": bucket,
         "key": key,
         "pdf_name": pdf_name
@@ -48,37 +107,116 @@ def extract_event_data(record):
     
     return data
 
-def lambda_handler(event, context):
+def build_payload(record):
+    data = extract_event_data(record)
+    extension = data["key"][-3:].lower()
+    payload = {
+        "id": data["id"],
+        "bucket": data["bucket"],
+        "key": data["key"],
+        "extension": extension
+    }
+    if extension != "pdf":
+        payload["image_keys"] = ["0"]
+    return payload
+
+def start_message(message):
+    """
+    Start the executions for the S3 records of one SQS message.
+
+    Returns:
+        Number of executions started
+    """
+    # S3 sends an s3:TestEvent without Records when the notification is created
+    records = json.loads(message["body"]).get("Records", [])
+    started = 0
+    for record in records:
+        metrics.put_metric("UploadSize", record["s3"]["object"].get("size", 0), "Bytes")
+        payload = build_payload(record)
+        if start_step_function(payload):
+            started += 1
+            record_upload(payload["id"], record["eventTime"], payload["key"])
+    return started
+
+def intake_headroom():
+    """
+    Documents that can be started before a limit on in-flight BDA jobs or
+    human loops is reached.
+
+    Returns:
+        The headroom, or None without limits or when the counts cannot be read
+    """
+    headroom = None
+    for kind, limit in MAX_INFLIGHT.items():
+        if limit <= 0:
+            continue
+        in_flight = inflight.count(kind)
+        if in_flight is None:
+            continue
+        metrics.put_metric(f"InFlight{kind.capitalize()}", in_flight)
+        room = max(0, limit - in_flight)
+        headroom = room if headroom is None else min(headroom, room)
+    return headroom
+
+def defer_message(message):
+    """
+    Hide a message that was not started for a while, longer the more often
+    it was deferred, with jitter so deferred batches do not return together.
+    """
+    receives = int(message.get("attributes", {}).get("ApproximateReceiveCount", "1"))
+    delay = min(BACKPRESSURE_DELAY * receives + random.randint(0, BACKPRESSURE_DELAY // 2), MAX_BACKPRESSURE_DELAY)
     try:
-        # this is the sqs payload
-        for record in event["Records"]:
-            # these are the s3 payload
-            for cur_record in json.loads(record["body"])["Records"]:
-                data = extract_event_data(cur_record)
-                extension = data["key"][-3:].lower()
-                if extension == "pdf":
-                    payload = {
-                        "id": data["id"],
-                        "bucket": data["bucket"],
-                        "key": data["key"],
-                        "extension": extension
-                    }
-                    response = start_step_function(payload)
-                else:
-                    payload = {
-                        "id": data["id"],
-                        "bucket": data["bucket"],
-                        "key": data["key"],
-                        "extension": extension,
-                        "image_keys" :["0"]
-                    }
-                    response = start_step_function(payload)                    
-            # delete message from sqs
-            client = boto3.client('sqs')
-            response = client.delete_message(
-                QueueUrl=os.environ['sqs_url'],
-                ReceiptHandle=record["receiptHandle"]
-            )
-    except:
-        return "something didn't go right...."
+        get_client('sqs').change_message_visibility(
+            QueueUrl=queue_url(message["eventSourceARN"]),
+            ReceiptHandle=message["receiptHandle"],
+            VisibilityTimeout=delay,
+        )
+    except Exception as e:
+        # The message still comes back, after the visibility timeout of the queue
+        logger.warning("Could not defer message", message_id=message["messageId"], error=str(e))
+
+@profiled
+@emits_metrics
+def lambda_handler(event, context):
+    """
+    Start one execution per uploaded document for a batch of SQS messages.
+
+    Messages are handled concurrently. Only the messages whose executions
+    could not be started are reported back, so SQS retries just those and
+    the duplicates they may cause are skipped by start_step_function.
+
+    With max_inflight_bda or max_inflight_reviews set, only as many messages
+    as there is headroom for are started. The others are deferred and
+    reported back, so intake slows down while BDA or the reviewers are
+    saturated instead of starting executions that would only wait or
+    throttle. S3 sends one message per upload. A deferral counts as a
+    receive, so a redrive policy on the queue must allow for them.
+    """
+    logger.reset(context)
+    # these are the sqs messages, each carrying an s3 notification
+    messages = event["Records"]
+    deferred = []
+    headroom = intake_headroom()
+    if headroom is not None and headroom < len(messages):
+        messages, deferred = messages[:headroom], messages[headroom:]
+        for message in deferred:
+            defer_message(message)
+        logger.info("Deferred messages for backpressure", deferred=len(deferred), headroom=headroom)
+    with ThreadPoolExecutor(max_workers=min(START_CONCURRENCY, len(messages) or 1)) as executor:
+        futures = [(message, executor.submit(start_message, message)) for message in messages]
+
+    failures = []
+    started = 0
+    for message, future in futures:
+        try:
+            started += future.result()
+        except Exception:
+            logger.exception("Error starting executions", message_id=message["messageId"])
+            failures.append({"itemIdentifier": message["messageId"]})
 
+    logger.info("Started executions", started=started, messages=len(messages), failed=len(failures))
+    metrics.add("DocumentsStarted", started)
+    metrics.add("FailedMessages", len(failures))
+    metrics.add("DeferredMessages", len(deferred))
+    failures.extend({"itemIdentifier": message["messageId"]} for message in deferred)
+    return {"batchItemFailures": failures}
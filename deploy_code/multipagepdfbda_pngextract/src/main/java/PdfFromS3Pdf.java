@@ -19,6 +19,7 @@
 
  import com.amazonaws.services.s3.AmazonS3;
  import com.amazonaws.services.s3.AmazonS3ClientBuilder;
+ import com.amazonaws.services.s3.model.AmazonS3Exception;
  import com.amazonaws.services.s3.model.GetObjectRequest;
  import com.amazonaws.services.s3.model.ObjectMetadata;
  import com.amazonaws.services.s3.model.PutObjectRequest;
@@ -46,8 +47,35 @@
          InputStream in = fullObject.getObjectContent();
          return in;
      }
+     // Written after every page of a document is rendered and holds the page count.
+     // Rendering may already have run speculatively alongside the BDA job, or for
+     // another segment of the same document, so later calls reuse the pages.
+     private static final String RENDERED_MARKER = "rendered.txt";
+
+     // Page count in the marker, or -1 when the document was not rendered yet.
+     // Without s3:ListBucket S3 answers a missing key with 403 instead of 404.
+     private int getRenderedPageCount(String bucketName, String markerKey) {
+         try {
+             return Integer.parseInt(s3client.getObjectAsString(bucketName, markerKey).trim());
+         } catch (AmazonS3Exception e) {
+             if (e.getStatusCode() == 403 || e.getStatusCode() == 404) {
+                 return -1;
+             }
+             throw e;
+         }
+     }
+
      public ArrayList<String> run(String cur_id, String cur_bucket, String cur_key) throws IOException {
          ArrayList<String> image_keys = new ArrayList<String>();
+         String marker_key = "wip/" + cur_id + "/" + RENDERED_MARKER;
+         int page_count = getRenderedPageCount(cur_bucket, marker_key);
+         if (page_count >= 0) {
+             System.out.println("Reusing " + page_count + " rendered pages of " + cur_id);
+             for(int cur_page = 0; cur_page < page_count; ++cur_page) {
+                 image_keys.add(String.valueOf(cur_page));
+             }
+             return image_keys;
+         }
          InputStream inputPdf = getPdfFromS3(cur_bucket, cur_key);
          try (PDDocument inputDocument = PDDocument.load(inputPdf)) {
              PDFRenderer pdfRenderer = new PDFRenderer(inputDocument);
@@ -64,6 +92,7 @@
          } finally {
              inputPdf.close();
          }
+         s3client.putObject(cur_bucket, marker_key, String.valueOf(image_keys.size()));
          return image_keys;
      }
  }
\ No newline at end of file
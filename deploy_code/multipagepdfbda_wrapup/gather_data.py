@@ -17,33 +17,60 @@
 #  */
 
 
+import csv
+import datetime
+import io
 import json
-import boto3
-import botocore
 import os
-from operator import itemgetter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.s3_paths import (
+    AI_OUTPUT_SUFFIX, COMPLETE_PREFIX, HUMAN_DELTA_SUFFIX, HUMAN_OUTPUT_SUFFIX, compaction_index_key, page_number_of,
+    wip_prefix
+)
+from multipagepdfbda_common.structured_log import get_logger
+from s3_csv_writer import S3CsvStreamWriter
+from parquet_output import parquet_enabled, write_parquet_outputs
+from review_delta import answers_from_delta, changes_as_answers, delta_from_answers
 
 
-def does_exsist(bucket, key):
-    s3 = boto3.resource('s3')
-    try:
-        s3.Object(bucket, key).load()
-    except botocore.exceptions.ClientError as e:
-        return False
-    else:
-        return True
+# Number of page outputs downloaded in parallel by curate_data
+FETCH_CONCURRENCY = int(os.environ.get('fetch_concurrency', '16'))
+
+# Only carry the fields a reviewer changed into the human outputs, instead of
+# the full merged human view
+DELTA_ONLY_HUMAN_OUTPUT = os.environ.get('DELTA_ONLY_HUMAN_OUTPUT', 'false').lower() == 'true'
+
+# One client shared by all fetch threads; the pool is sized to the fetch concurrency
+s3_client = get_client('s3', max_pool_connections=FETCH_CONCURRENCY)
+
+logger = get_logger()
+
+def build_output_index(bucket, document_id):
+    """
+    List wip/{document_id}/ once and return the set of ai/human output keys.
+
+    One ListObjectsV2 call returns up to 1000 keys, replacing the per-page
+    HEAD probes that gather and curate used to issue for every candidate key.
+    """
+    output_index = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=wip_prefix(document_id)):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith((AI_OUTPUT_SUFFIX, HUMAN_DELTA_SUFFIX, HUMAN_OUTPUT_SUFFIX)):
+                output_index.add(obj['Key'])
+    return output_index
 
 def write_data_to_bucket(payload, name, csv):
-    dest = "wip/" + payload["id"] + "/csv/" + name.replace(".png", ".csv")
-    s3 = boto3.resource('s3')
-    s3.Object(payload["bucket"], dest).put(Body=csv)
+    dest = wip_prefix(payload["id"]) + "csv/" + name.replace(".png", ".csv")
+    s3_client.put_object(Bucket=payload["bucket"], Key=dest, Body=csv)
     return dest
 
 def get_data_from_bucket(bucket, key):
-    print(bucket)
-    print(key)
-    client = boto3.client('s3')
-    response = client.get_object(
+    logger.debug("Reading object", key=key)
+    response = s3_client.get_object(
         Bucket=bucket,
         Key=key
     )
@@ -51,55 +78,88 @@ def get_data_from_bucket(bucket, key):
     
     return data
 
-def create_csv(kv_list, give_type, page_number=None):
+def fetch_json_objects(bucket, keys):
+    """
+    Download JSON objects concurrently and yield (key, data) in the order of keys.
+
+    At most 2 * FETCH_CONCURRENCY downloads are in flight or buffered, so results
+    stream to the caller while later pages are still being fetched and memory
+    does not grow with the page count.
+    """
+    key_iter = iter(keys)
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+        window = deque(
+            (key, executor.submit(get_data_from_bucket, bucket, key))
+            for key in islice(key_iter, FETCH_CONCURRENCY * 2)
+        )
+        while window:
+            key, future = window.popleft()
+            for next_key in islice(key_iter, 1):
+                window.append((next_key, executor.submit(get_data_from_bucket, bucket, next_key)))
+            yield key, future.result()
+
+def get_human_output_key(base_key, output_index):
+    """Review delta of a page, else its pre-delta full human output, else None"""
+    for suffix in (HUMAN_DELTA_SUFFIX, HUMAN_OUTPUT_SUFFIX):
+        if base_key + suffix in output_index:
+            return base_key + suffix
+    return None
+
+def load_kv_dict(kv_list):
+    """Return the page output as a dict, parsing JSON strings; None if invalid."""
     if isinstance(kv_list, str):
         try:
-            kv_dict = json.loads(kv_list)
+            kv_list = json.loads(kv_list)
         except json.JSONDecodeError:
-            return "Error: Invalid JSON string", ""
-    elif isinstance(kv_list, dict):
-        kv_dict = kv_list
+            return None
+    return kv_list if isinstance(kv_list, dict) else None
+
+def flatten_fields(value, path=""):
+    """
+    Yield (path, leaf) for every leaf of a nested output.
+
+    Nested keys are joined with "_" and list items (table rows) get their
+    index, e.g. {"table": [{"date": "x"}]} yields ("table_0_date", "x").
+    """
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from flatten_fields(child, f"{path}_{key}" if path else str(key))
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            yield from flatten_fields(child, f"{path}_{index}" if path else str(index))
     else:
-        return "Error: Invalid input type", ""
-    
-    outputkey = ""
-    outputvalue = ""
-
-    def process_dict(dictionary, prefix=""):
-        nonlocal outputkey, outputvalue
-        for key, value in dictionary.items():
-            if isinstance(value, dict):
-                # Recursively process nested dictionaries
-                process_dict(value, f"{key}_")
-            else:
-                # If there's a prefix, use it; otherwise, use just the key
-                final_key = (prefix + key if prefix else key).replace(",", "")
-                
-                # Add page number to the key if provided
-                if page_number is not None:
-                    keytype = f"page{page_number}_{final_key}-{give_type}"
-                else:
-                    keytype = f"{final_key}-{give_type}"
-                
-                outputkey += keytype + ","
-                outputvalue += str(value).replace(",", "") + ","
-
-    process_dict(kv_dict)
-    
-    # Remove trailing commas
-    outputkey = outputkey.rstrip(',')
-    outputvalue = outputvalue.rstrip(',')
-    
-    return outputkey, outputvalue
+        yield path, "" if value is None else str(value)
+
+def iter_csv_fields(kv_dict, give_type, page_number=None):
+    """Yield (column, value) pairs for one page output in CSV column order."""
+    for path, value in flatten_fields(kv_dict):
+        # Add page number to the key if provided
+        if page_number is not None:
+            yield f"page{page_number}_{path}-{give_type}", value
+        else:
+            yield f"{path}-{give_type}", value
 
-def write_to_s3(csv, payload, original_uplolad_key, image_keys):
-    client = boto3.client('s3')
+def create_csv(kv_list, give_type, page_number=None):
+    """Return the quoted CSV header line and value line for one page output."""
+    kv_dict = load_kv_dict(kv_list)
+    if kv_dict is None:
+        return "Error: Invalid input", ""
     
+    fields = list(iter_csv_fields(kv_dict, give_type, page_number))
+    lines = []
+    for row in ([column for column, _ in fields], [value for _, value in fields]):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="").writerow(row)
+        lines.append(buffer.getvalue())
+    return lines[0], lines[1]
+
+def get_output_base_key(payload, image_keys):
+    """complete/ key prefix shared by all outputs of one segment"""
     # Extract a meaningful name from the original upload key
-    if "/" in original_uplolad_key:
-        filename = original_uplolad_key.split("/")[-1].split(".")[0]
+    if "/" in payload["key"]:
+        filename = payload["key"].split("/")[-1].split(".")[0]
     else:
-        filename = original_uplolad_key.split(".")[0]
+        filename = payload["key"].split(".")[0]
     
     # Format image_keys for the filename
     if image_keys and isinstance(image_keys, list):
@@ -108,109 +168,50 @@ def write_to_s3(csv, payload, original_uplolad_key, image_keys):
     else:
         image_keys_str = "unknown"
     
-    # Create a single output file for all pages with image_keys in the name
-    output_key = f"complete/{payload['id']}-{filename}-pages-{image_keys_str}-output.csv"
-    
-    response = client.put_object(
-        Body = csv,
-        Bucket = payload["bucket"],
-        Key = output_key
-    )
-    return payload["bucket"], output_key
+    return f"{COMPLETE_PREFIX}{payload['id']}-{filename}-pages-{image_keys_str}"
+
+def write_csv_to_s3(csv_sources, bucket, key):
+    """
+    Stream the combined two-row CSV (header row, value row) to S3.
+
+    Each source is walked twice, once for the header and once for the values,
+    so neither row is ever built in memory.
+    """
+    with S3CsvStreamWriter(s3_client, bucket, key) as writer:
+        writer.write_row(column for source in csv_sources for column, _ in iter_csv_fields(*source))
+        writer.write_row(value for source in csv_sources for _, value in iter_csv_fields(*source))
+    return writer.bytes_written
 
 def write_json_to_s3(data, bucket, key):
-    """Write JSON data to S3 bucket"""
-    client = boto3.client('s3')
-    response = client.put_object(
-        Body=json.dumps(data, indent=2),
+    """Write JSON data to S3 bucket; returns the bytes written"""
+    body = json.dumps(data, indent=2).encode('utf-8')
+    s3_client.put_object(
+        Body=body,
         Bucket=bucket,
         Key=key,
         ContentType='application/json'
     )
-    return response
+    return len(body)
 
-def reconstruct_original_format(a2i_response, structure_map):
+def write_compaction_index(bucket, output_base_key, written):
     """
-    Reconstructs the original format from the A2I response using the structure map.
-    
-    Args:
-        a2i_response: The response from A2I with updated field values
-        structure_map: The structure map from the flattening process
-    
-    Returns:
-        The reconstructed data in the original format
+    Record the complete/ outputs of a segment and their sizes, so compaction
+    lists the entries written since its last run instead of all of complete/.
     """
-    result = [{} for _ in range(max(item['section_idx'] for item in structure_map.values()) + 1)]
-    
-    # First, create the structure
-    for field_name, structure_info in structure_map.items():
-        section_idx = structure_info['section_idx']
-        
-        if '.' not in field_name and '[' not in field_name:  # Root level field
-            if structure_info['type'] == 'array':
-                result[section_idx][field_name] = [{} for _ in range(structure_info['length'])]
-            elif structure_info['type'] == 'object':
-                result[section_idx][field_name] = {}
-            elif structure_info['type'] == 'simple':
-                # Will be filled in later with values
-                pass
-    
-    # Now fill in the values from A2I response
-    for field in a2i_response:
-        components = field['path_components']
-        value = field['value']
-        
-        if 'array_index' in components:
-            # This is a field in an array item
-            root = components['root']
-            index = components['array_index']
-            field_name = components['field']
-            
-            # Create the confidence structure
-            field_data = {
-                'value': value,
-                'confidence': field['confidence']
-            }
-            if field['geometry']:
-                field_data['geometry'] = field['geometry']
-                
-            result[structure_map[root]['section_idx']][root][index][field_name] = field_data
-        elif 'field' in components:
-            # This is a field in an object
-            root = components['root']
-            field_name = components['field']
-            
-            # Create the confidence structure
-            field_data = {
-                'value': value,
-                'confidence': field['confidence']
-            }
-            if field['geometry']:
-                field_data['geometry'] = field['geometry']
-                
-            result[structure_map[root]['section_idx']][root][field_name] = field_data
-        else:
-            # This is a simple field at root level
-            root = components['root']
-            
-            # Create the confidence structure
-            field_data = {
-                'value': value,
-                'confidence': field['confidence']
-            }
-            if field['geometry']:
-                field_data['geometry'] = field['geometry']
-                
-            result[structure_map[root]['section_idx']][root] = field_data
-    
-    return result
-
-def curate_data(base_image_keys, payload, image_keys):
-    # Initialize data structures to collect all AI and human data
-    all_ai_keys = []
-    all_ai_values = []
-    all_human_keys = []
-    all_human_values = []
+    key = compaction_index_key(datetime.datetime.now(datetime.timezone.utc), output_base_key[len(COMPLETE_PREFIX):])
+    write_json_to_s3({"segment": output_base_key, "files": written}, bucket, key)
+    return key
+
+def add_csv_source(csv_sources, kv_list, give_type, page_number):
+    kv_dict = load_kv_dict(kv_list)
+    if kv_dict is None:
+        logger.warning("Skipping invalid output in CSV", output_type=give_type, page=page_number)
+        return
+    csv_sources.append((kv_dict, give_type, page_number))
+
+def curate_data(base_image_keys, payload, image_keys, output_index, ai_output=None):
+    # Page outputs in CSV column order (AI first, then human) as (data, type, page)
+    csv_sources = []
     
     # Track which files were processed
     processed_files = []
@@ -219,118 +220,124 @@ def curate_data(base_image_keys, payload, image_keys):
     original_responses = {}
     a2i_responses = {}
     
+    # Review deltas in page order
+    corrections = []
+    
     # For AI data, we only need to process it once since it's duplicated across pages
     # Get the first available AI data
     ai_data = None
     ai_page_number = None
     
-    for i, base_key in enumerate(base_image_keys):
-        page_number = base_key[base_key.rfind("/") + 1:]
-        page_number = int(page_number[:page_number.find(".")])
-        
-        # Get AI data (only for the first page we find it)
-        if ai_data is None:
-            ai_key = base_key + "/ai/output.json"
-            if does_exsist(payload["bucket"], ai_key):
-                ai_data = get_data_from_bucket(payload["bucket"], ai_key)
-                ai_page_number = page_number
-                print(f"AI data found on page {page_number}:", ai_data)
-                
-                # Store original AI response (only once)
-                original_responses[f"page_{page_number}_ai"] = ai_data
-                
-                datakey, datavalue = create_csv(ai_data, "ai", page_number)
-                all_ai_keys.append(datakey)
-                all_ai_values.append(datavalue)
-                processed_files.append(ai_key)
+    if ai_output is not None:
+        # Passed in by the caller, so no page output is read from wip/
+        ai_page_number, ai_data = ai_output
+        original_responses[f"page_{ai_page_number}_ai"] = ai_data
+        add_csv_source(csv_sources, ai_data, "ai", ai_page_number)
     
-    # Now process human data for all pages
-    for i, base_key in enumerate(base_image_keys):
-        page_number = base_key[base_key.rfind("/") + 1:]
-        page_number = int(page_number[:page_number.find(".")])
+    for base_key in base_image_keys:
+        page_number = page_number_of(base_key)
         
-        # Get human data
-        human_key = base_key + "/human/output.json"
-        if does_exsist(payload["bucket"], human_key):
-            temp_data = get_data_from_bucket(payload["bucket"], human_key)
-            print(f"Human data for page {page_number}:", temp_data)
-            
-            # Store A2I response
-            a2i_responses[f"page_{page_number}_human"] = temp_data
+        # Get AI data (only for the first page we find it)
+        ai_key = base_key + AI_OUTPUT_SUFFIX
+        if ai_key in output_index:
+            ai_data = get_data_from_bucket(payload["bucket"], ai_key)
+            ai_page_number = page_number
+            logger.debug("AI data found", page=page_number, ai_data=ai_data)
             
-            # Check if we have structure map in the human data
-            if 'structure_map' in temp_data:
-                # If we have structure map, reconstruct the original format
-                if 'all_fields' in temp_data:
-                    reconstructed_data = reconstruct_original_format(
-                        temp_data['all_fields'], 
-                        temp_data['structure_map']
-                    )
-                    a2i_responses[f"page_{page_number}_human_reconstructed"] = reconstructed_data
+            # Store original AI response (only once)
+            original_responses[f"page_{page_number}_ai"] = ai_data
             
-            datakeyhuman, datavaluehuman = create_csv(temp_data, "human", page_number)
-            all_human_keys.append(datakeyhuman)
-            all_human_values.append(datavaluehuman)
-            processed_files.append(human_key)
+            add_csv_source(csv_sources, ai_data, "ai", page_number)
+            processed_files.append(ai_key)
+            break
     
-    # Combine all data - AI first, then human
-    combined_keys = ",".join(all_ai_keys + all_human_keys)
-    combined_values = ",".join(all_ai_values + all_human_values)
+    # Now process human data for all pages, fetched concurrently and consumed in page order
+    human_keys = [get_human_output_key(base_key, output_index) for base_key in base_image_keys]
+    human_keys = [key for key in human_keys if key]
+    for human_key, temp_data in fetch_json_objects(payload["bucket"], human_keys):
+        if human_key.endswith(HUMAN_DELTA_SUFFIX):
+            page_number = page_number_of(human_key[:-len(HUMAN_DELTA_SUFFIX)])
+            delta = temp_data
+        else:
+            page_number = page_number_of(human_key[:-len(HUMAN_OUTPUT_SUFFIX)])
+            delta = delta_from_answers(load_kv_dict(temp_data) or {}, load_kv_dict(ai_data))
+        logger.info("Read human review", page=page_number, changed_fields=len(delta['changes']), reviewed_fields=delta['reviewed_fields'])
+        
+        # The full human view of the page is the AI output with the changes applied
+        corrections.append(dict(delta, page=page_number))
+        if DELTA_ONLY_HUMAN_OUTPUT:
+            a2i_responses[f"page_{page_number}_human"] = changes_as_answers(delta)
+        else:
+            a2i_responses[f"page_{page_number}_human"] = answers_from_delta(delta, load_kv_dict(ai_data))
+        
+        add_csv_source(csv_sources, a2i_responses[f"page_{page_number}_human"], "human", page_number)
+        processed_files.append(human_key)
     
-    # Create the final CSV content
-    data = combined_keys + "\n" + combined_values
+    output_base_key = get_output_base_key(payload, image_keys)
     
     # Write CSV to S3
-    bucket, key = write_to_s3(data, payload, payload["key"], image_keys)
-    upload_response = {"bucket": bucket, "key": key}
+    csv_key = f"{output_base_key}-output.csv"
+    written = {csv_key: write_csv_to_s3(csv_sources, payload["bucket"], csv_key)}
+    upload_response = {"bucket": payload["bucket"], "key": csv_key}
     
-    # Extract a meaningful name from the original upload key for JSON files
-    if "/" in payload["key"]:
-        filename = payload["key"].split("/")[-1].split(".")[0]
-    else:
-        filename = payload["key"].split(".")[0]
-    
-    # Format image_keys for the filename
-    if image_keys and isinstance(image_keys, list):
-        image_keys_str = "-".join([str(k) for k in image_keys])
-    else:
-        image_keys_str = "unknown"
-    
-    # Write original responses to S3
-    original_responses_key = f"complete/{payload['id']}-{filename}-pages-{image_keys_str}-original-responses.json"
-    write_json_to_s3(original_responses, payload["bucket"], original_responses_key)
-    
-    # Write A2I responses to S3
-    a2i_responses_key = f"complete/{payload['id']}-{filename}-pages-{image_keys_str}-a2i-responses.json"
-    write_json_to_s3(a2i_responses, payload["bucket"], a2i_responses_key)
+    # Columnar copy for analytics, typed from the matched blueprint
+    if parquet_enabled():
+        human_answers = {}
+        for page_key, page_data in a2i_responses.items():
+            if page_key.endswith("_human") and isinstance(page_data, dict):
+                human_answers.update(page_data)
+        document_columns = {
+            "document_id": payload["id"],
+            "source_key": payload["key"],
+            "pages": "-".join(str(k) for k in image_keys or []),
+            "processed_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        try:
+            upload_response["parquet_keys"] = write_parquet_outputs(
+                s3_client, payload["bucket"], output_base_key[len(COMPLETE_PREFIX):],
+                ai_data, human_answers, document_columns, payload.get("matched_blueprint"),
+                corrections
+            )
+        except Exception:
+            logger.exception("Error writing Parquet output")
     
-    # Add the JSON file paths to the upload response
-    upload_response["original_responses_key"] = original_responses_key
-    upload_response["a2i_responses_key"] = a2i_responses_key
+    # The JSON responses are restructured by the caller and written once, in their final form
+    responses = {
+        "output_base_key": output_base_key,
+        "original_responses": original_responses,
+        "a2i_responses": a2i_responses,
+        "corrections": corrections,
+        "written": written,
+    }
     
-    return data, upload_response, processed_files
+    return upload_response, processed_files, responses
 
 def get_base_image_keys(bucket, keys):
     temp = []
     for key in keys:
-        if "/human/output.json" in key:
-            temp.append(key[:key.rfind("/human/output.json")])
-        if "/ai/output.json" in key:
-            temp.append(key[:key.rfind("/ai/output.json")])
+        if HUMAN_DELTA_SUFFIX in key:
+            temp.append(key[:key.rfind(HUMAN_DELTA_SUFFIX)])
+        if HUMAN_OUTPUT_SUFFIX in key:
+            temp.append(key[:key.rfind(HUMAN_OUTPUT_SUFFIX)])
+        if AI_OUTPUT_SUFFIX in key:
+            temp.append(key[:key.rfind(AI_OUTPUT_SUFFIX)])
     return list(dict.fromkeys(temp))
 
 def get_extension(s):
     return s.split('.')[-1]
 
-def get_all_possible_files(event):
+def get_all_possible_files(event, output_index):
     files = []
     payload = {}
 
     payload["bucket"] = event["bucket"]
     payload["id"] = event["id"]
     payload["key"] = event["key"]
+    payload["matched_blueprint"] = event.get("matched_blueprint")
     if "a2i_result" in event and "a2iinput" in event["a2i_result"]:
         payload["a2iinput"] = event["a2i_result"]["a2iinput"]
+    elif event.get("needs_a2i") is False:
+        payload["a2iinput"] = "none"
     else:
         payload["a2iinput"] = "notnone"
 
@@ -350,48 +357,54 @@ def get_all_possible_files(event):
     # Default to empty list if image_keys is still not found
     if image_keys is None:
         image_keys = []
-        print("WARNING: Could not find image_keys in any expected location")
+        logger.warning("Could not find image_keys in any expected location")
 
     for item in image_keys:
         # Check type and handle appropriately
         if isinstance(item, int):
-            print(f"Converting integer item {item} to string")
             item = str(item)
 
         if item == "single_image":
-            base_key = f"wip/{payload['id']}/single_image/0.{file_extension}"
+            base_key = f"{wip_prefix(payload['id'])}single_image/0.{file_extension}"
         else:
-            base_key = f"wip/{payload['id']}/{item}.{file_extension}"
-        
-        possible_ai_output_key = base_key + "/ai/output.json"
-        possible_human_output_key = base_key + "/human/output.json"
-        print(possible_ai_output_key)
-        print(possible_human_output_key)
+            base_key = f"{wip_prefix(payload['id'])}{item}.{file_extension}"
         
-        s3 = boto3.resource('s3')
-        try:
-            s3.Object(event["bucket"], possible_ai_output_key).load()
-            files.append(possible_ai_output_key)
-        except botocore.exceptions.ClientError as e:
-            pass
-
-        try:
-            s3.Object(event["bucket"], possible_human_output_key).load()
-            files.append(possible_human_output_key)
-        except botocore.exceptions.ClientError as e:
-            pass
+        for possible_output_key in (base_key + AI_OUTPUT_SUFFIX, base_key + HUMAN_DELTA_SUFFIX, base_key + HUMAN_OUTPUT_SUFFIX):
+            if possible_output_key in output_index:
+                files.append(possible_output_key)
             
     return files, payload, image_keys
 
+def get_first_page_number(image_keys):
+    """Page the AI output is filed under: the lowest page of the segment"""
+    pages = [0 if str(item) == "single_image" else int(item) for item in image_keys]
+    return min(pages) if pages else 0
+
+def gather_direct_data(event):
+    """
+    Write the outputs of a segment that needs no human review.
+
+    The inference result arrives with the event, so nothing is written to or
+    listed and read back from wip/. The outputs are the same as when the
+    segment went through analyzepdf with an empty review.
+    """
+    _, payload, image_keys = get_all_possible_files(event, set())
+    ai_output = (get_first_page_number(image_keys), event["inference_result"])
+    s3outputpath, processed_keys, responses = curate_data([], payload, image_keys, set(), ai_output)
+    return s3outputpath, payload, processed_keys, responses
+
 def gather_and_combine_data(event):
-    keys, payload, image_keys = get_all_possible_files(event)
-    print(keys)
-    print(payload)    
+    if event.get("needs_a2i") is False:
+        return gather_direct_data(event)
+
+    # A single listing serves both the gather and the curate step
+    output_index = build_output_index(event["bucket"], event["id"])
+    keys, payload, image_keys = get_all_possible_files(event, output_index)
     base_image_keys = get_base_image_keys(payload["bucket"], keys)
-    print("base_image_keys", base_image_keys)
+    logger.debug("Gathered page outputs", keys=keys, base_image_keys=base_image_keys)
     
-    # Sort base_image_keys to ensure consistent page ordering
-    base_image_keys.sort()
+    # Sort base_image_keys numerically by page to ensure consistent page ordering
+    base_image_keys.sort(key=page_number_of)
     
-    data, s3outputpath, processed_keys = curate_data(base_image_keys, payload, image_keys)
-    return data, s3outputpath, payload, processed_keys
\ No newline at end of file
+    s3outputpath, processed_keys, responses = curate_data(base_image_keys, payload, image_keys, output_index)
+    return s3outputpath, payload, processed_keys, responses
\ No newline at end of file
@@ -1,82 +1,82 @@
-import json
-import boto3
-import botocore
-import os
-import copy
-from boto3.dynamodb.conditions import Key
-from gather_data import gather_and_combine_data
+from gather_data import DELTA_ONLY_HUMAN_OUTPUT, gather_and_combine_data, write_compaction_index, write_json_to_s3
+from review_delta import materialize_human_view
+from multipagepdfbda_common import checkpoint
+from multipagepdfbda_common.metrics import blueprint_name, emits_metrics, get_metrics, size_bucket
+from multipagepdfbda_common.profiling import profiled
+from multipagepdfbda_common.structured_log import get_logger
+from multipagepdfbda_common.timeline import now_ms, record_span
 
+logger = get_logger()
+metrics = get_metrics()
+
+@profiled
+@emits_metrics
 def lambda_handler(event, context):
-    print(event)
-    # Gather all of the data into a CSV
-    data, s3outputpath, payload, processed_keys = gather_and_combine_data(event)
+    logger.reset(context, id=event.get("id"), segment=event.get("segment_index"))
+    logger.debug("Received event", event=event)
+    pages = len(event.get("image_keys") or []) or 1
+    metrics.put_dimensions(Blueprint=blueprint_name(event.get("matched_blueprint")), SizeBucket=size_bucket(pages))
+    metrics.put_metric("Pages", pages)
+    started = now_ms()
+    s3outputpath = wrap_up(event)
+    checkpoint.save(event.get("id"), f"wrapup#{event.get('segment_index')}", outputs=s3outputpath)
+    record_span(event.get("id"), "wrapup", started, segment=event.get("segment_index"), pages=event.get("image_keys"))
+    return s3outputpath
+
+def wrap_up(event):
+    # Gather all of the data into a CSV; the JSON responses come back in memory
+    s3outputpath, payload, processed_keys, responses = gather_and_combine_data(event)
+    logger.info("Wrote segment outputs", outputs=s3outputpath)
     
-    print(f"s3outputpath {s3outputpath}")
+    original_responses = responses['original_responses']
+    a2i_responses = responses['a2i_responses']
+    output_base_key = responses['output_base_key']
+    written = responses['written']
+    bucket = s3outputpath['bucket']
     
     try:
-        # Check if s3outputpath contains the necessary information
-        if isinstance(s3outputpath, dict) and 'original_responses_key' in s3outputpath and 'a2i_responses_key' in s3outputpath:
-            bucket = s3outputpath['bucket']
-            
-            # Get original responses from S3
-            s3_client = boto3.client('s3')
-            original_response = s3_client.get_object(
-                Bucket=bucket,
-                Key=s3outputpath['original_responses_key']
-            )
-            original_response_body = original_response["Body"].read().decode('utf-8')
-            print(f"Original response body: {original_response_body}")
-            original_responses = json.loads(original_response_body)
-            
-            # Get A2I responses from S3
-            a2i_response = s3_client.get_object(
-                Bucket=bucket,
-                Key=s3outputpath['a2i_responses_key']
-            )
-            a2i_response_body = a2i_response["Body"].read().decode('utf-8')
-            print(f"A2I response body: {a2i_response_body}")
-            a2i_responses = json.loads(a2i_response_body)
+        # Find the first AI page to use as a template
+        ai_template_key = None
+        for key in original_responses:
+            if key.endswith('_ai'):
+                ai_template_key = key
+                break
+        
+        if not ai_template_key:
+            logger.warning("No AI template found in original responses")
+            return s3outputpath
             
-            # Find the first AI page to use as a template
-            ai_template_key = None
-            for key in original_responses:
-                if key.endswith('_ai'):
-                    ai_template_key = key
-                    break
-            
-            if not ai_template_key:
-                print("No AI template found in original responses")
-                return s3outputpath
-                
-            # Get the template structure
-            ai_template = original_responses[ai_template_key]
+        # Get the template structure
+        ai_template = original_responses[ai_template_key]
 
-            # Write BDA responses to S3 (renamed from original_responses)
-            bda_responses_key = s3outputpath['original_responses_key'].replace('-original-responses.json', '-bda-responses.json')
-            s3_client.put_object(
-                Body=json.dumps({"bda_responses": ai_template}, indent=2),
-                Bucket=bucket,
-                Key=bda_responses_key,
-                ContentType='application/json'
-            ) 
+        # Write BDA responses to S3
+        bda_responses_key = f"{output_base_key}-bda-responses.json"
+        written[bda_responses_key] = write_json_to_s3({"bda_responses": ai_template}, bucket, bda_responses_key)
+        s3outputpath['bda_responses_key'] = bda_responses_key
 
-            if payload["a2iinput"] != "none":
-                # Create a single combined restructured response
-                combined_restructured = copy.deepcopy(ai_template)
+        if payload["a2iinput"] != "none":
+            # Track which pages have been processed
+            processed_pages = [page_key for page_key in a2i_responses if page_key.endswith('_human')]
+            corrections = responses['corrections']
+            metrics.put_metric("PagesReviewed", len(processed_pages))
+            metrics.put_metric("FieldsChanged", sum(len(delta['changes']) for delta in corrections))
             
-                # Track which pages have been processed
-                processed_pages = []
+            # The review deltas are always kept; the merged view is derived from them
+            human_corrections_key = f"{output_base_key}-human-corrections.json"
+            written[human_corrections_key] = write_json_to_s3({
+                "corrections": corrections,
+                "changed_fields": sum(len(delta['changes']) for delta in corrections),
+                "processed_pages": processed_pages
+            }, bucket, human_corrections_key)
+            s3outputpath['human_corrections_key'] = human_corrections_key
             
-                # Process each page in A2I responses and combine updates
-                for page_key, page_data in a2i_responses.items():
-                    if not page_key.endswith('_human'):
-                        continue
-                    
-                    processed_pages.append(page_key)
-                    print(f"Processing A2I page: {page_key}")
-                    
-                    # Update the combined structure with values from this page
-                    update_with_flattened_values(combined_restructured, page_data)
+            if not DELTA_ONLY_HUMAN_OUTPUT:
+                # Apply the corrections of all pages (in page order, later pages win)
+                # to the AI output in a single traversal
+                combined_restructured, conflicts = materialize_human_view(ai_template, corrections)
+                logger.info("Merged corrections", pages=len(processed_pages), skipped=len(conflicts))
+                for path, reason in conflicts:
+                    logger.warning("Skipped correction", field=path, reason=reason)
                 
                 # Create the final restructured response
                 restructured_responses = {
@@ -84,98 +84,20 @@ def lambda_handler(event, context):
                     "processed_pages": processed_pages
                 }
             
-                print(f"Final restructured responses: {json.dumps(restructured_responses, indent=2)}")
-
-                # Write human responses to S3 (renamed from restructured-a2i-responses)
-                human_responses_key = s3outputpath['a2i_responses_key'].replace('-a2i-responses.json', '-human-responses.json')
-                s3_client.put_object(
-                    Body=json.dumps(restructured_responses, indent=2),
-                    Bucket=bucket,
-                    Key=human_responses_key,
-                    ContentType='application/json'
-                )
-
-            # Delete the original files that we don't need anymore
-            try:
-                print(f"Deleting original responses file: {s3outputpath['original_responses_key']}")
-                s3_client.delete_object(
-                    Bucket=bucket,
-                    Key=s3outputpath['original_responses_key']
-                )
-                
-                print(f"Deleting A2I responses file: {s3outputpath['a2i_responses_key']}")
-                s3_client.delete_object(
-                    Bucket=bucket,
-                    Key=s3outputpath['a2i_responses_key']
-                )
-                
-                print("Successfully deleted original and A2I response files")
-            except Exception as delete_error:
-                print(f"Warning: Error deleting files: {str(delete_error)}")
-                
-            
-            # Update the response to include the new keys
-            s3outputpath['bda_responses_key'] = bda_responses_key
-            s3outputpath['human_responses_key'] = human_responses_key
-            
-            # Remove the old keys that we don't need anymore
-            if 'original_responses_key' in s3outputpath:
-                del s3outputpath['original_responses_key']
-            if 'a2i_responses_key' in s3outputpath:
-                del s3outputpath['a2i_responses_key']
-            if 'restructured_a2i_responses_key' in s3outputpath:
-                del s3outputpath['restructured_a2i_responses_key']
-    except Exception as e:
-        print(f"Error restructuring responses: {str(e)}")
-        import traceback
-        traceback.print_exc()
+                # Write human responses to S3
+                human_responses_key = f"{output_base_key}-human-responses.json"
+                written[human_responses_key] = write_json_to_s3(restructured_responses, bucket, human_responses_key)
+                s3outputpath['human_responses_key'] = human_responses_key
+    except Exception:
+        logger.exception("Error restructuring responses")
+        
+        # Keep the unrestructured responses so nothing gathered is lost
+        s3outputpath['original_responses_key'] = f"{output_base_key}-original-responses.json"
+        written[s3outputpath['original_responses_key']] = write_json_to_s3(original_responses, bucket, s3outputpath['original_responses_key'])
+        s3outputpath['a2i_responses_key'] = f"{output_base_key}-a2i-responses.json"
+        written[s3outputpath['a2i_responses_key']] = write_json_to_s3(a2i_responses, bucket, s3outputpath['a2i_responses_key'])
+    finally:
+        # Compaction finds the outputs of the segment through this entry
+        write_compaction_index(bucket, output_base_key, written)
     
     return s3outputpath
-
-def update_with_flattened_values(structure, flattened_values):
-    """
-    Updates the structure with values from the flattened key-value pairs.
-    
-    Args:
-        structure: The nested structure to update (modified in place)
-        flattened_values: Dict with flattened keys like "PARENT/CHILD" or "PARENT.CHILD"
-    """
-    print(f"Updating structure with flattened values: {json.dumps(flattened_values, indent=2)}")
-    
-    # Process direct keys first (no separators)
-    for key, value in flattened_values.items():
-        if '/' not in key and '.' not in key:
-            if key in structure:
-                print(f"Updating direct key: {key} = {value}")
-                structure[key] = value
-            else:
-                print(f"Creating new direct key: {key} = {value}")
-                structure[key] = value
-    
-    # Process nested keys
-    for key, value in flattened_values.items():
-        # Handle both slash and dot separators
-        if '/' in key or '.' in key:
-            # Split by either slash or dot
-            parts = key.split('/') if '/' in key else key.split('.')
-            current = structure
-            path_so_far = []
-            
-            # Navigate to the nested location
-            for i, part in enumerate(parts):
-                path_so_far.append(part)
-                
-                if i == len(parts) - 1:
-                    # Last part - update the value
-                    print(f"Setting value at {'.'.join(path_so_far)} = {value}")
-                    current[part] = value
-                else:
-                    # Navigate deeper, creating structure as needed
-                    if part not in current:
-                        print(f"Creating missing structure for: {'.'.join(path_so_far)}")
-                        current[part] = {}
-                    elif not isinstance(current[part], dict):
-                        print(f"Converting to dict at {'.'.join(path_so_far)}")
-                        # Convert to dict if it's not already
-                        current[part] = {}
-                    current = current[part]
\ No newline at end of file
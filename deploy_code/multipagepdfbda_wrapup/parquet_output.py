@@ -0,0 +1,274 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+import datetime
+import io
+import json
+import os
+import re
+from urllib.parse import unquote
+
+from multipagepdfbda_common.aws_clients import get_client
+from multipagepdfbda_common.structured_log import get_logger
+
+from review_delta import iter_correction_rows
+
+# pyarrow comes from the AWS SDK for pandas layer; without it Parquet output is skipped
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+PARQUET_OUTPUT = os.environ.get('PARQUET_OUTPUT', 'false').lower() == 'true'
+PARQUET_PREFIX = os.environ.get('PARQUET_PREFIX', 'analytics')
+
+# Main table holding one row per document segment
+DOCUMENT_TABLE = "documents"
+
+# One row per field a reviewer changed
+CORRECTIONS_TABLE = "corrections"
+CORRECTION_COLUMNS = ["page", "human_loop", "field", "old_value", "new_value", "reviewer", "submitted_at"]
+
+TRUE_STRINGS = {"true", "yes", "y", "1", "on"}
+FALSE_STRINGS = {"false", "no", "n", "0", "off"}
+
+logger = get_logger()
+
+# Blueprint schemas by ARN, cached for the lifetime of the container
+_blueprint_schemas = {}
+
+
+def parquet_enabled():
+    if PARQUET_OUTPUT and pyarrow is None:
+        logger.warning("PARQUET_OUTPUT is enabled but pyarrow is not available; skipping Parquet output")
+    return PARQUET_OUTPUT and pyarrow is not None
+
+
+def get_blueprint_schema(blueprint_arn):
+    """Fetch and cache the JSON schema of a BDA blueprint; None if unavailable."""
+    if not blueprint_arn:
+        return None
+    if blueprint_arn not in _blueprint_schemas:
+        try:
+            response = get_client('bedrock-data-automation').get_blueprint(blueprintArn=blueprint_arn)
+            _blueprint_schemas[blueprint_arn] = json.loads(response['blueprint']['schema'])
+        except Exception as e:
+            logger.warning("Could not load blueprint schema", blueprint_arn=blueprint_arn, error=str(e))
+            _blueprint_schemas[blueprint_arn] = None
+    return _blueprint_schemas[blueprint_arn]
+
+
+def infer_schema(value):
+    """Build a JSON-schema-like description from a sample output when no blueprint is available."""
+    if isinstance(value, dict):
+        return {"type": "object", "properties": {key: infer_schema(child) for key, child in value.items()}}
+    if isinstance(value, list):
+        return {"type": "array", "items": infer_schema(value[0]) if value else {"type": "string"}}
+    if isinstance(value, bool):
+        return {"type": "boolean"}
+    if isinstance(value, int):
+        return {"type": "integer"}
+    if isinstance(value, float):
+        return {"type": "number"}
+    return {"type": "string"}
+
+
+def resolve(node, definitions):
+    """Follow a "#/definitions/..." reference, keeping sibling keywords."""
+    if "$ref" not in node:
+        return node
+    name = unquote(node["$ref"].split("/")[-1])
+    resolved = dict(definitions.get(name, {}))
+    resolved.update({key: value for key, value in node.items() if key != "$ref"})
+    return resolved
+
+
+def compile_layout(schema):
+    """
+    Turn a blueprint schema into flat scalar columns plus child tables.
+
+    Returns:
+        (columns, child_tables) where columns is a list of (name, path, type)
+        and child_tables maps a list field to its path and item columns. Nested
+        objects are flattened into "parent_child" columns; lists become child
+        tables with one row per item.
+    """
+    definitions = schema.get("definitions", {})
+
+    def walk(node, path, columns, child_tables):
+        node = resolve(node, definitions)
+        node_type = node.get("type", "object" if "properties" in node else "string")
+        if node_type == "object":
+            for name, child in node.get("properties", {}).items():
+                walk(child, path + (name,), columns, child_tables)
+        elif node_type == "array" and child_tables is not None:
+            item_columns = []
+            item = resolve(node.get("items", {"type": "string"}), definitions)
+            if item.get("type", "object" if "properties" in item else "string") == "object":
+                walk(item, (), item_columns, None)
+            else:
+                item_columns.append(("value", (), item.get("type", "string")))
+            child_tables["_".join(path)] = (path, item_columns)
+        else:
+            # Lists nested inside a child table row are kept as JSON text
+            columns.append(("_".join(path), path, node_type if node_type != "array" else "json"))
+
+    columns, child_tables = [], {}
+    walk(schema, (), columns, child_tables)
+    return columns, child_tables
+
+
+def arrow_type(json_type):
+    return {
+        "boolean": pyarrow.bool_(),
+        "integer": pyarrow.int64(),
+        "number": pyarrow.float64(),
+    }.get(json_type, pyarrow.string())
+
+
+def coerce(value, json_type):
+    """Convert an AI or human value to the column type; unparseable values become null."""
+    if value is None or value == "":
+        return None
+    try:
+        if json_type == "boolean":
+            if isinstance(value, bool):
+                return value
+            text = str(value).strip().lower()
+            return True if text in TRUE_STRINGS else False if text in FALSE_STRINGS else None
+        if json_type == "integer":
+            return int(float(value))
+        if json_type == "number":
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def get_path(data, path):
+    for part in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def build_tables(layout, ai_data, human_answers, document_columns):
+    """
+    Build the main row and child table rows with AI and human values side by side.
+
+    Human answers use the flattened A2I keys: "parent.child" for nested fields
+    and "field[3].child" for list items.
+    """
+    columns, child_tables = layout
+    tables = {}
+
+    row = dict(document_columns)
+    schema = [(name, pyarrow.string()) for name in document_columns]
+    for name, path, json_type in columns:
+        human_key = ".".join(path)
+        row[f"{name}_ai"] = coerce(get_path(ai_data, path), json_type)
+        row[f"{name}_human"] = coerce(human_answers.get(human_key), json_type)
+        schema += [(f"{name}_ai", arrow_type(json_type)), (f"{name}_human", arrow_type(json_type))]
+    tables[DOCUMENT_TABLE] = ([row], schema)
+
+    for table_name, (path, item_columns) in child_tables.items():
+        human_prefix = ".".join(path)
+        ai_items = get_path(ai_data, path)
+        ai_items = ai_items if isinstance(ai_items, list) else []
+        human_indexes = [
+            int(match.group(1))
+            for key in human_answers
+            for match in [re.match(rf"^{re.escape(human_prefix)}\[(\d+)\]", key)]
+            if match
+        ]
+        row_count = max([len(ai_items)] + [index + 1 for index in human_indexes])
+
+        rows = []
+        for index in range(row_count):
+            item = ai_items[index] if index < len(ai_items) else None
+            child_row = dict(document_columns)
+            child_row["row_index"] = index
+            for name, item_path, json_type in item_columns:
+                human_key = f"{human_prefix}[{index}]" + "".join(f".{part}" for part in item_path)
+                ai_value = get_path(item, item_path) if item_path else item
+                child_row[f"{name}_ai"] = coerce(ai_value, json_type)
+                child_row[f"{name}_human"] = coerce(human_answers.get(human_key), json_type)
+            rows.append(child_row)
+
+        child_schema = [(name, pyarrow.string()) for name in document_columns] + [("row_index", pyarrow.int64())]
+        for name, _, json_type in item_columns:
+            child_schema += [(f"{name}_ai", arrow_type(json_type)), (f"{name}_human", arrow_type(json_type))]
+        tables[table_name] = (rows, child_schema)
+
+    return tables
+
+
+def partition_value(value):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value or "unknown")
+
+
+def build_corrections_table(corrections, document_columns):
+    rows = [dict(document_columns, **row) for row in iter_correction_rows(corrections)]
+    schema = [(name, pyarrow.string()) for name in document_columns]
+    schema += [(name, pyarrow.int64() if name == "page" else pyarrow.string()) for name in CORRECTION_COLUMNS]
+    return rows, schema
+
+
+def write_parquet_outputs(s3_client, bucket, output_name, ai_data, human_answers, document_columns, matched_blueprint,
+                          corrections=None):
+    """
+    Write one Parquet file per table under
+    {PARQUET_PREFIX}/{table}/blueprint={name}/date={yyyy-mm-dd}/{output_name}.parquet
+
+    The human columns hold the reviewer's value of each reviewed field, or
+    only the changed ones with DELTA_ONLY_HUMAN_OUTPUT, and are null
+    elsewhere. Review deltas are also written to a corrections table with one
+    row per changed field.
+
+    Returns:
+        List of the written S3 keys.
+    """
+    matched_blueprint = matched_blueprint or {}
+    schema = get_blueprint_schema(matched_blueprint.get("arn")) or infer_schema(ai_data or {})
+    layout = compile_layout(schema)
+
+    blueprint = partition_value(matched_blueprint.get("name"))
+    date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+    document_columns = dict(document_columns, blueprint=matched_blueprint.get("name"))
+
+    tables = build_tables(layout, ai_data or {}, human_answers, document_columns)
+    tables[CORRECTIONS_TABLE] = build_corrections_table(corrections or [], document_columns)
+
+    keys = []
+    for table_name, (rows, table_schema) in tables.items():
+        if not rows:
+            continue
+        arrow_schema = pyarrow.schema(table_schema)
+        table = pyarrow.Table.from_pylist(rows, schema=arrow_schema)
+        buffer = io.BytesIO()
+        pyarrow.parquet.write_table(table, buffer, compression="snappy")
+
+        key = f"{PARQUET_PREFIX}/{partition_value(table_name)}/blueprint={blueprint}/date={date}/{output_name}.parquet"
+        s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        keys.append(key)
+    return keys
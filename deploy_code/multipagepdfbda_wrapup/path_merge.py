@@ -0,0 +1,167 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+from functools import lru_cache
+
+@lru_cache(maxsize=65536)
+def parse_path(path):
+    """
+    Split a flattened field path into dict keys and list indices.
+
+    Accepts the paths built by multipagepdfbda_confidence ("name",
+    "parent.child", "records[3].date") as well as "/" separators, e.g.
+    "records[3].date" -> ("records", 3, "date"). Paths repeat for every
+    document of a blueprint, so parsed paths are cached per container.
+
+    Returns:
+        Tuple of str and int segments, or None if the path is malformed
+    """
+    separator = "/" if "/" in path else "."
+    if "[" not in path and "]" not in path:
+        segments = tuple(path.split(separator))
+        return None if "" in segments else segments
+    segments = []
+    for part in path.split(separator):
+        name, bracket, indexes = part.partition("[")
+        if "]" in name or not (name or bracket):
+            return None
+        if name:
+            segments.append(name)
+        if bracket:
+            # "[3][4]" arrives here as "3][4]"
+            if not indexes.endswith("]"):
+                return None
+            for index in indexes[:-1].split("]["):
+                if not index.isdigit():
+                    return None
+                segments.append(int(index))
+    if isinstance(segments[0], int):
+        return None
+    return tuple(segments)
+
+
+class PathTrie:
+    """
+    Flattened corrections compiled into a trie of path segments.
+
+    Compile once from (path, value) pairs, then merge into a nested document
+    with a single traversal that visits every shared prefix once. Only inner
+    nodes are objects; leaf values are kept in their parent's `values`. Later
+    pairs for the same path win, so pages can be compiled in order.
+    """
+
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = {}
+
+    @classmethod
+    def compile(cls, items):
+        """
+        Build a trie from an iterable of (path, value).
+
+        Returns:
+            (trie, rejected) where rejected lists the paths that could not be parsed
+        """
+        root = cls()
+        rejected = []
+        for path, value in items:
+            segments = parse_path(path)
+            if segments is None:
+                rejected.append(path)
+                continue
+            node = root
+            for segment in segments[:-1]:
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = cls()
+                node = child
+            node.values[segments[-1]] = value
+        return root, rejected
+
+    def merge(self, target):
+        """
+        Apply the compiled values to target in place.
+
+        Missing dicts, lists and list items are created. A value is never
+        written over a node of a different shape: a path that runs through a
+        scalar, uses an index on a dict or a name on a list, or would replace
+        a dict or list with a scalar is skipped and reported instead. When a
+        path has both a value and nested fields, the value wins.
+
+        Returns:
+            List of (path, reason) for the skipped values
+        """
+        conflicts = []
+        _merge_node(target, self, None, conflicts)
+        return conflicts
+
+
+def format_path(prefix, segment):
+    """Rebuild a flattened path from the (parent, segment) chain used during a merge."""
+    segments = [segment]
+    while prefix is not None:
+        prefix, parent_segment = prefix
+        segments.append(parent_segment)
+    path = ""
+    for part in reversed(segments):
+        path += f"[{part}]" if isinstance(part, int) else f".{part}" if path else part
+    return path
+
+
+def _slot(container, segment, prefix, conflicts):
+    """
+    Return (ok, current) for segment in container, padding lists as needed.
+    """
+    if type(segment) is int:
+        if not isinstance(container, list):
+            conflicts.append((format_path(prefix, segment), f"expected a list, found {type(container).__name__}"))
+            return False, None
+        if segment >= len(container):
+            container.extend([None] * (segment + 1 - len(container)))
+        return True, container[segment]
+    if not isinstance(container, dict):
+        conflicts.append((format_path(prefix, segment), f"expected an object, found {type(container).__name__}"))
+        return False, None
+    return True, container.get(segment)
+
+
+def _merge_node(container, node, prefix, conflicts):
+    values = node.values
+    for segment, value in values.items():
+        ok, current = _slot(container, segment, prefix, conflicts)
+        if not ok:
+            continue
+        if isinstance(current, (dict, list)) and not isinstance(value, (dict, list)):
+            conflicts.append((format_path(prefix, segment), f"would replace a {type(current).__name__} with a scalar"))
+            continue
+        container[segment] = value
+
+    for segment, child in node.children.items():
+        if segment in values:
+            conflicts.append((format_path(prefix, segment), "nested fields given under a path that has a value"))
+            continue
+        ok, current = _slot(container, segment, prefix, conflicts)
+        if not ok:
+            continue
+        if current is None:
+            current = [] if type(next(iter(child.children or child.values))) is int else {}
+            container[segment] = current
+        _merge_node(current, child, (prefix, segment), conflicts)
@@ -0,0 +1,106 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+import copy
+
+from path_merge import PathTrie, parse_path
+
+
+def normalize_answer(value):
+    return "" if value is None else str(value).strip()
+
+
+def get_ai_value(ai_data, field):
+    """Value of a flattened field path in the AI output, or None."""
+    node = ai_data
+    for segment in parse_path(field) or ():
+        try:
+            node = node[segment]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return node
+
+
+def delta_from_answers(answers, ai_data):
+    """
+    Build a review delta from a full answerContent.
+
+    Human outputs written before deltas were introduced hold every reviewed
+    field; the AI output stands in for the values the reviewer was shown.
+    """
+    changes = []
+    for field, value in answers.items():
+        old = get_ai_value(ai_data, field) if isinstance(ai_data, dict) else None
+        if normalize_answer(value) != normalize_answer(old):
+            changes.append({"field": field, "old": old, "new": value})
+    return {"reviewed_fields": len(answers), "reviewed": list(answers), "changes": changes}
+
+
+def changes_as_answers(delta):
+    """The changed fields of a delta as flattened {field: new value}."""
+    return {change["field"]: change["new"] for change in delta.get("changes", [])}
+
+
+def answers_from_delta(delta, ai_data):
+    """
+    Rebuild the reviewer's full answers from a delta as flattened {field: value}.
+
+    Reviewed fields without a change keep their AI value. Deltas that do not
+    list their reviewed fields yield only the changed ones.
+    """
+    answers = {
+        field: get_ai_value(ai_data, field) if isinstance(ai_data, dict) else None
+        for field in delta.get("reviewed", [])
+    }
+    answers.update(changes_as_answers(delta))
+    return answers
+
+
+def materialize_human_view(bda_responses, corrections):
+    """
+    Apply review deltas to the AI output and return the merged human view.
+
+    Corrections are applied in list order, so later pages win when two pages
+    changed the same field.
+
+    Returns:
+        (view, conflicts) where conflicts lists the (path, reason) of skipped changes
+    """
+    view = copy.deepcopy(bda_responses)
+    trie, rejected = PathTrie.compile(
+        (change["field"], change["new"])
+        for delta in corrections
+        for change in delta.get("changes", [])
+    )
+    return view, [(path, "unparseable path") for path in rejected] + trie.merge(view)
+
+
+def iter_correction_rows(corrections):
+    """Yield one flat row per changed field, for analytics."""
+    for delta in corrections:
+        for change in delta.get("changes", []):
+            yield {
+                "page": delta.get("page"),
+                "human_loop": delta.get("human_loop"),
+                "field": change["field"],
+                "old_value": normalize_answer(change["old"]),
+                "new_value": normalize_answer(change["new"]),
+                "reviewer": delta.get("reviewer"),
+                "submitted_at": delta.get("submitted_at"),
+            }
@@ -0,0 +1,134 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+import csv
+import io
+from itertools import islice
+
+# S3 requires every part except the last to be at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+
+# Cells handed to the csv module at a time; bounds the memory of very wide rows
+CELLS_PER_CHUNK = 512
+
+
+class S3CsvStreamWriter:
+    """
+    Write CSV rows to an S3 object as they are produced.
+
+    Cells are quoted by the csv module. Encoded output is buffered until a part
+    is full and then sent with UploadPart, so memory stays at about one part no
+    matter how many fields a document has. Outputs smaller than one part are
+    written with a single PutObject.
+
+    Use as a context manager; the upload is completed on exit, or aborted if
+    the block raises.
+    """
+
+    def __init__(self, client, bucket, key, part_size=PART_SIZE, content_type="text/csv"):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.content_type = content_type
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="")
+        self.upload_id = None
+        self.parts = []
+        self.bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def write_row(self, cells):
+        """Write one row from any iterable of cells without materializing it."""
+        cells = iter(cells)
+        first = True
+        while True:
+            chunk = list(islice(cells, CELLS_PER_CHUNK))
+            if not chunk:
+                break
+            if not first:
+                self.buffer.write(",")
+            self.writer.writerow(chunk)
+            first = False
+            if self.buffer.tell() >= self.part_size:
+                self._upload_part()
+        self.buffer.write("\n")
+
+    def _take_buffer(self):
+        data = self.buffer.getvalue().encode("utf-8")
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def _upload_part(self):
+        data = self._take_buffer()
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                ContentType=self.content_type
+            )
+            self.upload_id = response["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.bytes_written += len(data)
+
+    def close(self):
+        if self.upload_id is None:
+            data = self._take_buffer()
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=data,
+                ContentType=self.content_type
+            )
+            self.bytes_written += len(data)
+            return
+        if self.buffer.tell():
+            self._upload_part()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id
+            )
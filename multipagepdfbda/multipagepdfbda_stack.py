@@ -55,6 +55,7 @@ class multipagepdfbdaStack(Stack):
 
         services = self.create_services()
         self.create_events(services)
+        self.set_reserved_concurrency(services)
 
     def create_state_machine(self, services):
         # Lambda tasks
@@ -85,11 +86,16 @@ class multipagepdfbdaStack(Stack):
             result_path="$.segment_metadata",
         )
         
-        # Cleanup task for the new end state
-        task_cleanup = aws_stepfunctions_tasks.LambdaInvoke(
+        # Cleanup is queued rather than awaited; cleans3files consumes the queue
+        task_cleanup = aws_stepfunctions_tasks.SqsSendMessage(
             self,
-            "Cleanup Temporary Files",
-            lambda_function=services["lambda"]["cleans3files"],
+            "Queue Temporary File Cleanup",
+            queue=services["cleanup_sqs"],
+            message_body=aws_stepfunctions.TaskInput.from_object({
+                "id.$": "$.id",
+                "bucket.$": "$.bucket",
+                "bda_results.$": "$.bda_results"
+            }),
             result_path="$.cleanup_result",
         )
         
@@ -103,7 +109,8 @@ class multipagepdfbdaStack(Stack):
                 "bucket.$": "$.bucket",
                 "key.$": "$.key",
                 "extension.$": "$.extension",
-                "segment_uri.$": "$.segment_uri"
+                "segment_uri.$": "$.segment_uri",
+                "resume.$": "$.resume"
             }),
             result_path="$.confidence_result",
         )
@@ -134,7 +141,9 @@ class multipagepdfbdaStack(Stack):
                 "a2iinput.$": "$.confidence_result.Payload.a2i_input",
                 "wip_key.$": "$.confidence_result.Payload.page_index",
                 "inference_result.$": "$.confidence_result.Payload.inference_result",
-                "image_keys.$": "$.confidence_result.Payload.image_keys"
+                "image_keys.$": "$.confidence_result.Payload.image_keys",
+                "matched_blueprint.$": "$.confidence_result.Payload.matched_blueprint",
+                "attempt.$": "$.resume.attempt"
             }),
             integration_pattern=aws_stepfunctions.IntegrationPattern.WAIT_FOR_TASK_TOKEN,
             result_path="$.a2i_result",
@@ -152,7 +161,28 @@ class multipagepdfbdaStack(Stack):
                 "image_keys.$": "$.confidence_result.Payload.image_keys",
                 "segment_index.$": "$.confidence_result.Payload.segment_index",
                 "page_index.$": "$.confidence_result.Payload.page_index",
-                "inference_result.$": "$.confidence_result.Payload.inference_result"
+                "inference_result.$": "$.confidence_result.Payload.inference_result",
+                "matched_blueprint.$": "$.confidence_result.Payload.matched_blueprint"
+            }),
+            result_path="$.wrapup_result",
+        )
+        
+        # Straight-through segments skip the SQS round trip and task token; wrapup
+        # writes the final outputs directly from the inference result
+        direct_wrapup_task = aws_stepfunctions_tasks.LambdaInvoke(
+            self, 
+            "Write Outputs Without Review", 
+            lambda_function=services["lambda"]["wrapup"],
+            payload=aws_stepfunctions.TaskInput.from_object({
+                "id.$": "$.id",
+                "bucket.$": "$.bucket",
+                "key.$": "$.key",
+                "needs_a2i": False,
+                "image_keys.$": "$.confidence_result.Payload.image_keys",
+                "segment_index.$": "$.confidence_result.Payload.segment_index",
+                "page_index.$": "$.confidence_result.Payload.page_index",
+                "inference_result.$": "$.confidence_result.Payload.inference_result",
+                "matched_blueprint.$": "$.confidence_result.Payload.matched_blueprint"
             }),
             result_path="$.wrapup_result",
         )
@@ -176,10 +206,39 @@ class multipagepdfbdaStack(Stack):
             perform_bedrock_a2i
         )
         
-        need_a2i_choice.otherwise(perform_bedrock_a2i)
+        need_a2i_choice.otherwise(direct_wrapup_task)
+        
+        # A resumed execution skips the segments an earlier attempt wrote and
+        # the reviews it completed; check_confidence reads the checkpoints
+        segment_checkpoint_choice = aws_stepfunctions.Choice(self, "Segment Checkpointed?")
+        segment_checkpoint_choice.when(
+            aws_stepfunctions.Condition.and_(
+                aws_stepfunctions.Condition.is_present("$.confidence_result.Payload.resume_stage"),
+                aws_stepfunctions.Condition.string_equals("$.confidence_result.Payload.resume_stage", "written")
+            ),
+            aws_stepfunctions.Pass(
+                self,
+                "Segment Already Written",
+                input_path="$.confidence_result.Payload.wrapup_result",
+                result_path="$.wrapup_result",
+            )
+        )
+        segment_checkpoint_choice.when(
+            aws_stepfunctions.Condition.and_(
+                aws_stepfunctions.Condition.is_present("$.confidence_result.Payload.resume_stage"),
+                aws_stepfunctions.Condition.string_equals("$.confidence_result.Payload.resume_stage", "reviewed")
+            ),
+            aws_stepfunctions.Pass(
+                self,
+                "Restore Review Result",
+                input_path="$.confidence_result.Payload.review_result",
+                result_path="$.a2i_result",
+            ).next(wrapup_task)
+        )
+        segment_checkpoint_choice.otherwise(need_a2i_choice)
         
         # Set up the iterator chain
-        check_confidence_task.next(need_a2i_choice)
+        check_confidence_task.next(segment_checkpoint_choice)
         convert_pdf_task.next(perform_bedrock_a2i)
         perform_bedrock_a2i.next(wrapup_task)
         
@@ -194,6 +253,7 @@ class multipagepdfbdaStack(Stack):
                 "bucket.$": "$.bucket",
                 "key.$": "$.key",
                 "extension.$": "$.extension",
+                "resume.$": "$.resume",
                 "segment_uri.$": "$$.Map.Item.Value"
             }
         )
@@ -202,9 +262,52 @@ class multipagepdfbdaStack(Stack):
         process_segments_map.iterator(aws_stepfunctions.Chain.start(check_confidence_task))
         # Main choice state for document type
         pdf_or_image_choice = aws_stepfunctions.Choice(self, "PDF or Image?")
+        
+        # Optionally render the review pages of a PDF while the BDA job runs,
+        # e.g. cdk deploy -c speculative_rendering=true. The pages are cached
+        # under wip/{id}/ for the conversion step and removed by the cleanup.
+        if self.node.try_get_context("speculative_rendering") == "true":
+            task_invoke_bda_pdf = aws_stepfunctions_tasks.LambdaInvoke(
+                self,
+                "Invoke Bedrock Data Automation for PDF",
+                lambda_function=services["lambda"]["invoke_bda"],
+                payload_response_only=True,
+                result_path="$.bda_results",
+            )
+            
+            render_pages_task = aws_stepfunctions_tasks.LambdaInvoke(
+                self,
+                "Render Review Pages",
+                lambda_function=services["lambda"]["pngextract"],
+                payload=aws_stepfunctions.TaskInput.from_object({
+                    "id.$": "$.id",
+                    "bucket.$": "$.bucket",
+                    "key.$": "$.key"
+                }),
+                result_path=aws_stepfunctions.JsonPath.DISCARD,
+            )
+            # A failed render only costs the latency it was meant to save
+            render_pages_task.add_catch(
+                aws_stepfunctions.Pass(self, "Skip Speculative Rendering"),
+                result_path=aws_stepfunctions.JsonPath.DISCARD,
+            )
+            
+            # Only the BDA branch carries the state forward
+            bda_and_render = aws_stepfunctions.Parallel(
+                self,
+                "Invoke BDA and Render Pages",
+                output_path="$[0]",
+            )
+            bda_and_render.branch(task_invoke_bda_pdf)
+            bda_and_render.branch(render_pages_task)
+            bda_and_render.next(task_extract_metadata)
+            pdf_start = bda_and_render
+        else:
+            pdf_start = task_invoke_bda
+        
         pdf_or_image_choice.when(
             aws_stepfunctions.Condition.string_equals("$.extension", "pdf"),
-            task_invoke_bda
+            pdf_start
         )
         pdf_or_image_choice.when(
             aws_stepfunctions.Condition.string_equals("$.extension", "png"), 
@@ -215,6 +318,26 @@ class multipagepdfbdaStack(Stack):
             task_image_resize
         )
     
+        # tools/redrive.py starts a failed document again with a resume attempt
+        # and, when the BDA job had finished, its results
+        resume_choice = aws_stepfunctions.Choice(self, "Resume From Checkpoint?")
+        resume_choice.when(
+            aws_stepfunctions.Condition.is_present("$.bda_results"),
+            task_extract_metadata
+        )
+        resume_choice.when(
+            aws_stepfunctions.Condition.is_present("$.resume"),
+            pdf_or_image_choice
+        )
+        resume_choice.otherwise(
+            aws_stepfunctions.Pass(
+                self,
+                "Start From Upload",
+                result=aws_stepfunctions.Result.from_object({"attempt": 0}),
+                result_path="$.resume",
+            ).next(pdf_or_image_choice)
+        )
+    
         # Connect top level flow
         task_invoke_bda.next(task_extract_metadata)
         task_extract_metadata.next(process_segments_map)
@@ -227,7 +350,7 @@ class multipagepdfbdaStack(Stack):
             id="multipagepdfbda_stepfunction",
             state_machine_name="multipagepdfbda_stepfunction",
             role=services["sf_iam_roles"]["sfunctions"],
-            definition=pdf_or_image_choice,
+            definition=resume_choice,
             tracing_enabled=True,
             logs=aws_stepfunctions.LogOptions(
                 destination=services["sf_log_group"],
@@ -240,7 +363,7 @@ class multipagepdfbdaStack(Stack):
     def create_iam_role_for_lambdas(self, services):
         iam_roles = {}
 
-        names = ["kickoff", "pngextract", "analyzepdf", "humancomplete", "wrapup","imageresize","invoke_bda","check_confidence","extractmetadata","cleans3files"]
+        names = ["kickoff", "pngextract", "analyzepdf", "humancomplete", "humanfailed", "wrapup","imageresize","invoke_bda","check_confidence","extractmetadata","cleans3files","compaction","sweeper"]
         for name in names:
             iam_roles[name] = aws_iam.Role(
                 scope=self,
@@ -382,6 +505,8 @@ class multipagepdfbdaStack(Stack):
                 actions=[
                     "s3:GetObject",
                     "s3:PutObject",
+                    # A missing rendered.txt marker then reads as 404 rather than 403
+                    "s3:ListBucket",
                 ],
             )
         )
@@ -555,8 +680,7 @@ class multipagepdfbdaStack(Stack):
             statement=aws_iam.PolicyStatement(
                 resources=[f"arn:aws:dynamodb:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:table/{services['ddbtable_multia2ipdf_callback'].table_name}"],
                 actions=[
-                    "dynamodb:PutItem",
-                    "dynamodb:GetItem",
+                    "dynamodb:UpdateItem",
                 ],
             )
         )        
@@ -571,14 +695,6 @@ class multipagepdfbdaStack(Stack):
             )
         )         
 
-        iam_roles["humancomplete"].add_to_policy(
-            statement=aws_iam.PolicyStatement(
-                resources=[f"arn:aws:dynamodb:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:table/{services['ddbtable_multia2ipdf_callback'].table_name}/index/document_id-index"],
-                actions=[
-                    "dynamodb:Query",
-                ],
-            )
-        )
         iam_roles["humancomplete"].add_to_policy(
             statement=aws_iam.PolicyStatement(
                 resources=[f"arn:aws:dynamodb:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:table/{services['ddbtable_multia2ipdf_callback'].table_name}"],
@@ -639,6 +755,44 @@ class multipagepdfbdaStack(Stack):
             )
         )          
 
+        iam_roles["humanfailed"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:dynamodb:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:table/{services['ddbtable_multia2ipdf_callback'].table_name}"],
+                actions=[
+                    "dynamodb:GetItem",
+                    "dynamodb:UpdateItem"
+                ],
+            )
+        )
+
+        iam_roles["humanfailed"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:states:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:stateMachine:multipagepdfbda_stepfunction"], 
+                actions=[
+                    "states:SendTaskFailure",
+                ],
+            )
+        )
+
+        iam_roles["humanfailed"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:logs:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:*"],   
+                actions=[ 
+                    "logs:CreateLogGroup",
+                ],
+            )
+        ) 
+
+        iam_roles["humanfailed"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:logs:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:log-group:/aws/lambda/multipagepdfbda_humanfailed:*"],   
+                actions=[ 
+                    "logs:CreateLogStream",
+                    "logs:PutLogEvents",                    
+                ],
+            )
+        )
+
         iam_roles["wrapup"].add_to_policy(
             statement=aws_iam.PolicyStatement(
                 resources=[services["main_s3_bucket"].bucket_arn,  f"{services['main_s3_bucket'].bucket_arn}/*"],
@@ -647,11 +801,23 @@ class multipagepdfbdaStack(Stack):
                     "s3:PutObject",
                     "s3:Object",
                     "s3:DeleteObject",
-                    "s3:ListBucket",                    
+                    "s3:ListBucket",
+                    "s3:AbortMultipartUpload",
                 ],
             )
         )        
 
+        # Blueprint schemas type the Parquet output columns
+        iam_roles["wrapup"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:bedrock:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:blueprint/*",
+                           f"arn:aws:bedrock:{cdk.Stack.of(self).region}:aws:blueprint/*"],
+                actions=[
+                    "bedrock:GetBlueprint",
+                ],
+            )
+        )
+
         iam_roles["wrapup"].add_to_policy(
             statement=aws_iam.PolicyStatement(
                 resources=[f"arn:aws:logs:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:*"], 
@@ -671,6 +837,135 @@ class multipagepdfbdaStack(Stack):
             )
         )
         
+        iam_roles["sweeper"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[services["main_s3_bucket"].bucket_arn,  f"{services['main_s3_bucket'].bucket_arn}/*"],
+                actions=[
+                    "s3:ListBucket",
+                    "s3:DeleteObject",
+                ],
+            )
+        )
+
+        iam_roles["sweeper"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:states:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:execution:multipagepdfbda_stepfunction:*"],
+                actions=[
+                    "states:DescribeExecution",
+                ],
+            )
+        )
+
+        iam_roles["sweeper"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:logs:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:*"], 
+                actions=[ 
+                    "logs:CreateLogGroup",
+                ],
+            )
+        ) 
+
+        iam_roles["sweeper"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:logs:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:log-group:/aws/lambda/multipagepdfbda_sweeper:*"],   
+                actions=[ 
+                    "logs:CreateLogStream",
+                    "logs:PutLogEvents",                    
+                ],
+            )
+        )
+
+        iam_roles["compaction"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[services["main_s3_bucket"].bucket_arn,  f"{services['main_s3_bucket'].bucket_arn}/*"],
+                actions=[
+                    "s3:GetObject",
+                    "s3:PutObject",
+                    "s3:ListBucket",
+                    "s3:DeleteObject",
+                ],
+            )
+        )
+
+        iam_roles["compaction"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:logs:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:*"], 
+                actions=[ 
+                    "logs:CreateLogGroup",
+                ],
+            )
+        ) 
+
+        iam_roles["compaction"].add_to_policy(
+            statement=aws_iam.PolicyStatement(
+                resources=[f"arn:aws:logs:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:log-group:/aws/lambda/multipagepdfbda_compaction:*"],   
+                actions=[ 
+                    "logs:CreateLogStream",
+                    "logs:PutLogEvents",                    
+                ],
+            )
+        )
+
+        for name in ["kickoff", "invoke_bda", "check_confidence", "analyzepdf", "humancomplete", "wrapup"]:
+            iam_roles[name].add_to_policy(
+                statement=aws_iam.PolicyStatement(
+                    resources=[services["timeline_table"].table_arn],
+                    actions=["dynamodb:UpdateItem"],
+                )
+            )
+
+        # In-flight leases in the callback table and deferred uploads, for kickoff's
+        # backpressure, see multipagepdfbda_common/inflight.py
+        if self.inflight_limits():
+            inflight_actions = {
+                "kickoff": ["dynamodb:Query"],
+                "invoke_bda": ["dynamodb:PutItem", "dynamodb:DeleteItem"],
+                "analyzepdf": ["dynamodb:PutItem"],
+                "humancomplete": ["dynamodb:DeleteItem"],
+                "humanfailed": ["dynamodb:DeleteItem"],
+            }
+            for name, actions in inflight_actions.items():
+                iam_roles[name].add_to_policy(
+                    statement=aws_iam.PolicyStatement(
+                        resources=[services["ddbtable_multia2ipdf_callback"].table_arn],
+                        actions=actions,
+                    )
+                )
+            iam_roles["kickoff"].add_to_policy(
+                statement=aws_iam.PolicyStatement(
+                    resources=[services["sf_sqs"].queue_arn],
+                    actions=["sqs:ChangeMessageVisibility"],
+                )
+            )
+
+        # Stage checkpoints in the callback table, see multipagepdfbda_common/checkpoint.py
+        checkpoint_actions = {
+            "invoke_bda": ["dynamodb:PutItem"],
+            "check_confidence": ["dynamodb:PutItem", "dynamodb:Query"],
+            "analyzepdf": ["dynamodb:PutItem", "dynamodb:Query"],
+            "humancomplete": ["dynamodb:PutItem"],
+            "humanfailed": ["dynamodb:PutItem"],
+            "wrapup": ["dynamodb:PutItem"],
+        }
+        for name, actions in checkpoint_actions.items():
+            iam_roles[name].add_to_policy(
+                statement=aws_iam.PolicyStatement(
+                    resources=[services["ddbtable_multia2ipdf_callback"].table_arn],
+                    actions=actions,
+                )
+            )
+
+        # Sampled profiles are uploaded under profiles/, see multipagepdfbda_common/profiling.py
+        if self.node.try_get_context("profile_sample_rate"):
+            for name, role in iam_roles.items():
+                if name not in ("pngextract", "imageresize"):
+                    role.add_to_policy(
+                        statement=aws_iam.PolicyStatement(
+                            resources=[f"{services['main_s3_bucket'].bucket_arn}/profiles/*"],
+                            actions=["s3:PutObject"],
+                        )
+                    )
+
         return iam_roles
         
     def create_iam_role_for_stepfunction(self, services):
@@ -687,7 +982,7 @@ class multipagepdfbdaStack(Stack):
 
         iam_roles["sfunctions"].add_to_policy(
             statement=aws_iam.PolicyStatement(
-                resources=[services['bedrock_sqs'].queue_arn],
+                resources=[services['bedrock_sqs'].queue_arn, services['cleanup_sqs'].queue_arn],
                 actions=[
                     "sqs:SendMessage"
                 ],
@@ -762,6 +1057,44 @@ class multipagepdfbdaStack(Stack):
 
 
         
+    def inflight_limits(self):
+        """
+        The backpressure limits set in the context, e.g.
+        cdk deploy -c max_inflight_bda=20 -c max_inflight_reviews=200
+        """
+        limits = {}
+        for key in ("max_inflight_bda", "max_inflight_reviews"):
+            value = self.node.try_get_context(key)
+            if value:
+                limits[key] = int(value)
+        return limits
+
+    def add_common_environment(self, function, services):
+        """
+        Pass the settings of the common layer to a function: the timeline,
+        checkpoint and in-flight tables, and the logging and profiling settings, e.g.
+        cdk deploy -c log_level=DEBUG -c log_sample_rate=0.01 -c profile_sample_rate=0.05
+        """
+        function.add_environment("timeline_table", services["timeline_table"].table_name)
+        # Checkpoints point at intermediate files, so they expire with them
+        function.add_environment("checkpoint_table", services["ddbtable_multia2ipdf_callback"].table_name)
+        function.add_environment("checkpoint_ttl_days", str(self.node.try_get_context("intermediate_expiry_days") or 30))
+        if self.inflight_limits():
+            function.add_environment("inflight_table", services["ddbtable_multia2ipdf_callback"].table_name)
+        log_level = self.node.try_get_context("log_level")
+        if log_level:
+            function.add_environment("LOG_LEVEL", str(log_level).upper())
+        log_sample_rate = self.node.try_get_context("log_sample_rate")
+        if log_sample_rate:
+            function.add_environment("log_sample_rate", str(log_sample_rate))
+        profile_sample_rate = self.node.try_get_context("profile_sample_rate")
+        if profile_sample_rate:
+            function.add_environment("profile_sample_rate", str(profile_sample_rate))
+            function.add_environment("profile_bucket", services["main_s3_bucket"].bucket_name)
+            modes = self.node.try_get_context("profile_modes")
+            if modes:
+                function.add_environment("profile_modes", str(modes))
+
     def create_lambda_functions(self, services):
         lambda_functions = {}
         
@@ -780,6 +1113,14 @@ class multipagepdfbdaStack(Stack):
             compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_12], 
             description="bedrock BDA dependencies" 
         )      
+        # Shared runtime helpers (pooled AWS clients, S3 key layout) for every
+        # Python function, imported as multipagepdfbda_common
+        services["common_layer"] = aws_lambda.LayerVersion(
+            self, "multipagepdfbda_common_layer",
+            code=aws_lambda.Code.from_asset("./deploy_code/multipagepdfbda_common/"),
+            compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_12],
+            description="multipagepdfbda shared runtime helpers"
+        )
         
 
         lambda_functions["pngextract"] = aws_lambda.Function(
@@ -846,6 +1187,27 @@ class multipagepdfbdaStack(Stack):
             memory_size=3000,
             role=services["iam_roles"]["cleans3files"],
         ) 
+
+        # Scheduled sweep of the wip/ and BDA output folders of executions that
+        # did not reach the cleanup step
+        lambda_functions["sweeper"] = aws_lambda.Function(
+            scope=self,
+            id="multipagepdfbda_sweeper",
+            function_name="multipagepdfbda_sweeper",
+            code=aws_lambda.Code.from_asset(
+                "./deploy_code/multipagepdfbda_cleans3files/"
+            ),
+            handler="lambda_function.sweep_handler",
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            timeout=cdk.Duration.minutes(15),
+            memory_size=1024,
+            reserved_concurrent_executions=1,
+            role=services["iam_roles"]["sweeper"],
+            environment={
+                "bucket": services["main_s3_bucket"].bucket_name,
+                "execution_arn_prefix": f"arn:aws:states:{cdk.Stack.of(self).region}:{cdk.Stack.of(self).account}:execution:multipagepdfbda_stepfunction:",
+            },
+        )
         
         lambda_functions["extractmetadata"] = aws_lambda.Function(
             scope=self,
@@ -899,6 +1261,10 @@ class multipagepdfbdaStack(Stack):
             },
         )         
 
+        # Optional AWS SDK for pandas layer (provides pyarrow) enables the Parquet
+        # output of wrapup, e.g. cdk deploy -c sdk_pandas_layer_arn=arn:aws:lambda:...
+        sdk_pandas_layer_arn = self.node.try_get_context("sdk_pandas_layer_arn")
+
         names = ["humancomplete", "wrapup"]
 
         for name in names:
@@ -917,21 +1283,83 @@ class multipagepdfbdaStack(Stack):
                 environment={
                     "ddb_tablename": services["ddbtable_multia2ipdf_callback"].table_name,
                 },                  
+                # Completion events whose callbacks could not be delivered
+                dead_letter_queue=services["callbacks_dlq"] if name == "humancomplete" else None,
             )
 
+        sdk_pandas_layer = None
+        if sdk_pandas_layer_arn:
+            sdk_pandas_layer = aws_lambda.LayerVersion.from_layer_version_arn(self, "sdkpandaslayer", sdk_pandas_layer_arn)
+            lambda_functions["wrapup"].add_layers(sdk_pandas_layer)
+            lambda_functions["wrapup"].add_environment("PARQUET_OUTPUT", "true")
+
+        # Human reviews are stored as deltas; leaving out the full merged view is opt-in
+        if str(self.node.try_get_context("delta_only_human_output")).lower() == "true":
+            lambda_functions["wrapup"].add_environment("DELTA_ONLY_HUMAN_OUTPUT", "true")
 
+        # Scheduled compaction of the per-document outputs in complete/ into batch
+        # files; one concurrent execution so runs never overlap
+        lambda_functions["compaction"] = aws_lambda.Function(
+            scope=self,
+            id="multipagepdfbda_compaction",
+            function_name="multipagepdfbda_compaction",
+            code=aws_lambda.Code.from_asset(
+                "./deploy_code/multipagepdfbda_compaction/"
+            ),
+            handler="lambda_function.lambda_handler",
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            timeout=cdk.Duration.minutes(15),
+            memory_size=3000,
+            reserved_concurrent_executions=1,
+            role=services["iam_roles"]["compaction"],
+            environment={
+                "bucket": services["main_s3_bucket"].bucket_name,
+            },
+        )
+
+        # The same layer lets compaction merge the Parquet files as well
+        if sdk_pandas_layer:
+            lambda_functions["compaction"].add_layers(sdk_pandas_layer)
+
+        # Fails the waiting task tokens when a human loop fails or is stopped;
+        # shares the humancomplete code and callback fan-out
+        lambda_functions["humanfailed"] = aws_lambda.Function(
+            scope=self,
+            id="multipagepdfbda_humanfailed",
+            function_name="multipagepdfbda_humanfailed",
+            code=aws_lambda.Code.from_asset(
+                "./deploy_code/multipagepdfbda_humancomplete/"
+            ),
+            handler="lambda_function.failed_loop_handler",
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            timeout=cdk.Duration.minutes(3),
+            memory_size=1024,
+            role=services["iam_roles"]["humanfailed"],
+            environment={
+                "ddb_tablename": services["ddbtable_multia2ipdf_callback"].table_name,
+            },
+            dead_letter_queue=services["callbacks_dlq"],
+        )
+
+        for name, function in lambda_functions.items():
+            if name not in ("pngextract", "imageresize"):
+                function.add_layers(services["common_layer"])
+                self.add_common_environment(function, services)
  
         NagSuppressions.add_resource_suppressions(
             [
                 lambda_functions["wrapup"],
                 lambda_functions["imageresize"],
                 lambda_functions["humancomplete"],
+                lambda_functions["humanfailed"],
                 lambda_functions["analyzepdf"],
                 lambda_functions["pngextract"],
                 lambda_functions["check_confidence"],
                 lambda_functions["invoke_bda"],
                 lambda_functions["cleans3files"],
-                lambda_functions["extractmetadata"],                
+                lambda_functions["extractmetadata"],
+                lambda_functions["compaction"],
+                lambda_functions["sweeper"],
             ],
             [
                 {
@@ -981,39 +1409,124 @@ class multipagepdfbdaStack(Stack):
                 aws_s3.NotificationKeyFilter(prefix="uploads/", suffix=extension),
             )
 
+        # Concurrent invocations per queue: kickoff's bounds how fast documents
+        # enter the pipeline, analyzepdf's how fast human loops are started.
+        # Change them with cdk deploy -c kickoff_max_concurrency=<n>
+        # -c analyzepdf_max_concurrency=<n> (2 to 1000)
+        services["sqs_max_concurrency"] = {
+            "kickoff": int(self.node.try_get_context("kickoff_max_concurrency") or 5),
+            "analyzepdf": int(self.node.try_get_context("analyzepdf_max_concurrency") or 10),
+        }
+
         services["lambda"]["kickoff"].add_event_source(
-            aws_lambda_event_sources.SqsEventSource(services["sf_sqs"], batch_size=1)
+            aws_lambda_event_sources.SqsEventSource(
+                services["sf_sqs"], batch_size=10, report_batch_item_failures=True,
+                max_concurrency=services["sqs_max_concurrency"]["kickoff"],
+            )
         )
 
         services["lambda"]["analyzepdf"].add_event_source(
             aws_lambda_event_sources.SqsEventSource(
-                services["bedrock_sqs"], batch_size=1
+                services["bedrock_sqs"], batch_size=1,
+                max_concurrency=services["sqs_max_concurrency"]["analyzepdf"],
             )
         )
 
-        human_complete_target = aws_events_targets.LambdaFunction(
-            services["lambda"]["humancomplete"]
+        # Routing table for A2I human loop status changes of our flow definition.
+        # Each entry becomes one rule so other A2I workloads in the account and
+        # statuses we do not act on never invoke a function.
+        human_loop_routes = [
+            ("multipadepdfa2i_HumanReviewComplete", ["Completed"], services["lambda"]["humancomplete"]),
+            ("multipadepdfa2i_HumanReviewFailed", ["Failed", "Stopped"], services["lambda"]["humanfailed"]),
+        ]
+
+        for rule_id, statuses, function in human_loop_routes:
+            aws_events.Rule(
+                self,
+                rule_id,
+                event_pattern=aws_events.EventPattern(
+                    source=["aws.sagemaker"],
+                    detail_type=["SageMaker A2I HumanLoop Status Change"],
+                    detail={
+                        "humanLoopStatus": statuses,
+                        "flowDefinitionArn": [SAGEMAKER_WORKFLOW_AUGMENTED_AI_ARN_EV],
+                    },
+                ),
+                targets=[aws_events_targets.LambdaFunction(function)],
+            )
+
+        services["lambda"]["cleans3files"].add_event_source(
+            aws_lambda_event_sources.SqsEventSource(
+                services["cleanup_sqs"], batch_size=10, report_batch_item_failures=True
+            )
         )
 
-        human_review_event_pattern = aws_events.EventPattern(
-            source=["aws.sagemaker"],
-            detail_type=["SageMaker A2I HumanLoop Status Change"],
+        # Scheduled orphan sweep; the interval can be changed with
+        # cdk deploy -c sweeper_interval_minutes=60
+        sweeper_interval = int(self.node.try_get_context("sweeper_interval_minutes") or 360)
+        aws_events.Rule(
+            self,
+            "multipagepdfbda_SweeperSchedule",
+            schedule=aws_events.Schedule.rate(cdk.Duration.minutes(sweeper_interval)),
+            targets=[aws_events_targets.LambdaFunction(services["lambda"]["sweeper"])],
         )
 
+        # Scheduled compaction; the interval can be changed with
+        # cdk deploy -c compaction_interval_minutes=15
+        compaction_interval = int(self.node.try_get_context("compaction_interval_minutes") or 60)
         aws_events.Rule(
             self,
-            "multipadepdfa2i_HumanReviewComplete",
-            event_pattern=human_review_event_pattern,
-            targets=[human_complete_target],
+            "multipagepdfbda_CompactionSchedule",
+            schedule=aws_events.Schedule.rate(cdk.Duration.minutes(compaction_interval)),
+            targets=[aws_events_targets.LambdaFunction(services["lambda"]["compaction"])],
         )
 
+    def set_reserved_concurrency(self, services):
+        """
+        Reserve concurrency for the functions named in the context, e.g.
+        cdk deploy -c reserved_concurrency=invoke_bda:20,analyzepdf:10, or a
+        {name: n} object in cdk.json. Nothing is reserved by default: every
+        reservation comes out of the account's unreserved concurrency, and
+        the deployment fails if less than 100 would be left.
+        """
+        setting = self.node.try_get_context("reserved_concurrency")
+        if not setting:
+            return
+        if isinstance(setting, dict):
+            entries = setting.items()
+        else:
+            entries = [entry.strip().split(":", 1) for entry in str(setting).split(",") if entry.strip()]
+        for name, limit in entries:
+            function = services["lambda"].get(name)
+            if function is None:
+                raise ValueError(f"reserved_concurrency names an unknown function: {name}")
+            function.node.default_child.reserved_concurrent_executions = int(limit)
+            # An SQS event source that may run more invocations than are reserved gets throttled
+            max_concurrency = services["sqs_max_concurrency"].get(name)
+            if max_concurrency and int(limit) < max_concurrency:
+                cdk.Annotations.of(function).add_warning(
+                    f"Reserved concurrency {limit} of {name} is below the maximum concurrency "
+                    f"{max_concurrency} of its SQS event source; messages will be throttled and retried"
+                )
+
     def create_services(self):
         services = {}
         # S3 bucket
+        # Backstop expiry of intermediate files. It must outlast the longest
+        # human review, e.g. cdk deploy -c intermediate_expiry_days=14
+        intermediate_expiry = cdk.Duration.days(int(self.node.try_get_context("intermediate_expiry_days") or 30))
         services["main_s3_bucket"] = aws_s3.Bucket(
             self, "multipagepdfbda", removal_policy=cdk.RemovalPolicy.DESTROY,  
             encryption=aws_s3.BucketEncryption.S3_MANAGED,
-            access_control=aws_s3.BucketAccessControl.BUCKET_OWNER_FULL_CONTROL
+            access_control=aws_s3.BucketAccessControl.BUCKET_OWNER_FULL_CONTROL,
+            lifecycle_rules=[
+                aws_s3.LifecycleRule(id="expire-wip", prefix="wip/", expiration=intermediate_expiry),
+                aws_s3.LifecycleRule(id="expire-bda-output", prefix="output/", expiration=intermediate_expiry),
+                aws_s3.LifecycleRule(id="expire-profiles", prefix="profiles/", expiration=intermediate_expiry),
+                # Index entries of the segments for compaction, see multipagepdfbda_compaction
+                aws_s3.LifecycleRule(id="expire-compaction-index", prefix="compacted/_index/", expiration=intermediate_expiry),
+                aws_s3.LifecycleRule(id="abort-incomplete-uploads", abort_incomplete_multipart_upload_after=cdk.Duration.days(1)),
+            ],
         )
         
  
@@ -1026,26 +1539,81 @@ class multipagepdfbdaStack(Stack):
                             name="callback_token", type=aws_dynamodb.AttributeType.STRING
                         ),
                         billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                        # Removes the expired in-flight leases and stage checkpoints, see
+                        # multipagepdfbda_common/inflight.py and checkpoint.py
+                        time_to_live_attribute="expires_at",
                         point_in_time_recovery=True,  # Enable backup (Point-in-Time Recovery)
                         removal_policy=cdk.RemovalPolicy.DESTROY,
                         encryption=aws_dynamodb.TableEncryption.AWS_MANAGED  # Use AWS-managed key
         )
 
-        # Add the global secondary index for document_id
-        services["ddbtable_multia2ipdf_callback"].add_global_secondary_index(
-            index_name="document_id-index",
-            partition_key=aws_dynamodb.Attribute(
-                name="document_id", type=aws_dynamodb.AttributeType.STRING
-            ),
+        # One item per document with the spans of its stages, see
+        # multipagepdfbda_common/timeline.py and tools/timeline_report.py
+        services["timeline_table"] = aws_dynamodb.Table(
+            self, "multipagepdfbda_timeline",
+            partition_key=aws_dynamodb.Attribute(name="id", type=aws_dynamodb.AttributeType.STRING),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            encryption=aws_dynamodb.TableEncryption.AWS_MANAGED
+        )
+        services["timeline_table"].add_global_secondary_index(
+            index_name="by_day",
+            partition_key=aws_dynamodb.Attribute(name="day", type=aws_dynamodb.AttributeType.STRING),
+            sort_key=aws_dynamodb.Attribute(name="uploaded_at", type=aws_dynamodb.AttributeType.NUMBER),
             projection_type=aws_dynamodb.ProjectionType.ALL
-        )        
+        )
 
+        # Dead-letter queues of the uploads, the cleanups and the human loop
+        # callbacks; tools/redrive.py moves their messages back
+        services["uploads_dlq"] = aws_sqs.Queue(
+            self,
+            "multipagepdfbda_uploads_dlq",
+            queue_name="multipagepdfbda_uploads_dlq",
+            retention_period=cdk.Duration.days(14),
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+        )
+
+        services["cleanup_dlq"] = aws_sqs.Queue(
+            self,
+            "multipagepdfbda_cleanup_dlq",
+            queue_name="multipagepdfbda_cleanup_dlq",
+            retention_period=cdk.Duration.days(14),
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+        )
+
+        services["callbacks_dlq"] = aws_sqs.Queue(
+            self,
+            "multipagepdfbda_callbacks_dlq",
+            queue_name="multipagepdfbda_callbacks_dlq",
+            retention_period=cdk.Duration.days(14),
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+        )
+
+        # Uploads deferred by kickoff's backpressure are received again each
+        # time, so the count allows for them, e.g. cdk deploy -c upload_max_receives=100
         services["sf_sqs"] = aws_sqs.Queue(
             self,
             "multipagepdfbda_sf_sqs",
             queue_name="multipagepdfbda_sf_sqs",
             visibility_timeout=cdk.Duration.minutes(5),
             encryption=aws_sqs.QueueEncryption.SQS_MANAGED, 
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                queue=services["uploads_dlq"],
+                max_receive_count=int(self.node.try_get_context("upload_max_receives") or 50),
+            ),
+        )
+
+        services["cleanup_sqs"] = aws_sqs.Queue(
+            self,
+            "multipagepdfbda_cleanup_sqs",
+            queue_name="multipagepdfbda_cleanup_sqs",
+            visibility_timeout=cdk.Duration.minutes(5),
+            encryption=aws_sqs.QueueEncryption.SQS_MANAGED,
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                queue=services["cleanup_dlq"],
+                max_receive_count=int(self.node.try_get_context("cleanup_max_receives") or 5),
+            ),
         )
 
         services["bedrock_sqs"] = aws_sqs.Queue(
@@ -1083,11 +1651,19 @@ class multipagepdfbdaStack(Stack):
             timeout=cdk.Duration.minutes(5),
             memory_size=3000,
             role=services["iam_roles"]["kickoff"],
+            layers=[services["common_layer"]],
             environment={
                 "sqs_url": services["sf_sqs"].queue_url,
                 "state_machine_arn": services["sf"].state_machine_arn,
             },
         )
+        self.add_common_environment(services["lambda"]["kickoff"], services)
+        # Backpressure on the uploads, see deploy_code/multipagepdfbda_kickoff
+        for key, limit in self.inflight_limits().items():
+            services["lambda"]["kickoff"].add_environment(key, str(limit))
+        backpressure_delay = self.node.try_get_context("backpressure_delay_seconds")
+        if backpressure_delay:
+            services["lambda"]["kickoff"].add_environment("backpressure_delay_seconds", str(backpressure_delay))
 
         NagSuppressions.add_resource_suppressions(
             [
@@ -0,0 +1,751 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+Discrete-event simulation of the pipeline's capacity.
+
+Documents arrive at --rate per hour and go through the stages of the state
+machine, competing for the limited resources:
+
+    Lambda      concurrent executions of the account, shared by all functions
+    BDA         concurrent jobs and InvokeDataAutomationAsync calls per second
+    Map         segments of one execution processed at once
+    reviewers   the private workforce; each works on one page (human loop) at a time
+
+    upload_queue delay, kickoff
+    invoke_bda: holds its Lambda for the BDA job, plus any wait for the quota;
+                fails the document when that exceeds the 3 minute timeout
+    extractmetadata
+    Map over segments: check_confidence, then either wrapup, or
+        pngextract (PDFs), review_queue delay, analyzepdf, a reviewer for
+        every page, humancomplete per page, and wrapup
+
+Work over a quota waits in line; the pipeline sees throttling and retries
+instead, so queueing delay is reported where it would build up.
+
+Stage times, the BDA job time per page and the document mix (pages,
+segments, share of segments reviewed, PDFs) are fitted from timelines: an
+NDJSON export of tools/timeline_report.py (--input) or the timeline table
+(--table). Function durations no span covers come from EMF records of the
+functions (--metrics, NDJSON as written to the logs), or defaults. Any of
+them can be set on the command line as a constant ("800ms") or as a
+lognormal distribution given its median and p95 ("3m,12m").
+
+The report shows end-to-end latency percentiles, the offered load and
+utilization of each resource, queue depths over time and the cost per
+document. --what-if reruns the simulation with changed settings, on the same
+arrivals, and compares the scenarios:
+
+    python tools/capacity_sim.py --input week.ndjson --rate 300 --hours 8
+    python tools/capacity_sim.py --input week.ndjson --rate 300 --what-if reviewers=x2 --what-if bda_concurrency=50
+    python tools/capacity_sim.py --rate 120 --pages 1:0.6,10:0.3,50:0.1 --review-share 0.4 --review-time 3m,12m
+
+Prices are us-east-1 list prices when this was written; check them, and the
+BDA quotas of the account, before relying on the cost and quota figures.
+"""
+
+import argparse
+import datetime
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+
+from timeline_report import PERCENTILES, format_ms, parse_time, percentile, plain, query_window, unique_spans
+
+HOUR_MS = 3600 * 1000
+
+# Defaults of the resources, as deployed or as the default service quotas
+LIMITS = {
+    "lambda_concurrency": 1000,
+    "bda_concurrency": 25,
+    "bda_tps": 10.0,
+    "map_concurrency": 40,
+    "reviewers": 10,
+}
+
+# Settings --what-if can change, besides the limits
+SCENARIO_SETTINGS = tuple(LIMITS) + ("rate", "review_share", "review_time", "bda_page_time")
+
+# Lambda memory of the functions, in MB (create_lambda_functions)
+FUNCTION_MEMORY_MB = {"humanfailed": 1024}
+DEFAULT_MEMORY_MB = 3000
+INVOKE_BDA_TIMEOUT_MS = 3 * 60 * 1000
+
+PRICES = {
+    "bda_page": 0.04,            # custom output, per page
+    "a2i_object": 0.08,          # per object (page) reviewed
+    "lambda_gb_second": 0.0000166667,
+    "lambda_request": 0.0000002,
+    "state_transition": 0.000025,
+}
+
+# Stage times used when neither timelines, metrics nor options give one
+DEFAULT_TIMES = {
+    "upload_queue": "2s,10s",
+    "kickoff": "150ms",
+    "bda_base": "20s",
+    "bda_page_time": "2s",
+    "extractmetadata": "300ms",
+    "check_confidence": "600ms,2s",
+    "render_page": "500ms",
+    "review_queue": "2s,8s",
+    "analyzepdf": "800ms",
+    "review_time": "3m,12m",
+    "humancomplete": "400ms",
+    "wrapup": "1.5s,5s",
+}
+
+# Settings fitted from the spans of the timelines
+SPAN_SETTINGS = {
+    "upload_queue": "upload_queue",
+    "confidence": "check_confidence",
+    "review_queue": "review_queue",
+    "review": "review_time",
+    "wrapup": "wrapup",
+}
+
+DURATION_UNITS = {"ms": 1, "s": 1000, "m": 60000, "h": HOUR_MS}
+
+
+def parse_duration(text):
+    """Milliseconds of "250ms", "30s", "5m" or "1.5h"; a bare number is seconds."""
+    text = text.strip()
+    for unit in ("ms", "s", "m", "h"):
+        if text.endswith(unit) and text[:-len(unit)].replace(".", "", 1).isdigit():
+            return float(text[:-len(unit)]) * DURATION_UNITS[unit]
+    return float(text) * 1000
+
+
+class Constant:
+    def __init__(self, value):
+        self.value = value
+        self.mean = value
+
+    def sample(self, rng):
+        return self.value
+
+    def scaled(self, factor):
+        return Constant(self.value * factor)
+
+    def __str__(self):
+        return format_ms(self.value)
+
+
+class Lognormal:
+    """Lognormal distribution with the given median and 95th percentile."""
+
+    def __init__(self, median, p95):
+        self.median = median
+        self.p95 = max(p95, median)
+        self.mu = math.log(median)
+        self.sigma = (math.log(self.p95) - self.mu) / 1.6449
+        self.mean = math.exp(self.mu + self.sigma ** 2 / 2)
+
+    def sample(self, rng):
+        return rng.lognormvariate(self.mu, self.sigma)
+
+    def scaled(self, factor):
+        return Lognormal(self.median * factor, self.p95 * factor)
+
+    def __str__(self):
+        return f"{format_ms(self.median)},{format_ms(self.p95)}"
+
+
+class Empirical:
+    """Observed values, sampled with replacement."""
+
+    def __init__(self, values):
+        self.values = list(values)
+        self.mean = sum(self.values) / len(self.values)
+
+    def sample(self, rng):
+        return rng.choice(self.values)
+
+    def scaled(self, factor):
+        return Empirical(value * factor for value in self.values)
+
+    def __str__(self):
+        return f"{len(self.values)} observed, p50 {format_ms(percentile(self.values, 50))}"
+
+
+def parse_distribution(text):
+    """A Constant of "800ms", or a Lognormal of "median,p95" such as "3m,12m"."""
+    parts = text.split(",")
+    if len(parts) == 2:
+        return Lognormal(parse_duration(parts[0]), parse_duration(parts[1]))
+    return Constant(parse_duration(text))
+
+
+def parse_mix(text):
+    """[(pages, weight)] of "1:0.6,10:0.3,50:0.1"."""
+    mix = []
+    for entry in text.split(","):
+        pages, _, weight = entry.partition(":")
+        mix.append((int(pages), float(weight or 1)))
+    return mix
+
+
+def page_count(pages):
+    return len(pages) if isinstance(pages, list) else 1
+
+
+def fit_timelines(items):
+    """
+    Stage times and the document mix of timeline items.
+
+    Returns:
+        ({setting: [ms]}, [(pages, bda ms)], [document]) where a document is
+        {"pages", "pdf", "segments": [{"pages", "review"}]}
+    """
+    times, bda_points, documents = {}, [], []
+    for item in items:
+        spans = unique_spans(item)
+        segments = {}
+        for span in spans:
+            duration = span["end"] - span["start"]
+            if span["stage"] == "confidence" and "segment" in span:
+                segments[span["segment"]] = {"pages": page_count(span.get("pages")), "review": bool(span.get("needs_review"))}
+            if span["stage"] in SPAN_SETTINGS:
+                times.setdefault(SPAN_SETTINGS[span["stage"]], []).append(duration)
+        if not segments:
+            continue
+        document = {
+            "pages": sum(segment["pages"] for segment in segments.values()),
+            "pdf": str(item.get("key", ".pdf")).lower().endswith(".pdf"),
+            "segments": [segments[index] for index in sorted(segments)],
+        }
+        documents.append(document)
+        for span in spans:
+            if span["stage"] == "bda_job":
+                bda_points.append((document["pages"], span["end"] - span["start"]))
+    return times, bda_points, documents
+
+
+def fit_linear(points):
+    """Least-squares (base, per page) of BDA job times; per page alone when all documents have the same size."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return 0, mean_y / mean_x
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+    slope = max(slope, 0)
+    return max(mean_y - slope * mean_x, 0), slope
+
+
+def read_metrics(path):
+    """{function: [StageDuration ms]} of EMF records, one per line, possibly after a log prefix."""
+    durations = {}
+    with open(path) as f:
+        for line in f:
+            start = line.find("{")
+            if start < 0:
+                continue
+            try:
+                record = json.loads(line[start:])
+            except ValueError:
+                continue
+            if "StageDuration" not in record or "Function" not in record:
+                continue
+            function = record["Function"].rsplit("multipagepdfbda_", 1)[-1]
+            values = record["StageDuration"]
+            durations.setdefault(function, []).extend(values if isinstance(values, list) else [values])
+    return durations
+
+
+class Resource:
+    """A pool of capacity units, granted first come first served."""
+
+    def __init__(self, simulation, name, capacity):
+        self.simulation = simulation
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0
+        self.waiting = []
+        self.busy_ms = 0
+        self.changed_at = 0
+        self.waited = 0
+
+    def _account(self):
+        now = self.simulation.now
+        self.busy_ms += self.in_use * (now - self.changed_at)
+        self.changed_at = now
+
+    def acquire(self):
+        def command(simulation, resume):
+            if self.in_use < self.capacity:
+                self._account()
+                self.in_use += 1
+                resume()
+            else:
+                self.waited += 1
+                self.waiting.append(resume)
+        return command
+
+    def release(self):
+        self._account()
+        if self.waiting:
+            self.simulation.at(self.simulation.now, self.waiting.pop(0))
+        else:
+            self.in_use -= 1
+
+    def utilization(self, elapsed):
+        self._account()
+        return self.busy_ms / (self.capacity * elapsed) if elapsed and self.capacity else 0
+
+
+class TokenBucket:
+    """Admits at most rate calls per second, one at a time."""
+
+    def __init__(self, rate):
+        self.interval = 1000 / rate
+        self.next_free = 0
+        self.waited = 0
+
+    def take(self):
+        def command(simulation, resume):
+            start = max(simulation.now, self.next_free)
+            self.next_free = start + self.interval
+            if start > simulation.now:
+                self.waited += 1
+            simulation.at(start, resume)
+        return command
+
+
+class Simulation:
+    """Event loop running generator processes that yield commands."""
+
+    def __init__(self):
+        self.now = 0
+        self.events = []
+        self.sequence = itertools.count()
+
+    def at(self, time, callback):
+        heapq.heappush(self.events, (time, next(self.sequence), callback))
+
+    def start(self, process, done=None):
+        self._step(process, done)
+
+    def _step(self, process, done):
+        try:
+            command = next(process)
+        except StopIteration as stop:
+            if done:
+                done(stop.value)
+            return
+        command(self, lambda: self._step(process, done))
+
+    def run(self, until):
+        while self.events and self.events[0][0] <= until:
+            self.now, _, callback = heapq.heappop(self.events)
+            callback()
+        self.now = until
+
+
+def delay(ms):
+    def command(simulation, resume):
+        simulation.at(simulation.now + max(ms, 0), resume)
+    return command
+
+
+def all_of(processes):
+    """Run processes side by side and resume when all of them have ended."""
+    def command(simulation, resume):
+        remaining = [len(processes)]
+        if not processes:
+            resume()
+            return
+
+        def finished(_):
+            remaining[0] -= 1
+            if not remaining[0]:
+                resume()
+        for process in processes:
+            simulation.start(process, finished)
+    return command
+
+
+class InvokeTimeout(Exception):
+    pass
+
+
+class Pipeline:
+    """
+    One simulated run of a scenario.
+
+    Args:
+        settings: the limits, rate (documents per hour), review_share (None
+            keeps the mix's own) and the stage time distributions
+        documents: the document mix, sampled with replacement
+        arrivals: arrival times in ms, shared by the scenarios of a comparison
+    """
+
+    def __init__(self, settings, documents, arrivals, seed):
+        self.settings = settings
+        self.documents = documents
+        self.arrivals = arrivals
+        self.rng = random.Random(seed)
+        self.simulation = Simulation()
+        self.lambdas = Resource(self.simulation, "lambda", settings["lambda_concurrency"])
+        self.bda = Resource(self.simulation, "bda", settings["bda_concurrency"])
+        self.bda_calls = TokenBucket(settings["bda_tps"])
+        self.reviewers = Resource(self.simulation, "reviewers", settings["reviewers"])
+        self.latencies = []
+        self.finished = 0
+        self.failed = 0
+        self.in_system = 0
+        self.cost = {"bda": 0, "a2i": 0, "reviewers": 0, "lambda": 0, "stepfunctions": 0}
+        self.samples = []
+
+    def time(self, name):
+        return self.settings[name].sample(self.rng)
+
+    def invoke(self, function, duration):
+        """A Lambda invocation that holds one unit of the account concurrency."""
+        yield self.lambdas.acquire()
+        yield delay(duration)
+        self.lambdas.release()
+        self.charge_lambda(function, duration)
+
+    def charge_lambda(self, function, duration):
+        memory_gb = FUNCTION_MEMORY_MB.get(function, DEFAULT_MEMORY_MB) / 1024
+        self.cost["lambda"] += duration / 1000 * memory_gb * PRICES["lambda_gb_second"] + PRICES["lambda_request"]
+        self.cost["stepfunctions"] += PRICES["state_transition"]
+
+    def invoke_bda(self, pages):
+        """invoke_bda holds its Lambda while it waits for the quota and for the job."""
+        yield self.lambdas.acquire()
+        started = self.simulation.now
+        yield self.bda_calls.take()
+        yield self.bda.acquire()
+        job = self.time("bda_base") + self.time("bda_page_time") * pages
+        elapsed = self.simulation.now - started + job
+        self.cost["bda"] += pages * PRICES["bda_page"]
+        if elapsed > INVOKE_BDA_TIMEOUT_MS:
+            # The job still runs to its end; the Lambda times out before it
+            yield delay(INVOKE_BDA_TIMEOUT_MS - (self.simulation.now - started))
+            self.simulation.at(started + elapsed, self.bda.release)
+            self.lambdas.release()
+            self.charge_lambda("invoke_bda", INVOKE_BDA_TIMEOUT_MS)
+            raise InvokeTimeout()
+        yield delay(job)
+        self.bda.release()
+        self.lambdas.release()
+        self.charge_lambda("invoke_bda", elapsed)
+
+    def review_page(self):
+        # A2I charges for the object when the loop starts
+        self.cost["a2i"] += PRICES["a2i_object"]
+        yield self.reviewers.acquire()
+        yield delay(self.time("review_time"))
+        self.reviewers.release()
+        yield from self.invoke("humancomplete", self.time("humancomplete"))
+
+    def segment(self, document, segment, map_slots):
+        yield map_slots.acquire()
+        yield from self.invoke("check_confidence", self.time("check_confidence"))
+        review = segment["review"]
+        if self.settings["review_share"] is not None:
+            review = self.rng.random() < self.settings["review_share"]
+        if review:
+            if document["pdf"]:
+                yield from self.invoke("pngextract", self.time("render_page") * segment["pages"])
+            yield delay(self.time("review_queue"))
+            yield from self.invoke("analyzepdf", self.time("analyzepdf"))
+            yield all_of([self.review_page() for _ in range(segment["pages"])])
+            self.cost["stepfunctions"] += 2 * PRICES["state_transition"]
+        yield from self.invoke("wrapup", self.time("wrapup"))
+        map_slots.release()
+
+    def document(self, document):
+        arrived = self.simulation.now
+        self.in_system += 1
+        try:
+            yield delay(self.time("upload_queue"))
+            yield from self.invoke("kickoff", self.time("kickoff"))
+            try:
+                yield from self.invoke_bda(document["pages"])
+            except InvokeTimeout:
+                self.failed += 1
+                return
+            yield from self.invoke("extractmetadata", self.time("extractmetadata"))
+            map_slots = Resource(self.simulation, "map", self.settings["map_concurrency"])
+            yield all_of([self.segment(document, segment, map_slots) for segment in document["segments"]])
+            # Choice, Map and the cleanup message
+            self.cost["stepfunctions"] += 4 * PRICES["state_transition"]
+            self.finished += 1
+            self.latencies.append((arrived, self.simulation.now - arrived))
+        finally:
+            self.in_system -= 1
+
+    def sample(self):
+        self.samples.append({
+            "time": self.simulation.now,
+            "in_system": self.in_system,
+            "lambda": len(self.lambdas.waiting),
+            "bda": len(self.bda.waiting),
+            "reviewers": len(self.reviewers.waiting),
+        })
+
+    def run(self, duration, sample_every, warmup):
+        for arrival in self.arrivals:
+            document = self.rng.choice(self.documents)
+            self.simulation.at(arrival, lambda document=document: self.simulation.start(self.document(document)))
+        for time in range(0, int(duration) + 1, int(sample_every)):
+            self.simulation.at(time, self.sample)
+        self.simulation.run(duration)
+        self.cost["reviewers"] = self.settings["reviewer_hourly"] * self.settings["reviewers"] * duration / HOUR_MS
+        latencies = [latency for arrived, latency in self.latencies if arrived >= warmup]
+        return {
+            "arrived": len(self.arrivals),
+            "finished": self.finished,
+            "failed": self.failed,
+            "in_system": self.in_system,
+            "latency_ms": {f"p{q}": percentile(latencies, q) for q in PERCENTILES},
+            # Calls the pipeline would see throttled and retry
+            "throttled": {
+                "lambda": self.lambdas.waited,
+                "bda_jobs": self.bda.waited,
+                "bda_calls": self.bda_calls.waited,
+            },
+            "utilization": {
+                resource.name: resource.utilization(duration) for resource in (self.lambdas, self.bda, self.reviewers)
+            },
+            "queue_depth": {
+                name: {
+                    "mean": sum(sample[name] for sample in self.samples) / len(self.samples),
+                    "p95": percentile([sample[name] for sample in self.samples], 95),
+                    "max": max(sample[name] for sample in self.samples),
+                    "end": self.samples[-1][name],
+                }
+                for name in ("in_system", "lambda", "bda", "reviewers")
+            },
+            "cost": dict(self.cost),
+            "cost_per_document": sum(self.cost.values()) / max(self.finished + self.failed, 1),
+            "samples": self.samples,
+        }
+
+
+def offered_load(settings, documents):
+    """
+    Mean busy units each resource needs at the arrival rate, by Little's law.
+    Above the capacity the queue grows without bound.
+    """
+    per_hour = settings["rate"]
+    pages = sum(document["pages"] for document in documents) / len(documents)
+    review_share = settings["review_share"]
+    if review_share is None:
+        reviewed_pages = sum(
+            segment["pages"] for document in documents for segment in document["segments"] if segment["review"]
+        ) / len(documents)
+    else:
+        reviewed_pages = pages * review_share
+    bda_job = settings["bda_base"].mean + settings["bda_page_time"].mean * pages
+    return {
+        "bda": per_hour * bda_job / HOUR_MS,
+        "reviewers": per_hour * reviewed_pages * settings["review_time"].mean / HOUR_MS,
+        "bda_tps": per_hour / 3600,
+    }
+
+
+def poisson_arrivals(rate_per_hour, duration, rng):
+    arrivals, time = [], 0
+    if rate_per_hour <= 0:
+        return arrivals
+    while True:
+        time += rng.expovariate(rate_per_hour / HOUR_MS)
+        if time >= duration:
+            return arrivals
+        arrivals.append(time)
+
+
+def apply_what_if(settings, change):
+    """Settings changed by "name=value" or "name=x2" (scale); times take a duration or distribution."""
+    name, _, value = change.partition("=")
+    name = name.strip().replace("-", "_")
+    if name not in SCENARIO_SETTINGS:
+        raise ValueError(f"Cannot change {name}; one of {', '.join(SCENARIO_SETTINGS)}")
+    changed = dict(settings)
+    current = settings[name]
+    if value.startswith("x"):
+        factor = float(value[1:])
+        if hasattr(current, "scaled"):
+            changed[name] = current.scaled(factor)
+        else:
+            changed[name] = type(current)(current * factor) if current is not None else None
+    elif hasattr(current, "sample"):
+        changed[name] = parse_distribution(value)
+    elif name == "review_share":
+        changed[name] = float(value)
+    else:
+        changed[name] = type(current)(float(value))
+    if isinstance(LIMITS.get(name), int):
+        changed[name] = max(int(changed[name]), 1)
+    return changed
+
+
+def build_settings(args, times, bda_points, metrics):
+    """Limits, rates and stage time distributions: options first, then the data, then the defaults."""
+    settings = {name: getattr(args, name) for name in LIMITS}
+    settings.update(rate=args.rate, review_share=args.review_share, reviewer_hourly=args.reviewer_hourly)
+    sources = {}
+    for name, default in DEFAULT_TIMES.items():
+        option = getattr(args, name, None)
+        observed = times.get(name) or metrics.get(name)
+        if option:
+            settings[name], sources[name] = parse_distribution(option), "option"
+        elif observed:
+            settings[name], sources[name] = Empirical(observed), "timelines" if name in times else "metrics"
+        else:
+            settings[name], sources[name] = parse_distribution(default), "default"
+    if bda_points and not (args.bda_base or args.bda_page_time):
+        base, per_page = fit_linear(bda_points)
+        settings["bda_base"], settings["bda_page_time"] = Constant(base), Constant(per_page)
+        sources["bda_base"] = sources["bda_page_time"] = f"fit of {len(bda_points)} jobs"
+    return settings, sources
+
+
+def synthetic_mix(args):
+    """Documents of --pages, split into segments of --segment-pages, reviewed at --review-share."""
+    documents = []
+    share = args.review_share if args.review_share is not None else 0.3
+    for pages, weight in parse_mix(args.pages):
+        size = args.segment_pages or pages
+        segments = [{"pages": min(size, pages - start), "review": False} for start in range(0, pages, size)]
+        # Enough copies to keep the weights; review is drawn per segment in the run
+        documents.extend({"pages": pages, "pdf": True, "segments": segments} for _ in range(max(int(weight * 100), 1)))
+    return documents, share
+
+
+def print_scenario(name, settings, result, load):
+    print(f"\n== {name}: {settings['rate']:g} documents/h, {settings['reviewers']} reviewers, "
+          f"BDA {settings['bda_concurrency']} jobs / {settings['bda_tps']:g} TPS, "
+          f"Lambda {settings['lambda_concurrency']}, Map {settings['map_concurrency']}")
+    print(f"documents: {result['arrived']} arrived, {result['finished']} finished, "
+          f"{result['failed']} failed (invoke_bda timed out), {result['in_system']} still in the pipeline")
+    print("end-to-end of the finished documents: " + ", ".join(f"{key} {format_ms(value)}" for key, value in result["latency_ms"].items()))
+    print(f"\n{'':>10} {'offered':>8} {'capacity':>9} {'busy':>6}")
+    for resource, capacity in (("bda", settings["bda_concurrency"]), ("reviewers", settings["reviewers"])):
+        flag = "  over capacity, the queue keeps growing" if load[resource] > capacity else ""
+        print(f"{resource:>10} {load[resource]:>8.1f} {capacity:>9} {result['utilization'][resource]:>6.0%}{flag}")
+    print(f"{'bda_tps':>10} {load['bda_tps']:>8.2f} {settings['bda_tps']:>9g}")
+    print(f"{'lambda':>10} {'':>8} {settings['lambda_concurrency']:>9} {result['utilization']['lambda']:>6.0%}")
+    throttled = result["throttled"]
+    print(f"throttled: {throttled['lambda']} Lambda invocations, {throttled['bda_jobs']} BDA jobs over the "
+          f"concurrency quota, {throttled['bda_calls']} over the TPS quota")
+    print(f"\nqueue depth {'mean':>7} {'p95':>6} {'max':>6} {'end':>6}")
+    for name, depth in result["queue_depth"].items():
+        print(f"{name:>11} {depth['mean']:>7.1f} {depth['p95']:>6.0f} {depth['max']:>6} {depth['end']:>6}")
+    cost = result["cost"]
+    print(f"\ncost: ${sum(cost.values()):.2f}, ${result['cost_per_document']:.4f} per document ("
+          + ", ".join(f"{key} ${value:.2f}" for key, value in cost.items() if value) + ")")
+
+
+def print_comparison(rows):
+    width = max(len(name) for name, _ in rows)
+    print(f"\n{'scenario':<{width}} {'finished':>8} {'failed':>7} {'p50':>8} {'p95':>8} {'review q':>9} {'in flight':>10} {'$/doc':>8}")
+    for name, result in rows:
+        latency = result["latency_ms"]
+        print(f"{name:<{width}} {result['finished']:>8} {result['failed']:>7} {format_ms(latency['p50']):>8} "
+              f"{format_ms(latency['p95']):>8} {result['queue_depth']['reviewers']['max']:>9} "
+              f"{result['in_system']:>10} {result['cost_per_document']:>8.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="timelines exported by timeline_report.py --export")
+    parser.add_argument("--table", default=os.environ.get("timeline_table"), help="timeline table to read instead")
+    parser.add_argument("--since", default="7d", help="upload window of the timelines read from --table")
+    parser.add_argument("--metrics", help="EMF records of the functions, one per line, for their StageDuration")
+    parser.add_argument("--rate", type=float, default=60, help="documents arriving per hour, Poisson")
+    parser.add_argument("--hours", type=float, default=8, help="simulated hours of arrivals")
+    parser.add_argument("--warmup", type=float, default=0.1, help="share of the run left out of the latency percentiles")
+    parser.add_argument("--sample-every", default="1m", help="interval of the queue depth samples")
+    parser.add_argument("--pages", default="5:1", help="document mix without timelines, pages:weight,...")
+    parser.add_argument("--segment-pages", type=int, help="pages per segment of the --pages mix; default one segment")
+    parser.add_argument("--review-share", type=float, help="share of segments sent to review; default from the timelines")
+    for name, default in LIMITS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(default), default=default)
+    for name in DEFAULT_TIMES:
+        parser.add_argument("--" + name.replace("_", "-"), help=f"time of {name}, e.g. {DEFAULT_TIMES[name]}")
+    parser.add_argument("--reviewer-hourly", type=float, default=0, help="cost of a reviewer per hour, for the workforce cost")
+    parser.add_argument("--what-if", action="append", default=[], help="setting change to compare, e.g. reviewers=x2; "
+                        "several changes of one scenario are separated by commas")
+    parser.add_argument("--series", action="store_true", help="also print the queue depth samples of the base scenario")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    items = []
+    if args.input:
+        with open(args.input) as f:
+            items = [json.loads(line) for line in f if line.strip()]
+    elif args.table:
+        import boto3
+        until = datetime.datetime.now(datetime.timezone.utc)
+        items = query_window(boto3.resource("dynamodb").Table(args.table), parse_time(args.since), until)
+    times, bda_points, documents = fit_timelines([plain(item) for item in items])
+    metrics = read_metrics(args.metrics) if args.metrics else {}
+    settings, sources = build_settings(args, times, bda_points, metrics)
+    if not documents:
+        documents, settings["review_share"] = synthetic_mix(args)
+
+    print(f"{len(documents)} documents in the mix, {sum(d['pages'] for d in documents) / len(documents):.1f} pages on average"
+          + (f", from {len(items)} timelines" if items else ""))
+    for name in DEFAULT_TIMES:
+        print(f"  {name:<17} {str(settings[name]):<32} {sources[name]}")
+
+    duration = args.hours * HOUR_MS
+    sample_every = parse_duration(args.sample_every)
+    scenarios = [("baseline", settings)]
+    for what_if in args.what_if:
+        changed = settings
+        for change in what_if.split(","):
+            try:
+                changed = apply_what_if(changed, change)
+            except ValueError as e:
+                parser.error(str(e))
+        scenarios.append((what_if, changed))
+
+    results = []
+    for name, scenario in scenarios:
+        # Same arrivals and seed for every scenario, so they differ only by the change
+        arrivals = poisson_arrivals(scenario["rate"], duration, random.Random(args.seed))
+        result = Pipeline(scenario, documents, arrivals, args.seed).run(duration, sample_every, duration * args.warmup)
+        load = offered_load(scenario, documents)
+        print_scenario(name, scenario, result, load)
+        results.append((name, result))
+
+    if args.series:
+        print(f"\n{'time':>8} {'in flight':>10} {'lambda':>7} {'bda':>5} {'reviewers':>10}")
+        for sample in results[0][1]["samples"]:
+            print(f"{format_ms(sample['time']):>8} {sample['in_system']:>10} {sample['lambda']:>7} {sample['bda']:>5} {sample['reviewers']:>10}")
+    if len(results) > 1:
+        print_comparison(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({name: result for name, result in results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
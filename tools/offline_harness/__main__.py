@@ -0,0 +1,184 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+Run documents through the pipeline offline and report throughput, latency,
+invocations and AWS API calls.
+
+No request leaves the machine. BDA answers with synthetic outputs, or with
+recorded ones given with --fixture, after --bda-ms plus --bda-page-ms per
+page. Human reviews are answered after --review-ms. Requires boto3, pandas
+and pyarrow, as the handlers do.
+
+Exits with 1 if an execution failed or the run timed out.
+
+Usage, from the repository root:
+    python -m tools.offline_harness --documents 50 --pages 4 --rate 10 --bda-ms 500 --review-ms 200
+    python -m tools.offline_harness --fixture recorded/claim_form --documents 10 --json report.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+from .fixtures import load_fixture, synthetic_document
+from .harness import Harness
+
+# Every client is a stand-in; these keep boto3 from looking for real credentials
+HARNESS_ENV = {
+    "AWS_ACCESS_KEY_ID": "offline",
+    "AWS_SECRET_ACCESS_KEY": "offline",
+    "AWS_EC2_METADATA_DISABLED": "true",
+}
+
+
+def build_documents(args):
+    """[(upload name, fixture)] of the run."""
+    rng = random.Random(args.seed)
+    recorded = [load_fixture(directory) for directory in args.fixture]
+    documents = []
+    for index in range(args.documents):
+        if recorded:
+            fixture = recorded[index % len(recorded)]
+        else:
+            fixture = synthetic_document(
+                pages=args.pages,
+                segments=args.segments,
+                fields_per_page=args.fields_per_page,
+                low_confidence_rate=args.low_confidence,
+                seed=args.seed + index,
+            )
+        # An image is a single page document
+        extension = "png" if fixture["pages"] == 1 and rng.random() < args.image_share else "pdf"
+        documents.append((f"offline-{index:05d}.{extension}", fixture))
+    return documents
+
+
+def print_report(report, timeline):
+    from timeline_report import format_ms, percentile, report_window
+
+    print(f"documents: {report['documents']} ({report['pages']} pages), "
+          f"succeeded: {report['succeeded']}, failed: {report['failed']}, resumed: {report['resumed']}"
+          + (", timed out" if report["timed_out"] else ""))
+    for error, count in sorted(report["execution_errors"].items()):
+        print(f"  {error}: {count}")
+    elapsed = report["elapsed_seconds"]
+    print(f"elapsed: {elapsed:.2f} s, {report['documents_per_second'] or 0:.2f} documents/s, "
+          f"{report['pages_per_second'] or 0:.2f} pages/s, {report['human_loops']} human loops")
+
+    latencies = report["latency_ms"]
+    if latencies:
+        print("upload to end of execution: " + ", ".join(
+            f"p{q} {format_ms(percentile(latencies, q))}" for q in (50, 90, 95, 99)
+        ) + f", max {format_ms(latencies[-1])}")
+
+    print(f"\n{'function':<18} {'invocations':>11} {'errors':>7} {'p50':>9} {'p95':>9} {'max':>9}")
+    for function, entry in report["invocations"].items():
+        durations = sorted(entry["durations_ms"])
+        print(f"{function:<18} {len(durations):>11} {entry['errors']:>7} "
+              f"{format_ms(percentile(durations, 50)):>9} {format_ms(percentile(durations, 95)):>9} {format_ms(durations[-1]):>9}")
+
+    documents = max(report["started"], 1)
+    print(f"\n{'API call':<60} {'calls':>7} {'per document':>13}")
+    for call, count in sorted(report["calls"].items(), key=lambda entry: -entry[1]):
+        print(f"{call:<60} {count:>7} {count / documents:>13.1f}")
+
+    dead_letters = {name: count for name, count in report["dead_letters"].items() if count}
+    if dead_letters or report["async_failures"]:
+        print(f"\ndead letters: {dead_letters}, failed async events: {report['async_failures']}")
+    if report["leftover_keys"]:
+        print(f"\n{len(report['leftover_keys'])} wip/ and output/ objects were not cleaned up")
+    if timeline:
+        print()
+        report_window(report["timelines"], slowest=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20, help="documents uploaded")
+    parser.add_argument("--pages", type=int, default=2, help="pages per synthetic document")
+    parser.add_argument("--segments", type=int, default=1, help="BDA segments per synthetic document")
+    parser.add_argument("--fields-per-page", type=int, default=8, help="fields per page of a synthetic document")
+    parser.add_argument("--low-confidence", type=float, default=0.05, help="share of synthetic fields below the threshold")
+    parser.add_argument("--image-share", type=float, default=0, help="share of single page documents uploaded as PNG")
+    parser.add_argument("--fixture", action="append", default=[], help="directory of a recorded BDA output, used in turn instead of synthetic ones")
+    parser.add_argument("--rate", type=float, default=0, help="uploads per second; 0 uploads all at once")
+    parser.add_argument("--bda-ms", type=float, default=0, help="BDA job time per document")
+    parser.add_argument("--bda-page-ms", type=float, default=0, help="BDA job time per page")
+    parser.add_argument("--review-ms", type=float, default=0, help="time from a human loop's start to its answer")
+    parser.add_argument("--render-page-ms", type=float, default=0, help="pngextract time per page")
+    parser.add_argument("--api-ms", type=float, default=0, help="latency added to every AWS API call")
+    parser.add_argument("--change-rate", type=float, default=0.1, help="share of reviewed values the reviewer changes")
+    parser.add_argument("--fail-rate", type=float, default=0, help="share of human loops that fail")
+    parser.add_argument("--confidence-threshold", type=float, default=0.95, help="CONFIDENCE_THRESHOLD of check_confidence")
+    parser.add_argument("--speculative-rendering", action="store_true", help="render pages while BDA runs")
+    parser.add_argument("--task-timeout", type=float, default=300, help="seconds an execution waits for a review")
+    parser.add_argument("--max-executions", type=int, default=256, help="executions run at once")
+    parser.add_argument("--max-inflight-bda", type=int, default=0, help="kickoff's backpressure limit on BDA jobs; 0 is none")
+    parser.add_argument("--max-inflight-reviews", type=int, default=0, help="kickoff's backpressure limit on human loops; 0 is none")
+    parser.add_argument("--backpressure-delay", type=int, default=1, help="seconds a deferred upload waits at first")
+    parser.add_argument("--resume-rounds", type=int, default=0, help="times the failed documents are resumed from their checkpoints")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the run to finish")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the fixtures and the reviewer")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--timeline", action="store_true", help="also print the timeline report of the run")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL of the handlers")
+    args = parser.parse_args()
+
+    for name, value in HARNESS_ENV.items():
+        os.environ.setdefault(name, value)
+    os.environ.setdefault("LOG_LEVEL", args.log_level)
+
+    harness = Harness(
+        build_documents(args),
+        bda_seconds=args.bda_ms / 1000,
+        bda_page_seconds=args.bda_page_ms / 1000,
+        review_seconds=args.review_ms / 1000,
+        render_page_seconds=args.render_page_ms / 1000,
+        api_latency=args.api_ms / 1000,
+        change_rate=args.change_rate,
+        fail_rate=args.fail_rate,
+        confidence_threshold=args.confidence_threshold,
+        speculative_rendering=args.speculative_rendering,
+        task_timeout=args.task_timeout,
+        max_executions=args.max_executions,
+        max_inflight_bda=args.max_inflight_bda,
+        max_inflight_reviews=args.max_inflight_reviews,
+        backpressure_delay=args.backpressure_delay,
+        resume_rounds=args.resume_rounds,
+        seed=args.seed,
+    )
+    report = harness.run(rate=args.rate, timeout=args.timeout)
+
+    # Imported after the run: timeline_report reads the environment set up by the harness
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from timeline_report import plain
+
+    report["timelines"] = [plain(item) for item in report["timelines"]]
+    print_report(report, args.timeline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    sys.exit(1 if report["failed"] or report["timed_out"] else 0)
+
+
+if __name__ == "__main__":
+    main()
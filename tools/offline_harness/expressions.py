@@ -0,0 +1,260 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+The subset of DynamoDB update and condition expressions the pipeline uses.
+
+Update expressions support SET with if_not_exists, list_append and + / -,
+ADD, REMOVE and DELETE on top-level attributes. Condition expressions
+support AND, OR, NOT, parentheses, the comparison operators and the
+functions attribute_exists, attribute_not_exists, contains and
+begins_with. Anything else raises ExpressionError, so a handler that starts
+using more of the language fails loudly instead of being misread.
+
+Items and values are plain Python: str, Decimal, bool, None, bytes, list,
+dict and set.
+"""
+
+import re
+from decimal import Decimal
+
+_TOKEN = re.compile(r"\s*(<>|<=|>=|[=<>(),+\-\[\].]|[#:]?[A-Za-z0-9_]+)")
+_ACTIONS = ("SET", "ADD", "REMOVE", "DELETE")
+_COMPARISONS = {
+    "=": lambda a, b: a == b,
+    "<>": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+_MISSING = object()
+
+
+class ExpressionError(ValueError):
+    """An expression that is invalid, or uses syntax this module does not support."""
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match:
+            raise ExpressionError(f"Cannot parse expression at: {expression[position:]!r}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ExpressionError("Unexpected end of expression")
+        self.position += 1
+        return token
+
+    def accept(self, token):
+        if self.peek() is not None and self.peek().upper() == token:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, token):
+        if not self.accept(token):
+            raise ExpressionError(f"Expected {token!r}, found {self.peek()!r}")
+
+    def name(self):
+        token = self.take()
+        if self.peek() in (".", "["):
+            raise ExpressionError("Nested attribute paths are not supported")
+        if token.startswith("#"):
+            if token not in self.names:
+                raise ExpressionError(f"Unknown attribute name placeholder {token}")
+            return self.names[token]
+        if token.startswith(":") or not re.match(r"[A-Za-z_]", token):
+            raise ExpressionError(f"Expected an attribute name, found {token!r}")
+        return token
+
+    def operand(self, item):
+        token = self.peek()
+        if token is None:
+            raise ExpressionError("Unexpected end of expression")
+        if token.startswith(":"):
+            self.position += 1
+            if token not in self.values:
+                raise ExpressionError(f"Unknown attribute value placeholder {token}")
+            return self.values[token]
+        lowered = token.lower()
+        if lowered == "if_not_exists":
+            self.position += 1
+            self.expect("(")
+            current = item.get(self.name(), _MISSING)
+            self.expect(",")
+            fallback = self.operand(item)
+            self.expect(")")
+            return fallback if current is _MISSING else current
+        if lowered == "list_append":
+            self.position += 1
+            self.expect("(")
+            first = self.operand(item)
+            self.expect(",")
+            second = self.operand(item)
+            self.expect(")")
+            if not isinstance(first, list) or not isinstance(second, list):
+                raise ExpressionError("list_append takes two lists")
+            return first + second
+        return item.get(self.name(), _MISSING)
+
+    def done(self):
+        return self.position == len(self.tokens)
+
+
+def _present(value, what):
+    if value is _MISSING:
+        raise ExpressionError(f"The provided expression refers to an attribute that does not exist in the item: {what}")
+    return value
+
+
+def apply_update(item, expression, names=None, values=None):
+    """
+    The item after an update expression; item itself is left unchanged.
+
+    Every operand refers to the item as it was before the update, as in DynamoDB.
+    """
+    parser = _Parser(expression, names, values)
+    updated = dict(item)
+    while not parser.done():
+        action = parser.take().upper()
+        if action not in _ACTIONS:
+            raise ExpressionError(f"Expected one of {', '.join(_ACTIONS)}, found {action!r}")
+        while True:
+            name = parser.name()
+            if action == "SET":
+                parser.expect("=")
+                value = _present(parser.operand(item), name)
+                if parser.peek() in ("+", "-"):
+                    sign = 1 if parser.take() == "+" else -1
+                    other = _present(parser.operand(item), name)
+                    if not isinstance(value, Decimal) or not isinstance(other, Decimal):
+                        raise ExpressionError("+ and - take numbers")
+                    value = value + sign * other
+                updated[name] = value
+            elif action == "REMOVE":
+                updated.pop(name, None)
+            else:
+                value = _present(parser.operand(item), name)
+                current = item.get(name)
+                if action == "ADD":
+                    if isinstance(value, set):
+                        updated[name] = set(current or ()) | value
+                    elif isinstance(value, Decimal):
+                        updated[name] = (current or Decimal(0)) + value
+                    else:
+                        raise ExpressionError("ADD takes a number or a set")
+                else:
+                    if not isinstance(value, set):
+                        raise ExpressionError("DELETE takes a set")
+                    remaining = set(current or ()) - value
+                    if remaining:
+                        updated[name] = remaining
+                    else:
+                        updated.pop(name, None)
+            if not parser.accept(","):
+                break
+    return updated
+
+
+def evaluate_condition(item, expression, names=None, values=None):
+    """Whether item, an empty dict if there is none, satisfies a condition expression."""
+    parser = _Parser(expression, names, values)
+    result = _or(parser, item)
+    if not parser.done():
+        raise ExpressionError(f"Unexpected {parser.peek()!r} in condition")
+    return result
+
+
+def _or(parser, item):
+    result = _and(parser, item)
+    while parser.accept("OR"):
+        result = _and(parser, item) or result
+    return result
+
+
+def _and(parser, item):
+    result = _not(parser, item)
+    while parser.accept("AND"):
+        result = _not(parser, item) and result
+    return result
+
+
+def _not(parser, item):
+    if parser.accept("NOT"):
+        return not _not(parser, item)
+    return _primary(parser, item)
+
+
+def _primary(parser, item):
+    if parser.accept("("):
+        result = _or(parser, item)
+        parser.expect(")")
+        return result
+    function = (parser.peek() or "").lower()
+    if function in ("attribute_exists", "attribute_not_exists"):
+        parser.take()
+        parser.expect("(")
+        exists = parser.name() in item
+        parser.expect(")")
+        return exists if function == "attribute_exists" else not exists
+    if function in ("contains", "begins_with"):
+        parser.take()
+        parser.expect("(")
+        container = item.get(parser.name(), _MISSING)
+        parser.expect(",")
+        operand = parser.operand(item)
+        parser.expect(")")
+        if container is _MISSING or operand is _MISSING:
+            return False
+        if function == "begins_with":
+            return isinstance(container, str) and isinstance(operand, str) and container.startswith(operand)
+        if isinstance(container, str):
+            return isinstance(operand, str) and operand in container
+        return isinstance(container, (set, list)) and operand in container
+    left = parser.operand(item)
+    comparison = parser.take()
+    if comparison not in _COMPARISONS:
+        raise ExpressionError(f"Unsupported comparison {comparison!r}")
+    right = parser.operand(item)
+    if left is _MISSING or right is _MISSING:
+        return False
+    try:
+        return _COMPARISONS[comparison](left, right)
+    except TypeError:
+        return False
@@ -0,0 +1,891 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+In-process stand-ins for the AWS services the pipeline calls.
+
+Each fake implements the operations the handlers use, with the request and
+response shapes of the real API, and raises botocore ClientErrors with the
+real error codes. State lives in memory and every operation is thread-safe.
+FakeAws bundles one set of fakes and is the factory passed to
+multipagepdfbda_common.aws_clients.set_factory.
+
+Every API call is counted per service and operation and can be delayed by
+a fixed latency, which stands in for the network round trip.
+"""
+
+import datetime
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import Future
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from .expressions import ExpressionError, apply_update, evaluate_condition
+from .fixtures import job_outputs
+from .state_machine import ExecutionFailed
+
+REGION = "us-east-1"
+ACCOUNT = "123456789012"
+
+# DynamoDB rejects items above 400 KB, SQS messages above 256 KiB
+MAX_ITEM_BYTES = 400 * 1024
+MAX_MESSAGE_BYTES = 256 * 1024
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class CallCounter:
+    """Number of API calls per (service, operation)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def count(self, service, operation):
+        with self.lock:
+            self.counts[service, operation] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class Exceptions:
+    """The client.exceptions of a fake: a ClientError subclass per error code."""
+
+    def __init__(self, codes):
+        self.ClientError = ClientError
+        for code in codes:
+            setattr(self, code, type(code, (ClientError,), {}))
+
+    def error(self, code, message, operation, status=400):
+        error_class = getattr(self, code, ClientError)
+        return error_class({
+            "Error": {"Code": code, "Message": message},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        }, operation)
+
+
+class FakeService:
+    service = None
+    errors = ()
+
+    def __init__(self, calls, latency=0):
+        self.calls = calls
+        self.latency = latency
+        self.exceptions = Exceptions(self.errors)
+        self.lock = threading.RLock()
+
+    def _call(self, operation):
+        self.calls.count(self.service, operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def _as_bytes(body):
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    if isinstance(body, (bytes, bytearray)):
+        return bytes(body)
+    return _as_bytes(body.read())
+
+
+class FakeS3(FakeService):
+    """
+    Objects, listings, batch deletes and multipart uploads.
+
+    Listeners added with on_object_created are called for every object
+    written, like an S3 event notification.
+    """
+
+    service = "s3"
+    errors = ("NoSuchKey", "NoSuchUpload")
+
+    def __init__(self, calls, latency=0):
+        super().__init__(calls, latency)
+        self.objects = {}
+        self.uploads = {}
+        self.listeners = []
+
+    def on_object_created(self, listener):
+        """Call listener(bucket, key, size, etag) after every object is written."""
+        self.listeners.append(listener)
+
+    def _store(self, bucket, key, data, content_type=None):
+        etag = hashlib.md5(data).hexdigest()
+        with self.lock:
+            self.objects[bucket, key] = {
+                "data": data,
+                "etag": etag,
+                "last_modified": utc_now(),
+                "content_type": content_type or "binary/octet-stream",
+            }
+        for listener in self.listeners:
+            listener(bucket, key, len(data), etag)
+        return etag
+
+    def _get(self, bucket, key, operation):
+        with self.lock:
+            stored = self.objects.get((bucket, key))
+        if stored is None:
+            raise self.exceptions.error("NoSuchKey", "The specified key does not exist.", operation, 404)
+        return stored
+
+    def put_object(self, Bucket, Key, Body=None, ContentType=None, **kwargs):
+        self._call("PutObject")
+        etag = self._store(Bucket, Key, _as_bytes(Body), ContentType)
+        return {"ETag": f'"{etag}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("GetObject")
+        stored = self._get(Bucket, Key, "GetObject")
+        return {
+            "Body": io.BytesIO(stored["data"]),
+            "ContentLength": len(stored["data"]),
+            "ContentType": stored["content_type"],
+            "ETag": f'"{stored["etag"]}"',
+            "LastModified": stored["last_modified"],
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("HeadObject")
+        stored = self._get(Bucket, Key, "HeadObject")
+        return {
+            "ContentLength": len(stored["data"]),
+            "ContentType": stored["content_type"],
+            "ETag": f'"{stored["etag"]}"',
+            "LastModified": stored["last_modified"],
+        }
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, MaxKeys=1000, ContinuationToken=None, StartAfter=None, **kwargs):
+        self._call("ListObjectsV2")
+        after = ContinuationToken or StartAfter or ""
+        with self.lock:
+            entries = sorted(
+                (key, stored) for (bucket, key), stored in self.objects.items()
+                if bucket == Bucket and key.startswith(Prefix) and key > after
+            )
+        contents, prefixes = [], []
+        next_token = None
+        for key, stored in entries:
+            if len(contents) + len(prefixes) == MaxKeys:
+                break
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common_prefix = Prefix + rest[:rest.index(Delimiter) + len(Delimiter)]
+                if prefixes and prefixes[-1] == common_prefix:
+                    continue
+                prefixes.append(common_prefix)
+                # Resume after every key of the common prefix
+                next_token = common_prefix + "\U0010ffff"
+            else:
+                contents.append({
+                    "Key": key,
+                    "LastModified": stored["last_modified"],
+                    "ETag": f'"{stored["etag"]}"',
+                    "Size": len(stored["data"]),
+                    "StorageClass": "STANDARD",
+                })
+                next_token = key
+        truncated = bool(entries) and next_token is not None and any(key > next_token for key, _ in entries)
+        response = {
+            "Name": Bucket,
+            "Prefix": Prefix,
+            "MaxKeys": MaxKeys,
+            "KeyCount": len(contents) + len(prefixes),
+            "IsTruncated": truncated,
+        }
+        if contents:
+            response["Contents"] = contents
+        if prefixes:
+            response["CommonPrefixes"] = [{"Prefix": prefix} for prefix in prefixes]
+        if truncated:
+            response["NextContinuationToken"] = next_token
+        return response
+
+    def get_paginator(self, operation_name):
+        if operation_name != "list_objects_v2":
+            raise NotImplementedError(f"No offline paginator for {operation_name}")
+        return _ListObjectsPaginator(self)
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._call("DeleteObjects")
+        deleted = []
+        with self.lock:
+            for entry in Delete["Objects"]:
+                self.objects.pop((Bucket, entry["Key"]), None)
+                deleted.append({"Key": entry["Key"]})
+        return {"Deleted": [] if Delete.get("Quiet") else deleted}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call("DeleteObject")
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None, **kwargs):
+        self._call("CreateMultipartUpload")
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {"bucket": Bucket, "key": Key, "content_type": ContentType, "parts": {}}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def _upload(self, upload_id, operation):
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise self.exceptions.error("NoSuchUpload", "The specified upload does not exist.", operation, 404)
+        return upload
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._call("UploadPart")
+        data = _as_bytes(Body)
+        upload = self._upload(UploadId, "UploadPart")
+        etag = hashlib.md5(data).hexdigest()
+        with self.lock:
+            upload["parts"][PartNumber] = (f'"{etag}"', data)
+        return {"ETag": f'"{etag}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._call("CompleteMultipartUpload")
+        upload = self._upload(UploadId, "CompleteMultipartUpload")
+        with self.lock:
+            parts = [upload["parts"][part["PartNumber"]] for part in MultipartUpload["Parts"]]
+            del self.uploads[UploadId]
+        etag = self._store(Bucket, Key, b"".join(data for _, data in parts), upload["content_type"])
+        return {"Bucket": Bucket, "Key": Key, "ETag": f'"{etag}-{len(parts)}"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._call("AbortMultipartUpload")
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def keys(self, bucket, prefix=""):
+        """Keys under prefix, for the harness; not counted as a call."""
+        with self.lock:
+            return sorted(key for (name, key) in self.objects if name == bucket and key.startswith(prefix))
+
+
+class _ListObjectsPaginator:
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.s3.list_objects_v2(**kwargs)
+            yield page
+            if not page["IsTruncated"]:
+                return
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+
+class FakeQueue:
+    """
+    One SQS queue.
+
+    A received message is in flight until it is deleted or released. A
+    released message is delivered again, or moved to dead_letters once it
+    was received max_receives times; with max_receives None it never is, as
+    without a redrive policy. A message whose visibility was changed is not
+    delivered again before the new timeout ends.
+    """
+
+    def __init__(self, name, max_receives=3):
+        self.name = name
+        self.url = f"https://sqs.{REGION}.amazonaws.com/{ACCOUNT}/{name}"
+        self.arn = f"arn:aws:sqs:{REGION}:{ACCOUNT}:{name}"
+        self.max_receives = max_receives
+        self.pending = deque()
+        self.in_flight = {}
+        self.dead_letters = []
+        self.condition = threading.Condition()
+
+    def put(self, body):
+        message = {
+            "messageId": str(uuid.uuid4()),
+            "body": body,
+            "md5OfBody": hashlib.md5(body.encode("utf-8")).hexdigest(),
+            "sent": int(time.time() * 1000),
+            "receives": 0,
+        }
+        with self.condition:
+            self.pending.append(message)
+            self.condition.notify()
+        return message
+
+    def _visible(self):
+        now = time.monotonic()
+        return [message for message in self.pending if message.get("visible_at", 0) <= now]
+
+    def receive(self, max_messages, timeout):
+        """Up to max_messages records in the Lambda event shape; waits up to timeout for the first."""
+        with self.condition:
+            if not self._visible():
+                self.condition.wait(timeout)
+            records = []
+            for message in self._visible()[:max_messages]:
+                self.pending.remove(message)
+                message["receives"] += 1
+                receipt_handle = uuid.uuid4().hex
+                self.in_flight[receipt_handle] = message
+                records.append({
+                    "messageId": message["messageId"],
+                    "receiptHandle": receipt_handle,
+                    "body": message["body"],
+                    "attributes": {
+                        "ApproximateReceiveCount": str(message["receives"]),
+                        "SentTimestamp": str(message["sent"]),
+                        "ApproximateFirstReceiveTimestamp": str(int(time.time() * 1000)),
+                    },
+                    "messageAttributes": {},
+                    "md5OfBody": message["md5OfBody"],
+                    "eventSource": "aws:sqs",
+                    "eventSourceARN": self.arn,
+                    "awsRegion": REGION,
+                })
+            return records
+
+    def delete(self, receipt_handle):
+        with self.condition:
+            return self.in_flight.pop(receipt_handle, None) is not None
+
+    def change_visibility(self, receipt_handle, seconds):
+        with self.condition:
+            message = self.in_flight.get(receipt_handle)
+            if message is not None:
+                message["visible_at"] = time.monotonic() + seconds
+            return message is not None
+
+    def release(self, receipt_handle):
+        with self.condition:
+            message = self.in_flight.pop(receipt_handle, None)
+            if message is None:
+                return
+            if self.max_receives is not None and message["receives"] >= self.max_receives:
+                self.dead_letters.append(message)
+            else:
+                self.pending.append(message)
+                self.condition.notify()
+
+    def idle(self):
+        with self.condition:
+            return not self.pending and not self.in_flight
+
+
+class FakeSqs(FakeService):
+    service = "sqs"
+    errors = ("QueueDoesNotExist", "ReceiptHandleIsInvalid", "InvalidParameterValue")
+
+    def __init__(self, calls, latency=0):
+        super().__init__(calls, latency)
+        self.queues = {}
+
+    def create_queue(self, name, max_receives=3):
+        """Create a queue for the harness; not counted as a call."""
+        queue = self.queues[FakeQueue(name).url] = FakeQueue(name, max_receives)
+        return queue
+
+    def _queue(self, url, operation):
+        queue = self.queues.get(url)
+        if queue is None:
+            raise self.exceptions.error("QueueDoesNotExist", "The specified queue does not exist.", operation)
+        return queue
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self._call("SendMessage")
+        if len(MessageBody.encode("utf-8")) > MAX_MESSAGE_BYTES:
+            raise self.exceptions.error("InvalidParameterValue", f"Message must be shorter than {MAX_MESSAGE_BYTES} bytes.", "SendMessage")
+        message = self._queue(QueueUrl, "SendMessage").put(MessageBody)
+        return {"MessageId": message["messageId"], "MD5OfMessageBody": message["md5OfBody"]}
+
+    def delete_message(self, QueueUrl, ReceiptHandle, **kwargs):
+        self._call("DeleteMessage")
+        # Deleting a message that is already gone succeeds, as in SQS
+        self._queue(QueueUrl, "DeleteMessage").delete(ReceiptHandle)
+        return {}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout, **kwargs):
+        self._call("ChangeMessageVisibility")
+        if not self._queue(QueueUrl, "ChangeMessageVisibility").change_visibility(ReceiptHandle, VisibilityTimeout):
+            raise self.exceptions.error("ReceiptHandleIsInvalid", "The receipt handle is not valid.", "ChangeMessageVisibility")
+        return {}
+
+
+def _plain(value):
+    """A Python value normalized as the DynamoDB resource layer does: ints become Decimal, floats are rejected."""
+    return _deserializer.deserialize(_serializer.serialize(value))
+
+
+class FakeDynamoDb(FakeService):
+    """
+    Tables with get, put, update, delete and query, including condition and
+    update expressions. A query evaluates its key condition on every item.
+
+    The client API takes and returns DynamoDB JSON; table(name) gives the
+    resource Table API on the same items with plain values.
+    """
+
+    service = "dynamodb"
+    errors = ("ConditionalCheckFailedException", "ResourceNotFoundException", "ValidationException")
+
+    def __init__(self, calls, latency=0):
+        super().__init__(calls, latency)
+        self.tables = {}
+
+    def create_table(self, name, *key_names):
+        """Create a table with its partition (and sort) key names; not counted as a call."""
+        self.tables[name] = {"keys": key_names, "items": {}}
+
+    def _table(self, name, operation):
+        table = self.tables.get(name)
+        if table is None:
+            raise self.exceptions.error("ResourceNotFoundException", f"Requested resource not found: Table: {name} not found", operation)
+        return table
+
+    def _key(self, table, key, operation):
+        if set(key) != set(table["keys"]):
+            raise self.exceptions.error("ValidationException", "The provided key element does not match the schema", operation)
+        return tuple(key[name] for name in table["keys"])
+
+    def _check(self, item, condition, names, values, operation):
+        if condition is None:
+            return
+        try:
+            satisfied = evaluate_condition(item or {}, condition, names, values)
+        except ExpressionError as e:
+            raise self.exceptions.error("ValidationException", str(e), operation)
+        if not satisfied:
+            raise self.exceptions.error("ConditionalCheckFailedException", "The conditional request failed", operation)
+
+    def _check_size(self, item, operation):
+        if len(json.dumps(_serializer.serialize(item)["M"], default=str)) > MAX_ITEM_BYTES:
+            raise self.exceptions.error("ValidationException", "Item size has exceeded the maximum allowed size", operation)
+
+    def get(self, table_name, key):
+        self._call("GetItem")
+        table = self._table(table_name, "GetItem")
+        with self.lock:
+            item = table["items"].get(self._key(table, key, "GetItem"))
+        return None if item is None else dict(item)
+
+    def put(self, table_name, item, condition=None, names=None, values=None):
+        self._call("PutItem")
+        table = self._table(table_name, "PutItem")
+        self._check_size(item, "PutItem")
+        with self.lock:
+            key = self._key(table, {name: item.get(name) for name in table["keys"]}, "PutItem")
+            self._check(table["items"].get(key), condition, names, values, "PutItem")
+            table["items"][key] = dict(item)
+
+    def update(self, table_name, key, expression, condition=None, names=None, values=None, return_values="NONE"):
+        self._call("UpdateItem")
+        table = self._table(table_name, "UpdateItem")
+        with self.lock:
+            item_key = self._key(table, key, "UpdateItem")
+            current = table["items"].get(item_key)
+            self._check(current, condition, names, values, "UpdateItem")
+            try:
+                updated = apply_update(current or dict(key), expression, names, values)
+            except ExpressionError as e:
+                raise self.exceptions.error("ValidationException", str(e), "UpdateItem")
+            self._check_size(updated, "UpdateItem")
+            table["items"][item_key] = updated
+        if return_values == "ALL_NEW":
+            return dict(updated)
+        if return_values == "ALL_OLD":
+            return dict(current) if current else None
+        return None
+
+    def delete(self, table_name, key):
+        self._call("DeleteItem")
+        table = self._table(table_name, "DeleteItem")
+        with self.lock:
+            table["items"].pop(self._key(table, key, "DeleteItem"), None)
+
+    def query(self, TableName, KeyConditionExpression, FilterExpression=None, ExpressionAttributeNames=None,
+              ExpressionAttributeValues=None, Select="ALL_ATTRIBUTES", **kwargs):
+        self._call("Query")
+        table = self._table(TableName, "Query")
+        values = _from_typed(ExpressionAttributeValues)
+        with self.lock:
+            items = [dict(item) for item in table["items"].values()]
+        try:
+            matched = [item for item in items if evaluate_condition(item, KeyConditionExpression, ExpressionAttributeNames, values)]
+            found = [item for item in matched
+                     if FilterExpression is None or evaluate_condition(item, FilterExpression, ExpressionAttributeNames, values)]
+        except ExpressionError as e:
+            raise self.exceptions.error("ValidationException", str(e), "Query")
+        response = {"Count": len(found), "ScannedCount": len(matched)}
+        if Select != "COUNT":
+            response["Items"] = [_to_typed(item) for item in found]
+        return response
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self.delete(TableName, _from_typed(Key))
+        return {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        item = self.get(TableName, _from_typed(Key))
+        return {} if item is None else {"Item": _to_typed(item)}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        self.put(TableName, _from_typed(Item), ConditionExpression, ExpressionAttributeNames, _from_typed(ExpressionAttributeValues))
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues="NONE", **kwargs):
+        attributes = self.update(
+            TableName, _from_typed(Key), UpdateExpression, ConditionExpression,
+            ExpressionAttributeNames, _from_typed(ExpressionAttributeValues), ReturnValues
+        )
+        return {"Attributes": _to_typed(attributes)} if attributes is not None else {}
+
+    def table(self, name):
+        return FakeTable(self, name)
+
+    def items(self, table_name):
+        """Every item of a table, for the harness; not counted as a call."""
+        with self.lock:
+            return [dict(item) for item in self.tables[table_name]["items"].values()]
+
+
+def _from_typed(values):
+    return {name: _deserializer.deserialize(value) for name, value in (values or {}).items()}
+
+
+def _to_typed(item):
+    return {name: _serializer.serialize(value) for name, value in item.items()}
+
+
+class FakeTable:
+    """The boto3 resource Table API of a FakeDynamoDb table."""
+
+    def __init__(self, dynamodb, name):
+        self.dynamodb = dynamodb
+        self.name = name
+        self.table_name = name
+
+    def get_item(self, Key, **kwargs):
+        item = self.dynamodb.get(self.name, _plain(Key))
+        return {} if item is None else {"Item": item}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        self.dynamodb.put(self.name, _plain(Item), ConditionExpression, ExpressionAttributeNames, _plain(ExpressionAttributeValues or {}))
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues="NONE", **kwargs):
+        attributes = self.dynamodb.update(
+            self.name, _plain(Key), UpdateExpression, ConditionExpression,
+            ExpressionAttributeNames, _plain(ExpressionAttributeValues or {}), ReturnValues
+        )
+        return {"Attributes": attributes} if attributes is not None else {}
+
+
+class FakeDynamoDbResource:
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+
+    def Table(self, name):
+        return self.dynamodb.table(name)
+
+
+class FakeStepFunctions(FakeService):
+    """
+    Executions and task tokens.
+
+    start_execution records the execution and hands it to starter, which runs
+    it; the runner reports the outcome with finish(). Task tokens are created
+    with new_token() and resolved by send_task_success and send_task_failure.
+    """
+
+    service = "stepfunctions"
+    errors = ("ExecutionAlreadyExists", "ExecutionDoesNotExist", "InvalidToken", "InvalidOutput", "TaskDoesNotExist", "TaskTimedOut")
+
+    def __init__(self, calls, latency=0, state_machine_name="multipagepdfbda_stepfunction"):
+        super().__init__(calls, latency)
+        self.state_machine_arn = f"arn:aws:states:{REGION}:{ACCOUNT}:stateMachine:{state_machine_name}"
+        self.execution_arn_prefix = f"arn:aws:states:{REGION}:{ACCOUNT}:execution:{state_machine_name}:"
+        self.executions = {}
+        self.tokens = {}
+        self.closed = set()
+        self.starter = None
+
+    def start_execution(self, stateMachineArn, name, input="{}", **kwargs):
+        self._call("StartExecution")
+        arn = self.execution_arn_prefix + name
+        with self.lock:
+            existing = self.executions.get(arn)
+            if existing is not None and existing["status"] == "RUNNING" and existing["input"] == input:
+                # Idempotent while running: the same name and input return the running execution
+                return {"executionArn": arn, "startDate": existing["startDate"]}
+            if existing is not None:
+                raise self.exceptions.error("ExecutionAlreadyExists", f"Execution Already Exists: '{arn}'", "StartExecution")
+            execution = self.executions[arn] = {
+                "executionArn": arn,
+                "stateMachineArn": stateMachineArn,
+                "name": name,
+                "status": "RUNNING",
+                "startDate": utc_now(),
+                "input": input,
+            }
+        self.starter(execution)
+        return {"executionArn": arn, "startDate": execution["startDate"]}
+
+    def finish(self, execution, output=None, error=None, cause=None):
+        with self.lock:
+            execution["stopDate"] = utc_now()
+            if error is None:
+                execution.update(status="SUCCEEDED", output=json.dumps(output, default=str))
+            else:
+                execution.update(status="FAILED", error=error, cause=cause)
+
+    def list_executions(self, stateMachineArn, statusFilter=None, **kwargs):
+        self._call("ListExecutions")
+        with self.lock:
+            executions = [
+                {key: execution[key] for key in ("executionArn", "stateMachineArn", "name", "status", "startDate", "stopDate") if key in execution}
+                for execution in self.executions.values()
+                if execution["stateMachineArn"] == stateMachineArn and statusFilter in (None, execution["status"])
+            ]
+        return {"executions": sorted(executions, key=lambda execution: execution["startDate"], reverse=True)}
+
+    def describe_execution(self, executionArn, **kwargs):
+        self._call("DescribeExecution")
+        with self.lock:
+            execution = self.executions.get(executionArn)
+            if execution is None:
+                raise self.exceptions.error("ExecutionDoesNotExist", f"Execution Does Not Exist: '{executionArn}'", "DescribeExecution")
+            return dict(execution)
+
+    def new_token(self):
+        """A task token and the future its result is delivered to."""
+        token = uuid.uuid4().hex + uuid.uuid4().hex
+        future = Future()
+        with self.lock:
+            self.tokens[token] = future
+        return token, future
+
+    def close_token(self, token):
+        """Stop accepting results for a token whose task timed out."""
+        with self.lock:
+            self.tokens.pop(token, None)
+            self.closed.add(token)
+
+    def _take_token(self, token, operation):
+        with self.lock:
+            future = self.tokens.pop(token, None)
+            if future is None:
+                if token in self.closed:
+                    raise self.exceptions.error("TaskTimedOut", "Task Timed Out: 'Provided task does not exist anymore'", operation)
+                raise self.exceptions.error("InvalidToken", "Invalid Token", operation)
+            self.closed.add(token)
+        return future
+
+    def send_task_success(self, taskToken, output, **kwargs):
+        self._call("SendTaskSuccess")
+        try:
+            result = json.loads(output)
+        except ValueError:
+            raise self.exceptions.error("InvalidOutput", "Invalid Output", "SendTaskSuccess")
+        self._take_token(taskToken, "SendTaskSuccess").set_result(result)
+        return {}
+
+    def send_task_failure(self, taskToken, error=None, cause=None, **kwargs):
+        self._call("SendTaskFailure")
+        self._take_token(taskToken, "SendTaskFailure").set_exception(ExecutionFailed(error or "", cause or ""))
+        return {}
+
+
+class FakeBdaRuntime(FakeService):
+    """
+    Bedrock Data Automation jobs answered from fixtures.
+
+    invoke_data_automation_async writes the job_metadata.json and the custom
+    outputs of the fixture found by fixtures(bucket, key) to the output
+    location. get_data_automation_status blocks until the job has run for
+    job_seconds(fixture), so the harness measures the job time rather than
+    the poll interval of the handler.
+    """
+
+    service = "bedrock-data-automation-runtime"
+    errors = ("ValidationException", "ResourceNotFoundException")
+
+    def __init__(self, calls, s3, fixtures, job_seconds, latency=0):
+        super().__init__(calls, latency)
+        self.s3 = s3
+        self.fixtures = fixtures
+        self.job_seconds = job_seconds
+        self.jobs = {}
+
+    def invoke_data_automation_async(self, inputConfiguration, outputConfiguration, **kwargs):
+        self._call("InvokeDataAutomationAsync")
+        input_bucket, _, input_key = inputConfiguration["s3Uri"][len("s3://"):].partition("/")
+        fixture = self.fixtures(input_bucket, input_key)
+        if fixture is None:
+            raise self.exceptions.error("ValidationException", f"No fixture for {inputConfiguration['s3Uri']}", "InvokeDataAutomationAsync")
+
+        job_id = str(uuid.uuid4())
+        output_bucket, _, output_prefix = outputConfiguration["s3Uri"][len("s3://"):].partition("/")
+        job_prefix = f"{output_prefix.rstrip('/')}/{job_id}"
+        for path, document in job_outputs(fixture, job_id, f"s3://{output_bucket}/{job_prefix}").items():
+            self.s3._store(output_bucket, f"{job_prefix}/{path}", json.dumps(document).encode("utf-8"), "application/json")
+        metadata_key = f"{job_prefix}/job_metadata.json"
+
+        invocation_arn = f"arn:aws:bedrock:{REGION}:{ACCOUNT}:data-automation-invocation/{job_id}"
+        with self.lock:
+            self.jobs[invocation_arn] = {
+                "done_at": time.monotonic() + self.job_seconds(fixture),
+                "metadata_uri": f"s3://{output_bucket}/{metadata_key}",
+            }
+        return {"invocationArn": invocation_arn}
+
+    def get_data_automation_status(self, invocationArn, **kwargs):
+        self._call("GetDataAutomationStatus")
+        with self.lock:
+            job = self.jobs.get(invocationArn)
+        if job is None:
+            raise self.exceptions.error("ResourceNotFoundException", f"No invocation {invocationArn}", "GetDataAutomationStatus")
+        remaining = job["done_at"] - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return {"status": "Success", "outputConfiguration": {"s3Uri": job["metadata_uri"]}}
+
+
+class FakeA2i(FakeService):
+    """Human loops; on_start(loop) is called for every loop started, to review it."""
+
+    service = "sagemaker-a2i-runtime"
+    errors = ("ConflictException", "ValidationException", "ResourceNotFoundException")
+
+    def __init__(self, calls, on_start, latency=0):
+        super().__init__(calls, latency)
+        self.on_start = on_start
+        self.loops = {}
+
+    def start_human_loop(self, HumanLoopName, FlowDefinitionArn, HumanLoopInput, **kwargs):
+        self._call("StartHumanLoop")
+        arn = f"arn:aws:sagemaker:{REGION}:{ACCOUNT}:human-loop/{HumanLoopName}"
+        with self.lock:
+            if HumanLoopName in self.loops:
+                raise self.exceptions.error("ConflictException", f"Human loop {HumanLoopName} already exists", "StartHumanLoop")
+            loop = self.loops[HumanLoopName] = {
+                "HumanLoopName": HumanLoopName,
+                "HumanLoopArn": arn,
+                "FlowDefinitionArn": FlowDefinitionArn,
+                "HumanLoopStatus": "InProgress",
+                "CreationTime": utc_now(),
+                "input": json.loads(HumanLoopInput["InputContent"]),
+            }
+        self.on_start(loop)
+        return {"HumanLoopArn": arn}
+
+    def describe_human_loop(self, HumanLoopName, **kwargs):
+        self._call("DescribeHumanLoop")
+        with self.lock:
+            loop = self.loops.get(HumanLoopName)
+        if loop is None:
+            raise self.exceptions.error("ResourceNotFoundException", f"Human loop {HumanLoopName} not found", "DescribeHumanLoop")
+        return {key: value for key, value in loop.items() if key != "input"}
+
+
+class Scheduler:
+    """Runs callbacks at a later time on one background thread, e.g. the end of a human review."""
+
+    def __init__(self):
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def call_later(self, delay, callback):
+        with self.condition:
+            heapq.heappush(self.queue, (time.monotonic() + delay, next(self.sequence), callback))
+            self.condition.notify()
+
+    def pending(self):
+        with self.condition:
+            return len(self.queue)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                if self.stopped:
+                    return
+                _, _, callback = heapq.heappop(self.queue)
+            callback()
+
+
+class FakeAws:
+    """
+    One set of stand-ins, and the client factory for aws_clients.set_factory.
+
+    Args:
+        fixtures: fixtures(bucket, key) -> the BDA fixture of an uploaded document
+        job_seconds: job_seconds(fixture) -> how long its BDA job runs
+        on_human_loop: called with every human loop started
+        latency: seconds added to every API call
+    """
+
+    def __init__(self, fixtures, job_seconds, on_human_loop, latency=0):
+        self.calls = CallCounter()
+        self.s3 = FakeS3(self.calls, latency)
+        self.sqs = FakeSqs(self.calls, latency)
+        self.dynamodb = FakeDynamoDb(self.calls, latency)
+        self.stepfunctions = FakeStepFunctions(self.calls, latency)
+        self.bda = FakeBdaRuntime(self.calls, self.s3, fixtures, job_seconds, latency)
+        self.a2i = FakeA2i(self.calls, on_human_loop, latency)
+        self.clients = {
+            fake.service: fake
+            for fake in (self.s3, self.sqs, self.dynamodb, self.stepfunctions, self.bda, self.a2i)
+        }
+        self.resources = {"dynamodb": FakeDynamoDbResource(self.dynamodb)}
+
+    def __call__(self, kind, service):
+        found = (self.clients if kind == "client" else self.resources).get(service)
+        if found is None:
+            raise NotImplementedError(f"No offline stand-in for the {service} {kind}")
+        return found
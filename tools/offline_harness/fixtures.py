@@ -0,0 +1,242 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+BDA fixtures: the custom outputs a Bedrock Data Automation job returns for a
+document.
+
+A fixture is a dict with the document's page count and one custom output
+per segment, or None for a segment that matched no blueprint:
+
+    {"pages": 3, "segments": [{"matched_blueprint": ..., "inference_result": ...,
+                               "explainability_info": [...], "split_document": {...}}, None]}
+
+synthetic_document() generates one. job_outputs() lays it out as the files a
+BDA job writes, write_fixture() saves those to a folder, and load_fixture()
+reads such a folder back, or the output of a real job as BDA wrote it:
+job_metadata.json and */custom_output/*/result.json.
+
+Generate fixtures of a given size, from the repository root:
+    python -m tools.offline_harness.fixtures fixtures/large --pages 50 --segments 5 --fields-per-page 40
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+
+BLUEPRINT_ARN = "arn:aws:bedrock:us-east-1:123456789012:blueprint/offline-form"
+BLUEPRINT_NAME = "offline-form"
+
+# Confidence of fields BDA is sure about, and of fields that need a look
+HIGH_CONFIDENCE = (0.96, 1.0)
+LOW_CONFIDENCE = (0.30, 0.90)
+
+
+def _geometry(page, rng):
+    left, top = round(rng.uniform(0.05, 0.7), 4), round(rng.uniform(0.05, 0.9), 4)
+    width, height = round(rng.uniform(0.05, 0.25), 4), round(rng.uniform(0.01, 0.05), 4)
+    return [{
+        "page": page + 1,
+        "boundingBox": {"left": left, "top": top, "width": width, "height": height},
+        "vertices": [
+            {"x": left, "y": top},
+            {"x": left + width, "y": top},
+            {"x": left + width, "y": top + height},
+            {"x": left, "y": top + height},
+        ],
+    }]
+
+
+def _field(value, page, low_confidence_rate, rng):
+    bounds = LOW_CONFIDENCE if rng.random() < low_confidence_rate else HIGH_CONFIDENCE
+    return {"value": value, "confidence": round(rng.uniform(*bounds), 4), "geometry": _geometry(page, rng)}
+
+
+def synthetic_segment(page_indices, fields_per_page=8, low_confidence_rate=0.05, rng=None, line_items_per_page=1):
+    """
+    Custom output of one segment covering page_indices.
+
+    Every page has fields_per_page simple fields and line_items_per_page
+    line_items rows; the first page also has a nested address object. Each
+    field is below the default review threshold with probability
+    low_confidence_rate.
+    """
+    rng = rng or random.Random(0)
+    inference_result = {}
+    explainability = {}
+    line_items = []
+    explained_items = []
+    for page in page_indices:
+        for index in range(fields_per_page):
+            name = f"page_{page}_field_{index}"
+            value = f"value {page}-{index}-{rng.randrange(10000)}"
+            inference_result[name] = value
+            explainability[name] = _field(value, page, low_confidence_rate, rng)
+        for row in range(line_items_per_page):
+            description, amount = f"item {row} on page {page}", f"{rng.uniform(1, 500):.2f}"
+            line_items.append({"description": description, "amount": amount})
+            explained_items.append({
+                "description": _field(description, page, low_confidence_rate, rng),
+                "amount": _field(amount, page, low_confidence_rate, rng),
+            })
+    first_page = page_indices[0]
+    address = {"street": f"{rng.randrange(1, 999)} Main St", "city": "Seattle"}
+    inference_result["address"] = address
+    explainability["address"] = {name: _field(value, first_page, low_confidence_rate, rng) for name, value in address.items()}
+    inference_result["line_items"] = line_items
+    explainability["line_items"] = explained_items
+    return {
+        "matched_blueprint": {"arn": BLUEPRINT_ARN, "name": BLUEPRINT_NAME, "confidence": 1},
+        "document_class": {"type": BLUEPRINT_NAME},
+        "split_document": {"page_indices": list(page_indices)},
+        "inference_result": inference_result,
+        "explainability_info": [explainability],
+    }
+
+
+def synthetic_document(pages=2, segments=1, fields_per_page=8, low_confidence_rate=0.05, unmatched_segments=0, seed=0,
+                       line_items_per_page=1):
+    """
+    Fixture of a document whose pages are split into consecutive segments.
+
+    The last unmatched_segments segments matched no blueprint and have no
+    custom output.
+    """
+    rng = random.Random(seed)
+    segments = max(1, min(segments, pages))
+    bounds = [round(pages * index / segments) for index in range(segments + 1)]
+    outputs = []
+    for index in range(segments):
+        page_indices = list(range(bounds[index], bounds[index + 1]))
+        if index >= segments - unmatched_segments:
+            outputs.append(None)
+        else:
+            outputs.append(synthetic_segment(page_indices, fields_per_page, low_confidence_rate, rng, line_items_per_page))
+    return {"pages": pages, "segments": outputs}
+
+
+def job_outputs(fixture, job_id, job_uri):
+    """
+    The files a BDA job writes for a fixture, as {path below the job folder: JSON document}.
+
+    job_uri is the S3 URI of the job folder, which job_metadata.json refers to.
+    """
+    outputs = {}
+    segment_metadata = []
+    for index, custom_output in enumerate(fixture["segments"]):
+        standard_path = f"0/standard_output/{index}/result.json"
+        outputs[standard_path] = {"metadata": {"number_of_pages": fixture["pages"]}}
+        entry = {"segment_index": index, "standard_output_path": f"{job_uri}/{standard_path}"}
+        if custom_output is None:
+            entry["custom_output_status"] = "NO_MATCH"
+        else:
+            custom_path = f"0/custom_output/{index}/result.json"
+            outputs[custom_path] = custom_output
+            entry.update(custom_output_status="MATCH", custom_output_path=f"{job_uri}/{custom_path}")
+        segment_metadata.append(entry)
+    outputs["job_metadata.json"] = {
+        "job_id": job_id,
+        "job_status": "PROCESSED",
+        "semantic_modality": "DOCUMENT",
+        "output_metadata": [{"asset_id": 0, "segment_metadata": segment_metadata}],
+    }
+    return outputs
+
+
+def write_fixture(fixture, directory, job_id="offline-job"):
+    """Write a fixture to directory as the job folder of a BDA job; load_fixture() reads it back."""
+    job_uri = f"s3://offline-fixtures/output/{job_id}"
+    for path, document in job_outputs(fixture, job_id, job_uri).items():
+        target = os.path.join(directory, *path.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "w") as f:
+            json.dump(document, f, indent=2)
+
+
+def load_fixture(directory):
+    """
+    Fixture from the output folder of a BDA job.
+
+    With a job_metadata.json, segments are read in its order and unmatched
+    segments are kept; without one, every custom_output/*/result.json under
+    directory is a segment.
+    """
+    metadata_path = os.path.join(directory, "job_metadata.json")
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            job_metadata = json.load(f)
+        paths = []
+        for asset in job_metadata.get("output_metadata", []):
+            for segment in asset.get("segment_metadata", []):
+                if segment.get("custom_output_status") == "MATCH":
+                    # The URI holds the job folder; keep the part below it
+                    relative = segment["custom_output_path"].split(f"{job_metadata['job_id']}/", 1)[-1]
+                    paths.append(os.path.join(directory, relative))
+                else:
+                    paths.append(None)
+    else:
+        paths = sorted(
+            glob.glob(os.path.join(directory, "**", "custom_output", "*", "result.json"), recursive=True),
+            key=lambda path: int(os.path.basename(os.path.dirname(path))),
+        )
+    segments = []
+    for path in paths:
+        if path is None:
+            segments.append(None)
+            continue
+        with open(path) as f:
+            segments.append(json.load(f))
+    # The standard output knows the page count; pages of unmatched segments are missing from the custom ones
+    page_indices = [page for segment in segments if segment for page in segment.get("split_document", {}).get("page_indices", [0])]
+    pages = max(page_indices, default=0) + 1
+    for path in glob.glob(os.path.join(directory, "**", "standard_output", "*", "result.json"), recursive=True)[:1]:
+        with open(path) as f:
+            pages = json.load(f).get("metadata", {}).get("number_of_pages", pages)
+    return {"pages": pages, "segments": segments}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="folder the job output is written to")
+    parser.add_argument("--pages", type=int, default=2, help="pages of the document")
+    parser.add_argument("--segments", type=int, default=1, help="segments the pages are split into")
+    parser.add_argument("--fields-per-page", type=int, default=8, help="simple fields per page")
+    parser.add_argument("--line-items-per-page", type=int, default=1, help="line_items rows per page")
+    parser.add_argument("--low-confidence", type=float, default=0.05, help="share of fields below the review threshold")
+    parser.add_argument("--unmatched-segments", type=int, default=0, help="trailing segments that matched no blueprint")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fixture = synthetic_document(
+        pages=args.pages,
+        segments=args.segments,
+        fields_per_page=args.fields_per_page,
+        low_confidence_rate=args.low_confidence,
+        unmatched_segments=args.unmatched_segments,
+        seed=args.seed,
+        line_items_per_page=args.line_items_per_page,
+    )
+    write_fixture(fixture, args.directory)
+    print(f"Wrote {len(fixture['segments'])} segments of {fixture['pages']} pages to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
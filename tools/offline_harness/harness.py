@@ -0,0 +1,633 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+Run the pipeline in-process against the stand-ins of fakes.py.
+
+Harness.run() sets up the bucket, queues and tables of the stack, wires them
+as create_events does, uploads the documents and waits until every
+execution has finished and its cleanup has run:
+
+    upload -> S3 notification -> sf_sqs -> kickoff -> StartExecution
+    execution (state_machine.py) -> invoke_bda, extractmetadata, Map of
+        check_confidence -> wrapup, or -> pngextract -> bedrock_sqs ->
+        analyzepdf -> A2I -> humancomplete -> task token -> wrapup
+    -> cleanup_sqs -> cleans3files
+
+The Python handlers run unchanged from deploy_code. pngextract (Java) and
+imageresize (Node.js) are replaced by stand-ins that write placeholder page
+images. Reviews are answered by Reviewer after a fixed time.
+
+All functions share one process, so the metrics and log context of
+concurrent invocations mix; metrics are off unless metrics_sink is set. Latencies come from the harness's own timing and from
+the timeline table, which is kept per document.
+"""
+
+import datetime
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import quote_plus
+
+from .fakes import ACCOUNT, REGION, FakeAws, Scheduler, utc_now
+from .state_machine import ExecutionFailed, StateMachine
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+DEPLOY_CODE = os.path.join(REPO_ROOT, "deploy_code")
+COMMON_LAYER = os.path.join(DEPLOY_CODE, "multipagepdfbda_common", "python")
+WRAPUP_FOLDER = os.path.join(DEPLOY_CODE, "multipagepdfbda_wrapup")
+
+BUCKET = "multipagepdfbda-offline"
+CALLBACK_TABLE = "multipagepdfbda-offline-callback"
+TIMELINE_TABLE = "multipagepdfbda-offline-timeline"
+FLOW_DEFINITION_ARN = f"arn:aws:sagemaker:{REGION}:{ACCOUNT}:flow-definition/offline-review"
+
+# Python functions by their name in create_lambda_functions: (folder, handler)
+HANDLERS = {
+    "kickoff": ("multipagepdfbda_kickoff", "lambda_handler"),
+    "invoke_bda": ("multipagepdfbda_invokebda", "lambda_handler"),
+    "extractmetadata": ("multipagepdfbda_extractmetadata", "lambda_handler"),
+    "check_confidence": ("multipagepdfbda_confidence", "lambda_handler"),
+    "analyzepdf": ("multipagepdfbda_analyzepdf", "lambda_handler"),
+    "humancomplete": ("multipagepdfbda_humancomplete", "lambda_handler"),
+    "humanfailed": ("multipagepdfbda_humancomplete", "failed_loop_handler"),
+    "wrapup": ("multipagepdfbda_wrapup", "lambda_handler"),
+    "cleans3files": ("multipagepdfbda_cleans3files", "lambda_handler"),
+}
+
+# Modules the wrapup handler imports from its own folder
+WRAPUP_MODULES = ("gather_data", "parquet_output", "path_merge", "review_delta", "s3_csv_writer")
+
+# Upload suffixes routed to sf_sqs by create_events, in any case
+UPLOAD_EXTENSIONS = ("pdf", "png", "jpg")
+
+# EventBridge invokes asynchronously; Lambda retries a failed event twice
+ASYNC_ATTEMPTS = 3
+
+PAGE_IMAGE = b"\x89PNG\r\n\x1a\n offline page image"
+
+
+def iso_time(value):
+    return value.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def function_arn(name):
+    return f"arn:aws:lambda:{REGION}:{ACCOUNT}:function:multipagepdfbda_{name}"
+
+
+def load_handlers():
+    """
+    Import the handler modules from deploy_code. The environment and the
+    client factory must be in place first, since modules read both on import.
+    """
+    sys.path.insert(0, COMMON_LAYER)
+    if WRAPUP_FOLDER not in sys.path:
+        sys.path.insert(0, WRAPUP_FOLDER)
+    # Modules that created their clients on import are loaded afresh
+    for name in WRAPUP_MODULES:
+        sys.modules.pop(name, None)
+    modules = {}
+    handlers = {}
+    for function, (folder, attribute) in HANDLERS.items():
+        if folder not in modules:
+            spec = importlib.util.spec_from_file_location(f"{folder}_lambda_function", os.path.join(DEPLOY_CODE, folder, "lambda_function.py"))
+            module = modules[folder] = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        handlers[function] = getattr(modules[folder], attribute)
+    return handlers
+
+
+class Invocations:
+    """Duration and outcome of every invocation, per function."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.errors = {}
+
+    def record(self, function, millis, error):
+        with self.lock:
+            self.durations.setdefault(function, []).append(millis)
+            self.errors[function] = self.errors.get(function, 0) + int(error)
+
+
+class Function:
+    """
+    A Lambda function. The event and the response go through JSON, as they
+    do in Lambda, and every invocation is timed.
+    """
+
+    def __init__(self, name, handler, invocations):
+        self.name = name
+        self.handler = handler
+        self.invocations = invocations
+
+    def __call__(self, event):
+        context = SimpleNamespace(
+            function_name=f"multipagepdfbda_{self.name}",
+            function_version="$LATEST",
+            invoked_function_arn=function_arn(self.name),
+            memory_limit_in_mb=3000,
+            aws_request_id=str(uuid.uuid4()),
+            get_remaining_time_in_millis=lambda: 900000,
+        )
+        event = json.loads(json.dumps(event))
+        started = time.perf_counter()
+        error = True
+        try:
+            response = self.handler(event, context)
+            error = False
+        finally:
+            self.invocations.record(self.name, (time.perf_counter() - started) * 1000, error)
+        return json.loads(json.dumps(response))
+
+
+class EventSourceMapping:
+    """
+    Polls a queue and invokes a function with batches, as a Lambda SQS event
+    source does. Messages of a successful batch are deleted; with
+    report_batch_item_failures only the reported ones are retried, otherwise
+    a failed invocation retries the whole batch.
+    """
+
+    def __init__(self, queue, function, batch_size, report_batch_item_failures=False, pollers=5):
+        self.queue = queue
+        self.function = function
+        self.batch_size = batch_size
+        self.report_batch_item_failures = report_batch_item_failures
+        self.stopped = threading.Event()
+        self.threads = [threading.Thread(target=self._poll, name=f"{function.name}-poller-{index}", daemon=True) for index in range(pollers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _poll(self):
+        while not self.stopped.is_set():
+            records = self.queue.receive(self.batch_size, timeout=0.05)
+            if records:
+                self._invoke(records)
+
+    def _invoke(self, records):
+        try:
+            response = self.function({"Records": records})
+        except Exception:
+            failed = {record["messageId"] for record in records}
+        else:
+            failed = set()
+            if self.report_batch_item_failures and isinstance(response, dict):
+                failed = {failure["itemIdentifier"] for failure in response.get("batchItemFailures", [])}
+        for record in records:
+            if record["messageId"] in failed:
+                self.queue.release(record["receiptHandle"])
+            else:
+                self.queue.delete(record["receiptHandle"])
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
+class AsyncInvoker:
+    """Asynchronous invocations, e.g. by EventBridge, retried twice on errors."""
+
+    def __init__(self, max_workers=32):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="async")
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.failures = {}
+
+    def invoke(self, function, event):
+        with self.lock:
+            self.in_flight += 1
+        self.executor.submit(self._run, function, event)
+
+    def _run(self, function, event):
+        try:
+            for _ in range(ASYNC_ATTEMPTS):
+                try:
+                    function(event)
+                    return
+                except Exception:
+                    pass
+            with self.lock:
+                self.failures[function.name] = self.failures.get(function.name, 0) + 1
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def idle(self):
+        with self.lock:
+            return self.in_flight == 0
+
+    def stop(self):
+        self.executor.shutdown(wait=True)
+
+
+class Reviewer:
+    """
+    Answers every human loop after review_seconds. A change_rate share of
+    the answers differ from the value shown, and a fail_rate share of the
+    loops fail instead of completing.
+    """
+
+    def __init__(self, aws, scheduler, deliver, review_seconds=0, change_rate=0.1, fail_rate=0, seed=0):
+        self.aws = aws
+        self.scheduler = scheduler
+        self.deliver = deliver
+        self.review_seconds = review_seconds
+        self.change_rate = change_rate
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+
+    def __call__(self, loop):
+        self.scheduler.call_later(self.review_seconds, lambda: self.finish(loop))
+
+    def answer(self, label):
+        value = "" if label.get("value") is None else str(label["value"])
+        return f"{value} (corrected)" if self.rng.random() < self.change_rate else value
+
+    def finish(self, loop):
+        now = utc_now()
+        name = loop["HumanLoopName"]
+        detail = {
+            "creationTime": iso_time(loop["CreationTime"]),
+            "failureCode": None,
+            "failureReason": None,
+            "flowDefinitionArn": loop["FlowDefinitionArn"],
+            "humanLoopArn": loop["HumanLoopArn"],
+            "humanLoopName": name,
+        }
+        if self.rng.random() < self.fail_rate:
+            detail.update(humanLoopStatus="Failed", failureCode="Offline", failureReason="Failed by the offline reviewer")
+            function = "humanfailed"
+        else:
+            output = {
+                "flowDefinitionArn": loop["FlowDefinitionArn"],
+                "humanAnswers": [{
+                    "acceptanceTime": iso_time(loop["CreationTime"]),
+                    "answerContent": {label["name"]: self.answer(label) for label in loop["input"].get("labels", [])},
+                    "submissionTime": iso_time(now),
+                    "timeSpentInSeconds": round((now - loop["CreationTime"]).total_seconds(), 3),
+                    "workerId": "offline-reviewer",
+                    "workerMetadata": {"identityData": {"identityProviderType": "Cognito", "sub": "offline-reviewer"}},
+                }],
+                "humanLoopName": name,
+                "inputContent": loop["input"],
+            }
+            key = f"a2i-output/offline-review/{now:%Y/%m/%d/%H/%M/%S}/{name}/output.json"
+            self.aws.s3._store(BUCKET, key, json.dumps(output).encode("utf-8"), "application/json")
+            detail.update(humanLoopStatus="Completed", humanLoopOutput={"outputS3Uri": f"s3://{BUCKET}/{key}"})
+            function = "humancomplete"
+        loop["HumanLoopStatus"] = detail["humanLoopStatus"]
+        self.deliver(function, {
+            "version": "0",
+            "id": str(uuid.uuid4()),
+            "detail-type": "SageMaker A2I HumanLoop Status Change",
+            "source": "aws.sagemaker",
+            "account": ACCOUNT,
+            "time": iso_time(now),
+            "region": REGION,
+            "resources": [loop["HumanLoopArn"]],
+            "detail": detail,
+        })
+
+
+class StandIns:
+    """Python stand-ins for the functions that are not written in Python."""
+
+    def __init__(self, aws, fixtures, render_page_seconds=0):
+        self.s3 = aws.s3
+        self.fixtures = fixtures
+        self.render_page_seconds = render_page_seconds
+
+    def render_pages(self, event, context):
+        """pngextract: render every page of a PDF to wip/{id}/{page}.png once, and return the page numbers."""
+        document_id, bucket = event["id"], event["bucket"]
+        marker_key = f"wip/{document_id}/rendered.txt"
+        try:
+            pages = int(self.s3.get_object(Bucket=bucket, Key=marker_key)["Body"].read())
+        except self.s3.exceptions.NoSuchKey:
+            self.s3.get_object(Bucket=bucket, Key=event["key"])
+            pages = self.fixtures(bucket, event["key"])["pages"]
+            for page in range(pages):
+                time.sleep(self.render_page_seconds)
+                self.s3.put_object(Bucket=bucket, Key=f"wip/{document_id}/{page}.png", Body=PAGE_IMAGE, ContentType="application/png")
+            self.s3.put_object(Bucket=bucket, Key=marker_key, Body=str(pages))
+        return [str(page) for page in range(pages)]
+
+    def resize_image(self, event, context):
+        """imageresize: copy an uploaded image to wip/{id}/0.{extension}."""
+        bucket, key = event["bucket"], event["key"]
+        extension = key.rsplit(".", 1)[-1].lower()
+        destination = f"wip/{event['id']}/0.{extension}"
+        body = self.s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        self.s3.put_object(Bucket=bucket, Key=destination, Body=body, ContentType=f"image/{extension}")
+        return {"statusCode": 200, "body": json.dumps({"location": f"{bucket}/{destination}"})}
+
+
+class Harness:
+    """
+    One offline run over a list of documents.
+
+    Args:
+        documents: [(name, fixture)]; a name ending in .pdf, .png or .jpg is
+            uploaded as uploads/{name}, with the fixture as its BDA output
+        bda_seconds, bda_page_seconds: BDA job time, fixed plus per page
+        review_seconds: time from the start of a human loop to its answer
+        render_page_seconds: pngextract time per page
+        api_latency: seconds added to every AWS API call
+        change_rate, fail_rate: see Reviewer
+        confidence_threshold: CONFIDENCE_THRESHOLD of check_confidence
+        speculative_rendering: as the speculative_rendering context flag
+        task_timeout: seconds an execution waits for a review before it fails
+        max_executions: executions that run at once; later ones wait
+        max_inflight_bda, max_inflight_reviews: kickoff's backpressure limits, 0 for none
+        backpressure_delay: backpressure_delay_seconds of kickoff
+        resume_rounds: times the failed documents are resumed, as tools/redrive.py failed does
+        seed: seed of the reviewer's choices
+    """
+
+    def __init__(self, documents, bda_seconds=0, bda_page_seconds=0, review_seconds=0, render_page_seconds=0,
+                 api_latency=0, change_rate=0.1, fail_rate=0, confidence_threshold=0.95,
+                 speculative_rendering=False, task_timeout=300, max_executions=256, max_inflight_bda=0,
+                 max_inflight_reviews=0, backpressure_delay=1, resume_rounds=0, seed=0):
+        self.documents = documents
+        self.bda_seconds = bda_seconds
+        self.bda_page_seconds = bda_page_seconds
+        self.review_seconds = review_seconds
+        self.render_page_seconds = render_page_seconds
+        self.api_latency = api_latency
+        self.change_rate = change_rate
+        self.fail_rate = fail_rate
+        self.confidence_threshold = confidence_threshold
+        self.speculative_rendering = speculative_rendering
+        self.task_timeout = task_timeout
+        self.max_executions = max_executions
+        self.max_inflight_bda = max_inflight_bda
+        self.max_inflight_reviews = max_inflight_reviews
+        self.backpressure_delay = backpressure_delay
+        self.resume_rounds = resume_rounds
+        self.seed = seed
+        self.fixtures = {f"uploads/{name}": fixture for name, fixture in documents}
+
+    def fixture(self, bucket, key):
+        return self.fixtures.get(key)
+
+    def job_seconds(self, fixture):
+        return self.bda_seconds + self.bda_page_seconds * fixture["pages"]
+
+    def configure_environment(self):
+        """The environment create_lambda_functions gives the functions, pointed at the stand-ins."""
+        os.environ.update({
+            "AWS_REGION": REGION,
+            "AWS_DEFAULT_REGION": REGION,
+            "REGION": REGION,
+            "OUTPUT_PATH": "output",
+            "PROJECT_ID": "offline",
+            "CONFIDENCE_THRESHOLD": str(self.confidence_threshold),
+            "ddb_tablename": CALLBACK_TABLE,
+            "timeline_table": TIMELINE_TABLE,
+            "checkpoint_table": CALLBACK_TABLE,
+            "sqs_url": self.queues["bedrock"].url,
+            "human_workflow_arn": FLOW_DEFINITION_ARN,
+            "state_machine_arn": self.aws.stepfunctions.state_machine_arn,
+            "execution_arn_prefix": self.aws.stepfunctions.execution_arn_prefix,
+            "bucket": BUCKET,
+            "max_inflight_bda": str(self.max_inflight_bda),
+            "max_inflight_reviews": str(self.max_inflight_reviews),
+            "backpressure_delay_seconds": str(self.backpressure_delay),
+        })
+        # The in-flight leases are kept only with a backpressure limit, as in the stack
+        if self.backpressure():
+            os.environ["inflight_table"] = CALLBACK_TABLE
+        else:
+            os.environ.pop("inflight_table", None)
+        os.environ.setdefault("metrics_sink", "off")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    def backpressure(self):
+        return bool(self.max_inflight_bda or self.max_inflight_reviews)
+
+    def setup(self):
+        self.scheduler = Scheduler()
+        self.async_invoker = AsyncInvoker()
+        self.aws = FakeAws(self.fixture, self.job_seconds, lambda loop: self.reviewer(loop), self.api_latency)
+        self.reviewer = Reviewer(self.aws, self.scheduler, self.deliver, self.review_seconds, self.change_rate, self.fail_rate, self.seed)
+        self.aws.dynamodb.create_table(CALLBACK_TABLE, "jobid", "callback_token")
+        self.aws.dynamodb.create_table(TIMELINE_TABLE, "id")
+        self.queues = {
+            # Deferred uploads are received again and again; the real queue dead-letters them after upload_max_receives
+            "sf": self.aws.sqs.create_queue("multipagepdfbda_sf_sqs", max_receives=None if self.backpressure() else 3),
+            "bedrock": self.aws.sqs.create_queue("multipagepdfbda_bedrock_sqs"),
+            "cleanup": self.aws.sqs.create_queue("multipagepdfbda_cleanup_sqs"),
+        }
+        self.configure_environment()
+
+        sys.path.insert(0, COMMON_LAYER)
+        from multipagepdfbda_common import aws_clients
+
+        aws_clients.set_factory(self.aws)
+        self.invocations = Invocations()
+        stand_ins = StandIns(self.aws, self.fixture, self.render_page_seconds)
+        handlers = dict(load_handlers(), pngextract=stand_ins.render_pages, imageresize=stand_ins.resize_image)
+        self.functions = {name: Function(name, handler, self.invocations) for name, handler in handlers.items()}
+
+        self.aws.s3.on_object_created(self.notify)
+        self.aws.stepfunctions.starter = self.start
+        self.executor = ThreadPoolExecutor(max_workers=self.max_executions, thread_name_prefix="execution")
+        self.state_machine = StateMachine(
+            invoke=lambda function, payload: self.functions[function](payload),
+            send_message=self.send_message,
+            new_token=self.aws.stepfunctions.new_token,
+            close_token=self.aws.stepfunctions.close_token,
+            function_arn=function_arn,
+            speculative_rendering=self.speculative_rendering,
+            task_timeout=self.task_timeout,
+        )
+        self.mappings = [
+            # Pollers as the default maximum concurrency of the SQS event sources in create_events
+            EventSourceMapping(self.queues["sf"], self.functions["kickoff"], batch_size=10, report_batch_item_failures=True, pollers=5),
+            EventSourceMapping(self.queues["bedrock"], self.functions["analyzepdf"], batch_size=1, pollers=10),
+            EventSourceMapping(self.queues["cleanup"], self.functions["cleans3files"], batch_size=10, report_batch_item_failures=True),
+        ]
+
+    def notify(self, bucket, key, size, etag):
+        """The S3 event notification of create_events: uploads/*.{pdf,png,jpg} to sf_sqs."""
+        if not key.startswith("uploads/") or key.rsplit(".", 1)[-1].lower() not in UPLOAD_EXTENSIONS:
+            return
+        record = {
+            "eventVersion": "2.1",
+            "eventSource": "aws:s3",
+            "awsRegion": REGION,
+            "eventTime": iso_time(utc_now()),
+            "eventName": "ObjectCreated:Put",
+            "s3": {
+                "s3SchemaVersion": "1.0",
+                "bucket": {"name": bucket, "arn": f"arn:aws:s3:::{bucket}"},
+                "object": {"key": quote_plus(key), "size": size, "eTag": etag, "sequencer": f"{time.time_ns():X}"},
+            },
+        }
+        self.queues["sf"].put(json.dumps({"Records": [record]}))
+
+    def deliver(self, function, event):
+        self.async_invoker.invoke(self.functions[function], event)
+
+    def send_message(self, queue, body):
+        return self.aws.sqs.send_message(QueueUrl=self.queues[queue].url, MessageBody=json.dumps(body))
+
+    def start(self, execution):
+        self.executor.submit(self.run_execution, execution)
+
+    def run_execution(self, execution):
+        try:
+            output = self.state_machine.run(json.loads(execution["input"]))
+        except ExecutionFailed as e:
+            self.aws.stepfunctions.finish(execution, error=e.error, cause=e.cause)
+        except Exception as e:
+            self.aws.stepfunctions.finish(execution, error="Harness." + type(e).__name__, cause=str(e))
+        else:
+            self.aws.stepfunctions.finish(execution, output)
+
+    def finished(self):
+        """Every document has an ended execution, or was dropped by kickoff, and nothing is left to do."""
+        executions = list(self.aws.stepfunctions.executions.values())
+        done = sum(execution["status"] != "RUNNING" for execution in executions)
+        dropped = len(self.queues["sf"].dead_letters)
+        return (
+            done == len(executions)
+            and done + dropped >= len(self.documents)
+            and all(queue.idle() for queue in self.queues.values())
+            and not self.scheduler.pending()
+            and self.async_invoker.idle()
+        )
+
+    def upload(self, name):
+        extension = name.rsplit(".", 1)[-1].lower()
+        content_type = "application/pdf" if extension == "pdf" else f"image/{extension}"
+        body = f"offline {name} {uuid.uuid4()}".encode("utf-8")
+        self.uploaded[f"uploads/{name}"] = time.time()
+        self.aws.s3.put_object(Bucket=BUCKET, Key=f"uploads/{name}", Body=body, ContentType=content_type)
+
+    def run(self, rate=0, timeout=600):
+        """
+        Upload the documents, rate per second or all at once, and wait for
+        the pipeline to go quiet or for timeout seconds.
+
+        Returns:
+            The report, see report()
+        """
+        self.setup()
+        self.uploaded = {}
+        started = time.time()
+        try:
+            for index, (name, _) in enumerate(self.documents):
+                if rate:
+                    time.sleep(max(0, started + index / rate - time.time()))
+                self.upload(name)
+            deadline = time.monotonic() + timeout
+            while not self.finished() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            for _ in range(self.resume_rounds):
+                if not self.finished() or not self.resume_failed():
+                    break
+                while not self.finished() and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            timed_out = not self.finished()
+            elapsed = time.time() - started
+        finally:
+            self.stop()
+        return self.report(elapsed, timed_out)
+
+    def resume_failed(self):
+        """Start the documents whose execution failed again from their checkpoints; returns the executions started."""
+        from .. import redrive
+
+        since = datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+        plans = redrive.resume_failed(self.aws.stepfunctions.state_machine_arn, CALLBACK_TABLE, since)
+        return [plan for plan in plans if "executionArn" in plan]
+
+    def stop(self):
+        for mapping in self.mappings:
+            mapping.stop()
+        self.scheduler.stop()
+        self.async_invoker.stop()
+        # Executions still waiting for a token when the run timed out are failed
+        for token in list(self.aws.stepfunctions.tokens):
+            try:
+                self.aws.stepfunctions.send_task_failure(taskToken=token, error="Harness.Stopped", cause="The run ended")
+            except Exception:
+                pass
+        self.executor.shutdown(wait=True)
+        from multipagepdfbda_common import aws_clients
+
+        aws_clients.set_factory(None)
+
+    def report(self, elapsed, timed_out):
+        """
+        Counts, throughput, latencies, invocations and API calls of the run, as a
+        JSON-serializable dict. Latency is from the upload to the end of the
+        execution, in milliseconds.
+        """
+        executions = list(self.aws.stepfunctions.executions.values())
+        # The outcome of a document is that of its last attempt
+        latest = {}
+        for execution in sorted(executions, key=lambda execution: execution["startDate"]):
+            latest[execution["name"].partition("-r")[0]] = execution
+        latencies = []
+        errors = {}
+        for execution in latest.values():
+            uploaded = self.uploaded.get(json.loads(execution["input"])["key"])
+            if execution["status"] == "SUCCEEDED" and uploaded is not None:
+                latencies.append((execution["stopDate"].timestamp() - uploaded) * 1000)
+            elif execution["status"] == "FAILED":
+                errors[execution["error"]] = errors.get(execution["error"], 0) + 1
+        succeeded = sum(execution["status"] == "SUCCEEDED" for execution in latest.values())
+        pages = sum(self.fixtures[key]["pages"] for key in self.fixtures)
+        calls = self.aws.calls.snapshot()
+        return {
+            "documents": len(self.documents),
+            "pages": pages,
+            "started": len(executions),
+            "resumed": len(executions) - len(latest),
+            "succeeded": succeeded,
+            "failed": sum(execution["status"] == "FAILED" for execution in latest.values()),
+            "timed_out": timed_out,
+            "execution_errors": errors,
+            "elapsed_seconds": elapsed,
+            "documents_per_second": succeeded / elapsed if elapsed else None,
+            "pages_per_second": pages * succeeded / len(self.documents) / elapsed if elapsed and self.documents else None,
+            "latency_ms": sorted(latencies),
+            "invocations": {
+                function: {"durations_ms": durations, "errors": self.invocations.errors.get(function, 0)}
+                for function, durations in sorted(self.invocations.durations.items())
+            },
+            "async_failures": dict(self.async_invoker.failures),
+            "dead_letters": {name: len(queue.dead_letters) for name, queue in self.queues.items()},
+            "calls": {f"{service}.{operation}": count for (service, operation), count in sorted(calls.items())},
+            "human_loops": len(self.aws.a2i.loops),
+            "timelines": self.aws.dynamodb.items(TIMELINE_TABLE),
+            "leftover_keys": self.aws.s3.keys(BUCKET, "wip/") + self.aws.s3.keys(BUCKET, "output/"),
+        }
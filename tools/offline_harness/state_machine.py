@@ -0,0 +1,282 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+
+"""
+The state machine of multipagepdfbda_stack.create_state_machine, in Python.
+
+StateMachine.run() takes an execution input through the same states as the
+deployed state machine, with the same payloads, result paths and choices.
+Lambda tasks and the SQS tasks are handed to callables, so the harness
+decides what runs them. Keep this module in step with create_state_machine.
+
+As in Step Functions, a JSONPath that matches nothing, a state above the
+256 KiB payload limit, a Lambda error or a failed task token fails the
+execution with ExecutionFailed.
+"""
+
+import functools
+import json
+from concurrent.futures import FIRST_EXCEPTION, InvalidStateError, ThreadPoolExecutor, TimeoutError, wait
+
+# Step Functions limit on the input and output of a state
+MAX_PAYLOAD_BYTES = 256 * 1024
+
+# Concurrent iterations of a Map state without MaxConcurrency
+MAP_CONCURRENCY = 40
+
+
+class ExecutionFailed(Exception):
+    """Fails the execution with a Step Functions error name and cause."""
+
+    def __init__(self, error, cause):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+def json_path(state, path):
+    """Value of a JSONPath such as $.confidence_result.Payload.page_index."""
+    value = state
+    for field in path[2:].split("."):
+        if not isinstance(value, dict) or field not in value:
+            raise ExecutionFailed("States.Runtime", f"The JSONPath '{path}' could not be found in the input")
+        value = value[field]
+    return value
+
+
+def select(state, **paths):
+    """Parameters of a state: {name: path} pairs resolved against state; values not starting with $ are kept."""
+    return {
+        name: json_path(state, value) if isinstance(value, str) and value.startswith("$") else value
+        for name, value in paths.items()
+    }
+
+
+def lambda_result(payload):
+    """Result of a LambdaInvoke task without payload_response_only."""
+    return {"ExecutedVersion": "$LATEST", "Payload": payload, "StatusCode": 200}
+
+
+class StateMachine:
+    """
+    Args:
+        invoke: invoke(function, payload) -> response of a Lambda function; raises on errors
+        send_message: send_message(queue, body) -> SendMessage response
+        new_token: new_token() -> (token, future) of a WAIT_FOR_TASK_TOKEN task
+        close_token: close_token(token) after a task timed out
+        function_arn: function_arn(function) -> ARN passed in the extractmetadata payload
+        speculative_rendering: as the speculative_rendering context flag
+        task_timeout: seconds a task token is waited for; None waits forever
+    """
+
+    def __init__(self, invoke, send_message, new_token, close_token, function_arn,
+                 speculative_rendering=False, task_timeout=None):
+        self.invoke = invoke
+        self.send_message = send_message
+        self.new_token = new_token
+        self.close_token = close_token
+        self.function_arn = function_arn
+        self.speculative_rendering = speculative_rendering
+        self.task_timeout = task_timeout
+
+    def run(self, execution_input):
+        """Run an execution to its end; returns the output or raises ExecutionFailed."""
+        state = self.checked(dict(execution_input))
+
+        # Resume From Checkpoint?
+        if "bda_results" not in state:
+            if "resume" not in state:
+                # Start From Upload
+                state["resume"] = {"attempt": 0}
+            state = self.start_bda(state)
+
+        state["segment_metadata"] = lambda_result(self.call("extractmetadata", {
+            "FunctionName": self.function_arn("extractmetadata"),
+            "Payload": state,
+        }))
+        state = self.checked(state)
+
+        segment_uris = json_path(state, "$.segment_metadata.Payload.segment_uris")
+        iterations = [
+            dict(select(state, id="$.id", bucket="$.bucket", key="$.key", extension="$.extension", resume="$.resume"), segment_uri=uri)
+            for uri in segment_uris
+        ]
+        state["map_results"] = self.process_segments(iterations)
+        state = self.checked(state)
+
+        state["cleanup_result"] = self.send_message("cleanup", select(state, id="$.id", bucket="$.bucket", bda_results="$.bda_results"))
+        return self.checked(state)
+
+    def start_bda(self, state):
+        # PDF or Image?
+        extension = json_path(state, "$.extension")
+        if extension == "pdf":
+            if self.speculative_rendering:
+                state = self.invoke_bda_and_render(state)
+            else:
+                state = self.invoke_bda(state)
+        elif extension in ("png", "jpg"):
+            state["Input"] = lambda_result(self.call("imageresize", state))
+            state = self.invoke_bda(self.checked(state))
+        else:
+            raise ExecutionFailed("States.NoChoiceMatched", f"No Choice Rules matched the input with extension {extension!r}")
+        return state
+
+    def invoke_bda(self, state):
+        # payload_response_only: the response itself is the result
+        state["bda_results"] = self.call("invoke_bda", state)
+        return self.checked(state)
+
+    def invoke_bda_and_render(self, state):
+        """The Parallel state; only the BDA branch carries the state forward."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            render = executor.submit(self.call, "pngextract", select(state, id="$.id", bucket="$.bucket", key="$.key"))
+            state = self.invoke_bda(dict(state))
+            try:
+                render.result()
+            except ExecutionFailed:
+                # Skip Speculative Rendering
+                pass
+        return state
+
+    def process_segments(self, iterations):
+        """
+        The Map state; the first failed iteration fails it, and the iterations
+        still waiting for a task token are stopped with it.
+        """
+        if not iterations:
+            return []
+        waiting = {}
+        with ThreadPoolExecutor(max_workers=min(MAP_CONCURRENCY, len(iterations))) as executor:
+            futures = [executor.submit(functools.partial(self.process_segment, waiting=waiting), iteration) for iteration in iterations]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = [future for future in done if future.exception() is not None]
+            if failed:
+                for token, future in list(waiting.items()):
+                    self.close_token(token)
+                    try:
+                        future.set_exception(ExecutionFailed("States.Aborted", "The Map state failed"))
+                    except InvalidStateError:
+                        # The result arrived before the token was closed
+                        pass
+                raise failed[0].exception()
+            return [future.result() for future in futures]
+
+    def process_segment(self, state, waiting=None):
+        state["confidence_result"] = lambda_result(self.call("check_confidence", select(
+            state, id="$.id", bucket="$.bucket", key="$.key", extension="$.extension", segment_uri="$.segment_uri",
+            resume="$.resume"
+        )))
+        state = self.checked(state)
+
+        # Segment Checkpointed?
+        resume_stage = state["confidence_result"]["Payload"].get("resume_stage")
+        if resume_stage == "written":
+            # Segment Already Written
+            state["wrapup_result"] = json_path(state, "$.confidence_result.Payload.wrapup_result")
+            return self.checked(state)
+        if resume_stage == "reviewed":
+            # Restore Review Result
+            state["a2i_result"] = json_path(state, "$.confidence_result.Payload.review_result")
+            return self.wrapup(self.checked(state))
+
+        # Does Document Need A2I?
+        needs_a2i = json_path(state, "$.confidence_result.Payload.needs_a2i") is True
+        if not needs_a2i:
+            state["wrapup_result"] = lambda_result(self.call("wrapup", select(
+                state,
+                id="$.id",
+                bucket="$.bucket",
+                key="$.key",
+                needs_a2i=False,
+                image_keys="$.confidence_result.Payload.image_keys",
+                segment_index="$.confidence_result.Payload.segment_index",
+                page_index="$.confidence_result.Payload.page_index",
+                inference_result="$.confidence_result.Payload.inference_result",
+                matched_blueprint="$.confidence_result.Payload.matched_blueprint",
+            )))
+            return self.checked(state)
+
+        if json_path(state, "$.extension") == "pdf":
+            state["conversion_result"] = lambda_result(self.call("pngextract", select(
+                state, id="$.id", bucket="$.bucket", key="$.key",
+                page_index="$.confidence_result.Payload.page_index", segment_uri="$.segment_uri"
+            )))
+            state = self.checked(state)
+
+        state["a2i_result"] = self.wait_for_review(state, {} if waiting is None else waiting)
+        return self.wrapup(self.checked(state))
+
+    def wrapup(self, state):
+        state["wrapup_result"] = lambda_result(self.call("wrapup", select(
+            state,
+            id="$.id",
+            bucket="$.bucket",
+            key="$.key",
+            a2i_result="$.a2i_result",
+            image_keys="$.confidence_result.Payload.image_keys",
+            segment_index="$.confidence_result.Payload.segment_index",
+            page_index="$.confidence_result.Payload.page_index",
+            inference_result="$.confidence_result.Payload.inference_result",
+            matched_blueprint="$.confidence_result.Payload.matched_blueprint",
+        )))
+        return self.checked(state)
+
+    def wait_for_review(self, state, waiting):
+        """
+        The SQS task with a task token: queue the segment for analyzepdf and
+        wait for the token, which is kept in waiting meanwhile.
+        """
+        token, future = self.new_token()
+        waiting[token] = future
+        self.send_message("bedrock", dict(select(
+            state,
+            id="$.id",
+            bucket="$.bucket",
+            key="$.key",
+            a2iinput="$.confidence_result.Payload.a2i_input",
+            wip_key="$.confidence_result.Payload.page_index",
+            inference_result="$.confidence_result.Payload.inference_result",
+            image_keys="$.confidence_result.Payload.image_keys",
+            matched_blueprint="$.confidence_result.Payload.matched_blueprint",
+            attempt="$.resume.attempt",
+        ), token=token))
+        try:
+            return future.result(timeout=self.task_timeout)
+        except TimeoutError:
+            self.close_token(token)
+            raise ExecutionFailed("States.Timeout", f"No task result within {self.task_timeout} seconds")
+        finally:
+            waiting.pop(token, None)
+
+    def call(self, function, payload):
+        """A Lambda task; an error of the function fails the execution."""
+        try:
+            return self.invoke(function, payload)
+        except ExecutionFailed:
+            raise
+        except Exception as e:
+            raise ExecutionFailed(type(e).__name__, json.dumps({"errorMessage": str(e), "errorType": type(e).__name__}))
+
+    @staticmethod
+    def checked(state):
+        size = len(json.dumps(state, separators=(",", ":")))
+        if size > MAX_PAYLOAD_BYTES:
+            raise ExecutionFailed("States.DataLimitExceeded", f"The state has {size} bytes, more than the limit of {MAX_PAYLOAD_BYTES}")
+        return state
@@ -0,0 +1,345 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+"""
+Resume failed document executions from their stage checkpoints, and move
+dead-lettered messages back into the pipeline.
+
+resume starts a new execution of a document, named {id}-r{attempt}, from the
+last stage its earlier attempts finished (see multipagepdfbda_common/checkpoint.py):
+    - the BDA job is not run again while its output is still in S3
+    - segments whose outputs were written are skipped
+    - pages whose review was completed are not sent to review again; the
+      segment is wrapped up from the stored review deltas
+The document counter of the review callbacks is reset, since the tokens of
+the failed attempt can no longer be used.
+
+Step Functions' own RedriveExecution is not used: it reruns the failed
+states with the names of their human loops, which A2I does not accept twice.
+
+failed resumes every document whose latest execution failed, timed out or
+was aborted in a time window. dlq moves the uploads dead-lettered by the
+kickoff queue, or the documents dead-lettered by the cleanup queue, back to
+their queue, or invokes humancomplete and humanfailed again with the human
+loop events they could not handle.
+
+Usage:
+    python tools/redrive.py resume --table <callback table> --id <document id>
+    python tools/redrive.py failed --table <callback table> --since 24h --dry-run
+    python tools/redrive.py dlq uploads
+    python tools/redrive.py dlq cleanup
+    python tools/redrive.py dlq callbacks
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "deploy_code", "multipagepdfbda_common", "python"))
+
+from multipagepdfbda_common import checkpoint  # noqa: E402
+from multipagepdfbda_common.aws_clients import get_client  # noqa: E402
+from multipagepdfbda_common.s3_paths import execution_name, parse_s3_uri  # noqa: E402
+
+STATE_MACHINE_NAME = "multipagepdfbda_stepfunction"
+# Sort key of the per-document completion counter item in the callback table
+DOCUMENT_COUNTER_SORT_KEY = "document"
+# Statuses of an execution that can be resumed
+ENDED_STATUSES = ("FAILED", "TIMED_OUT", "ABORTED")
+
+QUEUES = {
+    "uploads": ("multipagepdfbda_uploads_dlq", "multipagepdfbda_sf_sqs"),
+    "cleanup": ("multipagepdfbda_cleanup_dlq", "multipagepdfbda_cleanup_sqs"),
+    "callbacks": ("multipagepdfbda_callbacks_dlq", None),
+}
+CALLBACK_FUNCTIONS = {"Completed": "multipagepdfbda_humancomplete"}
+FAILED_CALLBACK_FUNCTION = "multipagepdfbda_humanfailed"
+
+
+def default_state_machine_arn():
+    sts = get_client("sts")
+    account = sts.get_caller_identity()["Account"]
+    return f"arn:aws:states:{sts.meta.region_name}:{account}:stateMachine:{STATE_MACHINE_NAME}"
+
+
+def execution_arn_prefix(state_machine_arn):
+    return state_machine_arn.replace(":stateMachine:", ":execution:") + ":"
+
+
+def document_id_of(name):
+    """Document id of an execution name; resumed executions end in -r{attempt}."""
+    return name.partition("-r")[0]
+
+
+def latest_execution(state_machine_arn, document_id):
+    """
+    The last attempt of a document.
+
+    Returns:
+        (attempt, describe_execution response), or (None, None) if the
+        document has no execution
+    """
+    sfn = get_client("stepfunctions")
+    prefix = execution_arn_prefix(state_machine_arn)
+    attempt, latest = None, None
+    while True:
+        next_attempt = 0 if attempt is None else attempt + 1
+        try:
+            execution = sfn.describe_execution(executionArn=prefix + execution_name(document_id, next_attempt))
+        except sfn.exceptions.ExecutionDoesNotExist:
+            return attempt, latest
+        attempt, latest = next_attempt, execution
+
+
+def bda_results(checkpoints):
+    """bda_results of the finished BDA job, if its output is still there to start from."""
+    bda = checkpoints.get("bda")
+    if not bda:
+        return None
+    bucket, key = parse_s3_uri(bda["job_metadata_uri"])
+    try:
+        get_client("s3").head_object(Bucket=bucket, Key=key)
+    except Exception:
+        # Swept or expired; the job is run again
+        return None
+    return {"status": "success", "job_metadata_uri": bda["job_metadata_uri"]}
+
+
+def expired_reviews(checkpoints, bucket):
+    """Completed reviews whose delta is no longer in S3, e.g. swept with wip/{id}/; {page: fields}."""
+    s3 = get_client("s3")
+    expired = {}
+    for page in checkpoint.completed_pages(checkpoints):
+        fields = checkpoints[f"review#{page}"]
+        try:
+            s3.head_object(Bucket=bucket, Key=fields["delta_key"])
+        except Exception:
+            expired[page] = fields
+    return expired
+
+
+def plan_resume(state_machine_arn, table, document_id):
+    """
+    What resuming a document would do.
+
+    Returns:
+        dict with the document id, the attempt, the execution name and input
+        and the stages skipped, or with a reason when it cannot be resumed
+    """
+    attempt, execution = latest_execution(state_machine_arn, document_id)
+    if execution is None:
+        return {"id": document_id, "skipped": "no execution"}
+    if execution["status"] not in ENDED_STATUSES:
+        return {"id": document_id, "skipped": f"{execution['name']} is {execution['status']}"}
+
+    checkpoints = checkpoint.load(document_id, table)
+    execution_input = {
+        key: value for key, value in json.loads(execution["input"]).items()
+        if key not in ("resume", "bda_results")
+    }
+    # Pages reviewed again, since the wrapup could not find their deltas
+    expired = expired_reviews(checkpoints, execution_input["bucket"])
+    for page, fields in expired.items():
+        checkpoints[f"review#{page}"] = dict(fields, status="Expired")
+    execution_input["resume"] = {"attempt": attempt + 1}
+    results = bda_results(checkpoints)
+    if results:
+        execution_input["bda_results"] = results
+    return {
+        "id": document_id,
+        "attempt": attempt + 1,
+        "name": execution_name(document_id, attempt + 1),
+        "input": execution_input,
+        "previous": {"name": execution["name"], "status": execution["status"]},
+        "bda": "reused" if results else "rerun",
+        "segments_written": sorted(stage for stage in checkpoints if stage.startswith("wrapup#")),
+        "pages_reviewed": sorted(checkpoint.completed_pages(checkpoints), key=lambda page: (len(page), page)),
+        "reviews_expired": {f"review#{page}": checkpoints[f"review#{page}"] for page in expired},
+    }
+
+
+def resume(state_machine_arn, table, document_id, dry_run=False):
+    """Start the next attempt of a document from its checkpoints; returns the plan."""
+    plan = plan_resume(state_machine_arn, table, document_id)
+    if dry_run or "skipped" in plan:
+        return plan
+    get_client("dynamodb").delete_item(
+        TableName=table,
+        Key={"jobid": {"S": document_id}, "callback_token": {"S": DOCUMENT_COUNTER_SORT_KEY}},
+    )
+    for stage, fields in plan["reviews_expired"].items():
+        checkpoint.save(document_id, stage, table, **fields)
+    checkpoint.save(document_id, f"resume#{plan['attempt']}", table, previous=plan["previous"], bda=plan["bda"])
+    response = get_client("stepfunctions").start_execution(
+        stateMachineArn=state_machine_arn,
+        name=plan["name"],
+        input=json.dumps(plan["input"]),
+    )
+    plan["executionArn"] = response["executionArn"]
+    return plan
+
+
+def failed_documents(state_machine_arn, since, until=None):
+    """Documents with an execution that ended unsuccessfully in [since, until), oldest first."""
+    sfn = get_client("stepfunctions")
+    until = until or datetime.datetime.now(datetime.timezone.utc)
+    stopped = {}
+    for status in ENDED_STATUSES:
+        kwargs = {"stateMachineArn": state_machine_arn, "statusFilter": status}
+        while True:
+            response = sfn.list_executions(**kwargs)
+            for execution in response["executions"]:
+                stop_date = execution.get("stopDate")
+                if stop_date and since <= stop_date < until:
+                    document_id = document_id_of(execution["name"])
+                    stopped[document_id] = min(stopped.get(document_id, stop_date), stop_date)
+            if "nextToken" not in response:
+                break
+            kwargs["nextToken"] = response["nextToken"]
+    return sorted(stopped, key=stopped.get)
+
+
+def resume_failed(state_machine_arn, table, since, until=None, dry_run=False):
+    """Resume every document that failed in the window; a document already running again is skipped."""
+    plans = []
+    for document_id in failed_documents(state_machine_arn, since, until):
+        try:
+            plans.append(resume(state_machine_arn, table, document_id, dry_run))
+        except Exception as e:
+            plans.append({"id": document_id, "error": str(e)})
+    return plans
+
+
+def queue_url(name):
+    return get_client("sqs").get_queue_url(QueueName=name)["QueueUrl"]
+
+
+def queue_arn(url):
+    return get_client("sqs").get_queue_attributes(QueueUrl=url, AttributeNames=["QueueArn"])["Attributes"]["QueueArn"]
+
+
+def redrive_queue(queue, dry_run=False):
+    """Move the dead-lettered messages of queue (uploads or cleanup) back to its source queue."""
+    dlq_name, queue_name = QUEUES[queue]
+    dlq_url = queue_url(dlq_name)
+    sqs = get_client("sqs")
+    waiting = sqs.get_queue_attributes(QueueUrl=dlq_url, AttributeNames=["ApproximateNumberOfMessages"])
+    result = {"queue": dlq_name, "messages": int(waiting["Attributes"]["ApproximateNumberOfMessages"])}
+    if not dry_run and result["messages"]:
+        response = sqs.start_message_move_task(
+            SourceArn=queue_arn(dlq_url),
+            DestinationArn=queue_arn(queue_url(queue_name)),
+        )
+        result["task"] = response["TaskHandle"]
+    return result
+
+
+def redrive_callbacks(dry_run=False, max_messages=1000):
+    """
+    Invoke humancomplete or humanfailed again with the human loop events in
+    the callbacks dead-letter queue. A message is deleted once its handler
+    succeeded; the others stay for the next run.
+    """
+    dlq_name, _ = QUEUES["callbacks"]
+    dlq_url = queue_url(dlq_name)
+    sqs = get_client("sqs")
+    lambda_client = get_client("lambda")
+    counts = {"queue": dlq_name, "handled": 0, "failed": 0}
+    seen = set()
+    while counts["handled"] + counts["failed"] < max_messages:
+        # In a dry run the messages are left to become visible again
+        visibility = 30 if dry_run else 300
+        messages = sqs.receive_message(QueueUrl=dlq_url, MaxNumberOfMessages=10, WaitTimeSeconds=1,
+                                       VisibilityTimeout=visibility).get("Messages", [])
+        messages = [message for message in messages if message["MessageId"] not in seen]
+        if not messages:
+            break
+        for message in messages:
+            seen.add(message["MessageId"])
+            event = json.loads(message["Body"])
+            status = event.get("detail", {}).get("humanLoopStatus")
+            function = CALLBACK_FUNCTIONS.get(status, FAILED_CALLBACK_FUNCTION)
+            if dry_run:
+                print(f"  would invoke {function} for {event.get('detail', {}).get('humanLoopName')} ({status})")
+                counts["handled"] += 1
+                continue
+            response = lambda_client.invoke(FunctionName=function, Payload=json.dumps(event).encode("utf-8"))
+            if "FunctionError" in response:
+                counts["failed"] += 1
+                continue
+            sqs.delete_message(QueueUrl=dlq_url, ReceiptHandle=message["ReceiptHandle"])
+            counts["handled"] += 1
+    return counts
+
+
+def print_plan(plan, dry_run):
+    if "skipped" in plan or "error" in plan:
+        print(f"{plan['id']}: not resumed, {plan.get('skipped') or plan.get('error')}")
+        return
+    verb = "would start" if dry_run else "started"
+    print(f"{plan['id']}: {verb} {plan['name']} after {plan['previous']['name']} {plan['previous']['status']}")
+    print(f"  BDA {plan['bda']}, {len(plan['segments_written'])} segments written, "
+          f"pages reviewed: {', '.join(plan['pages_reviewed']) or 'none'}")
+    if plan["reviews_expired"]:
+        print(f"  reviewed again, deltas expired: {', '.join(sorted(plan['reviews_expired']))}")
+
+
+def main():
+    from timeline_report import parse_time
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("resume", "failed"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("--table", default=os.environ.get("checkpoint_table"), help="callback table name")
+        subparser.add_argument("--state-machine-arn", default=os.environ.get("state_machine_arn"),
+                               help=f"default: {STATE_MACHINE_NAME} in the current account and region")
+        subparser.add_argument("--dry-run", action="store_true", help="show the plan without starting anything")
+    subparsers.choices["resume"].add_argument("--id", required=True, help="document id")
+    subparsers.choices["failed"].add_argument("--since", default="24h", help="start of the stop time window (default 24h)")
+    subparsers.choices["failed"].add_argument("--until", help="end of the stop time window (default now)")
+    dlq = subparsers.add_parser("dlq")
+    dlq.add_argument("queue", choices=sorted(QUEUES))
+    dlq.add_argument("--dry-run", action="store_true", help="count or list the messages without moving them")
+    args = parser.parse_args()
+
+    if args.command == "dlq":
+        result = redrive_callbacks(args.dry_run) if args.queue == "callbacks" else redrive_queue(args.queue, args.dry_run)
+        print(json.dumps(result))
+        return
+
+    if not args.table:
+        parser.error("--table is required")
+    state_machine_arn = args.state_machine_arn or default_state_machine_arn()
+    if args.command == "resume":
+        plans = [resume(state_machine_arn, args.table, args.id, args.dry_run)]
+    else:
+        until = parse_time(args.until) if args.until else None
+        plans = resume_failed(state_machine_arn, args.table, parse_time(args.since), until, args.dry_run)
+        if not plans:
+            print("No failed executions in the window")
+    for plan in plans:
+        print_plan(plan, args.dry_run)
+    if any("error" in plan for plan in plans):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
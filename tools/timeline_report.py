@@ -0,0 +1,310 @@
+# /*
+#  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  * SPDX-License-Identifier: MIT-0
+#  *
+#  * Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  * software and associated documentation files (the "Software"), to deal in the Software
+#  * without restriction, including without limitation the rights to use, copy, modify,
+#  * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  * permit persons to whom the Software is furnished to do so.
+#  *
+#  * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  * OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#  */
+
+"""
+Report where the processing time of documents went, from the timeline table.
+
+For one document (--id), every span is listed with its offset from the
+upload, followed by the critical path. For a time window (--since/--until,
+by upload time), the report shows percentiles of every stage and of the
+end-to-end time, the average critical-path breakdown, and the slowest
+documents.
+
+The critical path is the upload and BDA spans followed by the chain of the
+segment that finished last: its confidence check, review queue, slowest
+reviewed page and wrapup. It is walked back from the end of that chain, so
+overlapping spans are only counted once. Time on the path that no span
+covers, such as Step Functions transitions and the stages that record no
+span, is shown as "untracked".
+
+Timelines can be exported with --export and read back with --input, one
+JSON item per line, to analyze them offline.
+
+Usage:
+    python tools/timeline_report.py --table <timeline table> --id <document id>
+    python tools/timeline_report.py --table <timeline table> --since 24h
+    python tools/timeline_report.py --table <timeline table> --since 2025-06-01 --until 2025-06-08 --export week.ndjson
+    python tools/timeline_report.py --input week.ndjson
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "deploy_code", "multipagepdfbda_common", "python"))
+
+from multipagepdfbda_common.timeline import STAGES  # noqa: E402
+
+UNTRACKED = "untracked"
+PERCENTILES = (50, 90, 95, 99)
+
+
+def plain(value):
+    """DynamoDB numbers as int or float, recursively."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    return value
+
+
+def unique_spans(item):
+    """Spans of a timeline item with retried stages counted once, sorted by start."""
+    spans = {}
+    for span in item.get("spans", []):
+        key = (span["stage"], span.get("segment"), span.get("page"), span["start"])
+        # A retry records the same start; its later end is the one that counted
+        if key not in spans or span["end"] > spans[key]["end"]:
+            spans[key] = span
+    return sorted(spans.values(), key=lambda span: (span["start"], span["end"]))
+
+
+def segment_chains(spans):
+    """
+    Spans of each segment, with the document-level spans in every chain.
+
+    review_queue and review spans carry pages, not segments; they are
+    matched through the pages of each segment's confidence span. Spans that
+    cannot be matched are kept in every chain.
+    """
+    page_segments = {}
+    for span in spans:
+        if span["stage"] == "confidence" and "segment" in span:
+            for page in span.get("pages") or ():
+                page_segments[page] = span["segment"]
+
+    shared, by_segment = [], {}
+    for span in spans:
+        if "segment" in span:
+            segment = span["segment"]
+        elif "page" in span:
+            segment = page_segments.get(span["page"])
+        else:
+            segment = next((page_segments[page] for page in span.get("pages") or () if page in page_segments), None)
+        if segment is None:
+            shared.append(span)
+        else:
+            by_segment.setdefault(segment, []).append(span)
+    return [shared + chain for chain in by_segment.values()] or [shared]
+
+
+def critical_path(item):
+    """
+    The spans that held up a document and the time attributed to each stage.
+
+    Returns:
+        (total_ms, breakdown {stage: ms}, path [span]) where the breakdown sums to total_ms
+    """
+    spans = unique_spans(item)
+    if not spans:
+        return 0, {}, []
+    first = min([span["start"] for span in spans] + [item.get("uploaded_at", spans[0]["start"])])
+    total = max(span["end"] for span in spans) - first
+    path = []
+    # The chain of the segment that finished last
+    remaining = max(segment_chains(spans), key=lambda chain: max(span["end"] for span in chain))
+    cursor = max(span["end"] for span in remaining)
+    breakdown = {UNTRACKED: total - (cursor - first)}
+    while True:
+        candidates = [span for span in remaining if span["start"] < cursor]
+        if not candidates:
+            break
+        # A span that overlaps the cursor covers the time up to it
+        span = max(candidates, key=lambda candidate: (min(candidate["end"], cursor), candidate["start"]))
+        remaining.remove(span)
+        if span["end"] < cursor:
+            breakdown[UNTRACKED] += cursor - span["end"]
+            cursor = span["end"]
+        breakdown[span["stage"]] = breakdown.get(span["stage"], 0) + cursor - span["start"]
+        path.append(span)
+        cursor = span["start"]
+    if cursor > first:
+        breakdown[UNTRACKED] += cursor - first
+    if not breakdown[UNTRACKED]:
+        del breakdown[UNTRACKED]
+    path.reverse()
+    return total, breakdown, path
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile q (0-100) of values."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def stage_durations(items):
+    """{stage: [span duration ms]} over all documents, in pipeline order."""
+    durations = {stage: [] for stage in STAGES}
+    for item in items:
+        for span in unique_spans(item):
+            durations.setdefault(span["stage"], []).append(span["end"] - span["start"])
+    return {stage: values for stage, values in durations.items() if values}
+
+
+def format_ms(ms):
+    if ms is None:
+        return "-"
+    if ms < 1000:
+        return f"{ms:.0f}ms"
+    if ms < 120000:
+        return f"{ms / 1000:.1f}s"
+    if ms < 7200000:
+        return f"{ms / 60000:.1f}m"
+    return f"{ms / 3600000:.1f}h"
+
+
+def print_percentiles(title, rows):
+    print(f"\n{title}")
+    header = f"{'':>14} {'count':>7}" + "".join(f" {'p' + str(q):>8}" for q in PERCENTILES) + f" {'max':>8}"
+    print(header)
+    for name, values in rows:
+        cells = "".join(f" {format_ms(percentile(values, q)):>8}" for q in PERCENTILES)
+        print(f"{name:>14} {len(values):>7}{cells} {format_ms(max(values)):>8}")
+
+
+def report_document(item):
+    spans = unique_spans(item)
+    origin = item.get("uploaded_at") or (spans[0]["start"] if spans else 0)
+    print(f"document {item['id']}  key {item.get('key', '-')}")
+    print(f"{'stage':>14} {'offset':>8} {'duration':>9}  detail")
+    for span in spans:
+        detail = {key: value for key, value in span.items() if key not in ("stage", "start", "end")}
+        print(f"{span['stage']:>14} {format_ms(span['start'] - origin):>8} {format_ms(span['end'] - span['start']):>9}  "
+              f"{json.dumps(detail) if detail else ''}")
+    total, breakdown, path = critical_path(item)
+    print(f"\ncritical path, {format_ms(total)} in total:")
+    for span in path:
+        where = f" segment {span['segment']}" if "segment" in span else f" page {span['page']}" if "page" in span else ""
+        print(f"  {span['stage']}{where} {format_ms(span['end'] - span['start'])}")
+    print_breakdown([breakdown], total)
+
+
+def print_breakdown(breakdowns, total):
+    stages = [stage for stage in STAGES + (UNTRACKED,) if any(stage in breakdown for breakdown in breakdowns)]
+    stages += sorted({stage for breakdown in breakdowns for stage in breakdown} - set(stages))
+    print(f"\n{'':>14} {'mean':>8} {'share':>7}")
+    for stage in stages:
+        mean = sum(breakdown.get(stage, 0) for breakdown in breakdowns) / len(breakdowns)
+        share = mean * len(breakdowns) / total if total else 0
+        print(f"{stage:>14} {format_ms(mean):>8} {share:>7.1%}")
+
+
+def report_window(items, slowest):
+    items = [item for item in items if item.get("spans")]
+    if not items:
+        print("No timelines in the window")
+        return
+    paths = [(item, *critical_path(item)) for item in items]
+    print(f"{len(items)} documents")
+    rows = list(stage_durations(items).items())
+    rows.append(("end_to_end", [total for _, total, _, _ in paths]))
+    print_percentiles("span durations", rows)
+
+    print("\ncritical-path breakdown (mean per document)", end="")
+    print_breakdown([breakdown for _, _, breakdown, _ in paths], sum(total for _, total, _, _ in paths))
+
+    print(f"\nslowest {slowest} documents")
+    for item, total, breakdown, _ in sorted(paths, key=lambda path: path[1], reverse=True)[:slowest]:
+        stage, ms = max(breakdown.items(), key=lambda entry: entry[1])
+        print(f"  {item['id']} {format_ms(total):>8}  mostly {stage} ({format_ms(ms)})  {item.get('key', '')}")
+
+
+def parse_time(value):
+    """ISO date or time, or a duration before now such as 90m, 24h or 7d."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    units = {"m": "minutes", "h": "hours", "d": "days"}
+    if value[-1:] in units and value[:-1].replace(".", "", 1).isdigit():
+        return now - datetime.timedelta(**{units[value[-1]]: float(value[:-1])})
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def query_window(table, since, until):
+    """Items uploaded in [since, until), one by_day query per day."""
+    from boto3.dynamodb.conditions import Key
+    items = []
+    day = since.date()
+    while day <= until.date():
+        kwargs = {
+            "IndexName": "by_day",
+            "KeyConditionExpression": Key("day").eq(day.isoformat()) & Key("uploaded_at").between(
+                int(since.timestamp() * 1000), int(until.timestamp() * 1000) - 1),
+        }
+        while True:
+            response = table.query(**kwargs)
+            items.extend(plain(item) for item in response["Items"])
+            if "LastEvaluatedKey" not in response:
+                break
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        day += datetime.timedelta(days=1)
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default=os.environ.get("timeline_table"), help="timeline table name")
+    parser.add_argument("--id", help="report a single document")
+    parser.add_argument("--since", default="24h", help="start of the upload window (default 24h)")
+    parser.add_argument("--until", help="end of the upload window (default now)")
+    parser.add_argument("--input", help="read timelines from an NDJSON file instead of the table")
+    parser.add_argument("--export", help="also write the timelines read to an NDJSON file")
+    parser.add_argument("--slowest", type=int, default=10, help="number of slowest documents listed")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input) as f:
+            items = [json.loads(line) for line in f if line.strip()]
+        if args.id:
+            items = [item for item in items if item["id"] == args.id]
+    else:
+        if not args.table:
+            parser.error("--table or --input is required")
+        import boto3
+        table = boto3.resource("dynamodb").Table(args.table)
+        if args.id:
+            item = table.get_item(Key={"id": args.id}).get("Item")
+            items = [plain(item)] if item else []
+        else:
+            until = parse_time(args.until) if args.until else datetime.datetime.now(datetime.timezone.utc)
+            items = query_window(table, parse_time(args.since), until)
+
+    if args.export:
+        with open(args.export, "w") as f:
+            for item in items:
+                f.write(json.dumps(item) + "\n")
+
+    if args.id:
+        if not items:
+            sys.exit(f"No timeline for document {args.id}")
+        report_document(items[0])
+    else:
+        report_window(items, args.slowest)
+
+
+if __name__ == "__main__":
+    main()